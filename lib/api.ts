@@ -186,7 +186,7 @@ export async function getDashboardAnalytics() {
     const currentMonth = currentDate.getMonth() + 1
 
     const { data: salesData } = await supabase
-      .from("base_data")
+      .from("base_data_live")
       .select("total_quantity")
       .eq("sales_year", currentYear)
       .eq("sales_month", currentMonth)
@@ -230,7 +230,7 @@ export async function getAnalysisHistoricalSales(sku: string) {
     // First, try to find historical sales by SKU or product name in `base_data`.
     // This handles requests like a SKU lookup which should return sales over time.
     const { data: salesData, error: salesError } = await supabase
-      .from("base_data")
+      .from("base_data_live")
       .select("*")
       .or(`product_sku.ilike.%${sku}%,product_name.ilike.%${sku}%`)
       .order("sales_date", { ascending: true })
@@ -335,7 +335,7 @@ export async function getAnalysisBestSellers(year: number, month: number, topN =
     const supabase = getSupabaseClient()
 
     const { data, error } = await supabase
-      .from("base_data")
+      .from("base_data_live")
       .select("product_sku, product_name, total_quantity")
       .eq("sales_year", year)
       .eq("sales_month", month)
@@ -365,7 +365,7 @@ export async function getAnalysisTotalIncome(product_sku = "", category = "") {
   try {
     const supabase = getSupabaseClient()
 
-    let query = supabase.from("base_data").select("product_sku, product_name, total_quantity, sales_year, sales_month")
+    let query = supabase.from("base_data_live").select("product_sku, product_name, total_quantity, sales_year, sales_month")
 
     if (product_sku) {
       query = query.ilike("product_sku", `%${product_sku}%`)
@@ -449,7 +449,7 @@ export async function getAnalysisBaseSKUs(search = "") {
     }
 
     try {
-      let dataQuery = supabase.from("base_data").select("product_sku")
+      let dataQuery = supabase.from("base_data_live").select("product_sku")
       if (search) dataQuery = dataQuery.ilike("product_sku", `%${search}%`)
       const { data: baseData, error: baseError } = await dataQuery
       if (baseError) {
@@ -576,7 +576,7 @@ export async function getAnalysisPerformance(skuList: string[]) {
     const supabase = getSupabaseClient()
 
     const { data, error } = await supabase
-      .from("base_data")
+      .from("base_data_live")
       .select("product_sku, product_name, total_quantity, sales_month")
       .in("product_sku", skuList)
 
@@ -730,7 +730,7 @@ export async function getExistingForecasts() {
   try {
     const supabase = getSupabaseClient()
 
-    const { data, error } = await supabase.from("forecasts").select("*").order("forecast_date", { ascending: true })
+    const { data, error } = await supabase.from("forecasts_live").select("*").order("forecast_date", { ascending: true })
 
     if (error) throw error
 
@@ -785,15 +785,10 @@ export async function trainModel(salesFile: File, productFile?: File) {
     try {
       const supabase = getSupabaseClient()
 
-      // Parse and upload sales file
-      const salesData = await parseExcelFile(salesFile)
-      if (salesData.length > 0) {
-        const { error: salesError } = await supabase
-          .from("base_data")
-          .upsert(salesData, { onConflict: "product_sku,sales_date" })
-
-        if (salesError) throw salesError
-      }
+      // Sales data is not written here: base_data is refreshed as a versioned
+      // snapshot by the backend (replace_table_snapshot), so a direct write
+      // would conflict with its keys and stay invisible in base_data_live.
+      console.log("[v0] Skipping sales upload for", salesFile.name, "- it requires the backend")
 
       // Parse and upload product file if provided
       if (productFile) {
@@ -824,9 +819,9 @@ export async function trainModel(salesFile: File, productFile?: File) {
 
       return {
         data_cleaning: {
-          status: "completed",
-          rows_uploaded: salesData.length,
-          message: "Files uploaded successfully to database",
+          status: "skipped",
+          rows_uploaded: 0,
+          message: "Sales data can only be uploaded while the backend is running",
         },
         ml_training: {
           status: "skipped",
@@ -898,7 +893,39 @@ export async function uploadStockFiles(previousFile?: File | null, currentFile?:
     throw new Error(errMsg)
   }
 
-  return await response.json()
+  const accepted = await response.json()
+  if (!accepted.job_id || accepted.notifications_count !== undefined) {
+    return accepted
+  }
+  return await waitForJob(accepted.job_id)
+}
+
+/**
+ * Poll a backend job (/jobs/{id}) until it finishes and return its result.
+ * Upload processing runs in the background so the request never hits proxy timeouts.
+ * Gives up with an error once the job has not finished within timeoutMs.
+ */
+export async function waitForJob(jobId: string, intervalMs = 1000, timeoutMs = 15 * 60 * 1000) {
+  const API_BASE_URL_LOCAL = process.env.NEXT_PUBLIC_API_URL || API_BASE_URL
+  const deadline = Date.now() + timeoutMs
+
+  while (true) {
+    const response = await fetch(`${API_BASE_URL_LOCAL}/jobs/${jobId}`)
+    if (!response.ok) {
+      throw new Error(`Failed to fetch job status: ${response.status}`)
+    }
+    const job = await response.json()
+    if (job.status === "succeeded") {
+      return job.result
+    }
+    if (job.status === "failed") {
+      throw new Error(job.error || "Upload failed")
+    }
+    if (Date.now() + intervalMs > deadline) {
+      throw new Error(`Timed out waiting for job ${jobId} after ${Math.round(timeoutMs / 1000)}s (last status: ${job.status})`)
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervalMs))
+  }
 }
 
 // Helper function to parse Excel files
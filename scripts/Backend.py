@@ -5,45 +5,47 @@ from typing import Optional, List
 from datetime import datetime
 import os
 import pandas as pd
+import numpy as np
 import io
+import tempfile
+import hashlib
+import asyncio
 import uvicorn
-from DB_server import supabase, execute_query, insert_data, update_data, delete_data
+from DB_server import (
+    supabase, execute_query, read_table, replace_table_snapshot, cache_stats, metrics_snapshot, warm_up_db_pool, pool_settings,
+    SUPABASE_AVAILABLE, DB_AVAILABLE, DB_BACKEND, execute_query_async, read_table_async, count_rows_async, update_data_async,
+    delete_data_async, apply_table_diff_async, read_rows_async, upsert_data_async
+)
+from starlette.concurrency import run_in_threadpool
 import sys
 import time
 import joblib
 from dotenv import load_dotenv
-from supabase import create_client, Client
-import os
 from fastapi import BackgroundTasks
 import signal # Import signal for alarm
 
 # Load environment variables
 load_dotenv()
 
-try:
-    supabase_url = os.getenv("SUPABASE_URL")
-    supabase_key = os.getenv("SUPABASE_KEY")
-    
-    if supabase_url and supabase_key:
-        supabase: Client = create_client(supabase_url, supabase_key)
-        print("✅ Supabase client initialized successfully")
-        SUPABASE_AVAILABLE = True
-    else:
-        supabase = None
-        print("⚠️  Supabase credentials not found. Database features will be disabled.")
-        print("   Set SUPABASE_URL and SUPABASE_KEY environment variables to enable database.")
-        SUPABASE_AVAILABLE = False
-except Exception as e:
-    supabase = None
-    SUPABASE_AVAILABLE = False
-    print(f"⚠️  Failed to initialize Supabase client: {str(e)}")
-    print("   Database features will be disabled.")
-
 # Import local modules
 from Auto_cleaning import auto_cleaning
 engine = None  # Deprecated: use Supabase client functions instead
 from Predict import update_model_and_train, forcast_loop, Evaluate
-from Notification import generate_stock_report, update_manual_values
+from Notification import (
+    generate_stock_report, update_manual_values, recompute_manual_values,
+    get_notifications as query_notifications, get_notification_detail
+)
+from consumption import recent_history
+from restock_rules import get_rules
+from job_tracker import jobs
+import manual_overrides
+import upload_fingerprints
+from stock_history import (
+    record_stock_snapshot, record_stock_snapshots, read_stock_history, find_history_skus, latest_snapshot_date
+)
+from stock_files import (
+    load_file_with_fallback, ensure_sku_column, normalize_stock_frame, parse_stock_files, snapshot_date_from_name
+)
 
 # Initialize FastAPI app
 app = FastAPI(title="Lon TukTak Stock Management API")
@@ -91,6 +93,10 @@ async def startup_event():
     print("="*80, flush=True)
     print(f"✅ Backend loaded from: {__file__}")
     print(f"✅ Database engine available: {engine is not None}")
+    if SUPABASE_AVAILABLE and DB_BACKEND == "supabase":
+        await run_in_threadpool(warm_up_db_pool)
+    if DB_AVAILABLE:
+        await run_in_threadpool(manual_overrides.load)
     print("="*80 + "\n", flush=True)
     sys.stdout.flush()
 
@@ -104,12 +110,29 @@ async def health_check():
     health_status = {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "database": "connected" if SUPABASE_AVAILABLE else "not configured",
+        "database": "connected" if DB_AVAILABLE else "not configured",
+        "database_backend": DB_BACKEND,
+        "query_cache": cache_stats(),
+        "connection_pool": pool_settings(),
         "supabase_url_set": bool(os.getenv("SUPABASE_URL")),
         "supabase_key_set": bool(os.getenv("SUPABASE_KEY"))
     }
     return health_status
 
+@app.get("/metrics")
+async def get_metrics(reset: bool = Query(False, description="Clear the histograms after reading them")):
+    """
+    DB call metrics: latency, rows, bytes and retries per (operation, table),
+    slowest first. Round trips are labelled select/count/insert/upsert/update/
+    delete/sql/copy; whole calls by their DB_server function name.
+    """
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "database_backend": DB_BACKEND,
+        "query_cache": cache_stats(),
+        "db": metrics_snapshot(reset),
+    }
+
 @app.get("/api/test")
 async def test_endpoint():
     """Simple test endpoint"""
@@ -139,19 +162,19 @@ async def test_database():
     try:
         # Test 1: Simple connection test
         print("Test 1: Testing Supabase connection...", flush=True)
-        test_df = execute_query("SELECT * FROM stock_notifications LIMIT 1")
+        test_df = await execute_query_async("SELECT * FROM stock_notifications LIMIT 1")
         result["connection_test"] = not test_df.empty
         print("✅ Supabase connection successful", flush=True)
         # Test 2: Check if table exists (if query returned data or not)
         result["table_exists"] = True
-        # Test 3: Count rows
-        count_df = execute_query("SELECT * FROM stock_notifications")
-        result["row_count"] = len(count_df)
+        # Test 3: Count rows (head-only request, no rows transferred)
+        result["row_count"] = await count_rows_async("stock_notifications")
         # Test 4: Get column names
-        result["columns"] = list(count_df.columns)
+        sample_df = await execute_query_async("SELECT * FROM stock_notifications LIMIT 3")
+        result["columns"] = list(sample_df.columns)
         # Test 5: Get sample data
-        if not count_df.empty:
-            sample_records = count_df.head(3).to_dict('records')
+        if not sample_df.empty:
+            sample_records = sample_df.to_dict('records')
             for record in sample_records:
                 for key, value in record.items():
                     if pd.notna(value) and isinstance(value, (pd.Timestamp, datetime)):
@@ -171,164 +194,205 @@ async def test_database():
 # NOTIFICATIONS ENDPOINTS
 # ============================================================================
 
+def _query_values(value: Optional[str]) -> Optional[list]:
+    """Comma-separated query parameter -> list of values (None when absent)"""
+    if value is None:
+        return None
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
 @app.get("/api/notifications")
-async def get_notifications():
-    """Get inventory notifications from stock_notifications table"""
-    print("\n" + "="*80, flush=True)
-    print("NOTIFICATIONS ENDPOINT CALLED", flush=True)
-    print("="*80, flush=True)
-    sys.stdout.flush()
-    
-    if not SUPABASE_AVAILABLE:
-        print("⚠️  Supabase not available, returning empty notifications", flush=True)
-        return []
-    
+async def get_notifications(
+    status: Optional[str] = Query(None, description="Comma-separated statuses, e.g. Red,Yellow"),
+    category: Optional[str] = Query(None, description="Comma-separated categories"),
+    flag: Optional[str] = Query(None, description="Comma-separated flags"),
+    sort: str = Query('product_sku', description="product_sku, decrease_rate or weeks_to_empty"),
+    order: str = Query('asc', pattern='^(asc|desc)$'),
+    limit: Optional[int] = Query(None, ge=1, description="Page size (NOTIFICATIONS_MAX_PAGE_SIZE at most)"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+):
+    """
+    Get one page of inventory notifications from stock_notifications.
+    Filters, sorting and cursor pagination are evaluated by the database;
+    follow next_cursor until has_more is false to walk the whole list.
+    """
+    print(f"[Backend] Notifications query: status={status} category={category} flag={flag} "
+          f"sort={sort} {order} limit={limit} cursor={'yes' if cursor else 'no'}", flush=True)
+
+    if not DB_AVAILABLE:
+        print("⚠️  Database not available, returning empty notifications", flush=True)
+        return {"items": [], "next_cursor": None, "has_more": False}
+
     try:
-        print("Supabase client: fetching notifications...", flush=True)
-        df = execute_query("SELECT * FROM stock_notifications")
-        if df.empty:
-            return []
-        notifications = df.to_dict('records')
-        for notification in notifications:
-            for key, value in notification.items():
-                if pd.notna(value) and isinstance(value, (pd.Timestamp, datetime)):
-                    notification[key] = str(value)
-        return notifications
-    except Exception as e:
-        print(f"ERROR in get_notifications: {str(e)}", flush=True)
-        import traceback
-        traceback.print_exc()
-        sys.stdout.flush()
-        return []
+        return await run_in_threadpool(
+            query_notifications,
+            status=_query_values(status), category=_query_values(category), flag=_query_values(flag),
+            sort=sort, descending=order == 'desc', limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        print(f"[Backend] ❌ Notifications query failed: {str(e)}", flush=True)
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.get("/api/notifications/{product_sku}")
+async def get_notification(product_sku: str):
+    """Get the notification of one SKU"""
+    if not DB_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Database not available")
+    try:
+        notification = await run_in_threadpool(get_notification_detail, product_sku)
+    except RuntimeError as e:
+        print(f"[Backend] ❌ Notification lookup failed: {str(e)}", flush=True)
+        raise HTTPException(status_code=503, detail=str(e))
+    if notification is None:
+        raise HTTPException(status_code=404, detail=f"No notification for SKU {product_sku}")
+    return notification
 
 @app.get("/notifications/check_base_stock")
 async def check_base_stock():
     """Check if base_stock table exists and has data"""
     try:
         print("[Backend] Checking base_stock table...")
-        df = execute_query("SELECT * FROM base_stock")
-        count = len(df)
+        count = await count_rows_async("base_stock")
         print(f"[Backend] base_stock exists with {count} rows")
         return {"exists": count > 0, "count": count}
     except Exception as e:
         print(f"[Backend] base_stock table doesn't exist or error: {str(e)}")
         return {"exists": False, "count": 0}
 
-# --- Helper to load files with fallback headers ---
-def load_file_with_fallback(file_content, possible_headers=[0,1,2,3]):
+# Uploads are spooled to disk in chunks and rejected above this size
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+
+
+async def spool_upload(upload: UploadFile, max_bytes: int = None) -> tuple:
     """
-    Try to load Excel/CSV file with multiple header row attempts.
-    Returns (DataFrame, header_row_used)
+    Stream an upload to a temporary file in UPLOAD_CHUNK_BYTES chunks, so at
+    most one chunk is held in memory, hashing the content on the way.
+    The file keeps the upload's extension; the caller removes it when done.
+    Returns (path, sha256 hex digest).
+    Raises HTTP 413 once the upload exceeds max_bytes (MAX_UPLOAD_MB).
     """
-    column_mapping = {
-        # SKU columns
-        "รหัสสินค้า": "Product_SKU",
-        "เลขอ้างอิง SKU (SKU Reference No.)": "Product_SKU",
-        "Product_SKU": "Product_SKU",
-        "SKU": "Product_SKU",
-        "รหัส": "Product_SKU",
-        "Code": "Product_SKU",
-        
-        # Product name columns
-        "ชื่อสินค้า": "product_name",
-        "สินค้า": "product_name",
-        "Product Name": "product_name",
-        "Name": "product_name",
-        
-        # Stock level columns
-        "จำนวนคงเหลือ": "stock_level",
-        "จำนวน": "stock_level",
-        "Stock": "stock_level",
-        "Quantity": "stock_level",
-        
-        # Category columns
-        "หมวดหมู่": "category",
-        "Category": "category",
-        "ประเภท": "category"
-    }
-    
-    errors = []
-    
-    def clean_and_map_columns(df):
-        # Drop the index column if it exists
-        if '#' in df.columns:
-            df = df.drop('#', axis=1)
-        if 'Unnamed: 0' in df.columns:
-            df = df.drop('Unnamed: 0', axis=1)
-            
-        # Clean column names
-        df.columns = df.columns.str.strip()
-        
-        # Map columns using our mapping dictionary
-        for old_col, new_col in column_mapping.items():
-            if old_col in df.columns:
-                df = df.rename(columns={old_col: new_col})
-                
-        # Convert stock_level to numeric
-        if 'stock_level' in df.columns:
-            df['stock_level'] = pd.to_numeric(df['stock_level'], errors='coerce').fillna(0).astype(int)
-            
-        return df
-    
-    # Try Excel format first
-    for h in possible_headers:
+    max_bytes = max_bytes or MAX_UPLOAD_BYTES
+    suffix = os.path.splitext(upload.filename or '')[1].lower() or '.xlsx'
+    size = 0
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(mode='wb', delete=False, prefix='upload_', suffix=suffix) as spool:
+        path = spool.name
         try:
-            df = pd.read_excel(file_content, header=h)
-            df = clean_and_map_columns(df)
-            
-            # Verify required columns exist
-            if 'Product_SKU' in df.columns:
-                print(f"✓ Found Excel with header row {h}")
-                return df, h
-                
-            errors.append(f"Excel header={h}: No SKU column found")
-        except Exception as e:
-            errors.append(f"Excel header={h}: {str(e)}")
-    
-    # Try CSV with different encodings
-    encodings = ['utf-8', 'utf-8-sig', 'cp874', 'tis-620']
-    for encoding in encodings:
-        for h in possible_headers:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"{upload.filename} exceeds the {max_bytes // (1024 * 1024)} MB upload limit"
+                    )
+                spool.write(chunk)
+                digest.update(chunk)
+        except BaseException:
+            spool.close()
+            os.unlink(path)
+            raise
+    print(f"[Backend] Spooled {upload.filename} ({size / (1024 * 1024):.1f} MB) to {path}")
+    return path, digest.hexdigest()
+
+
+def remove_spooled(*paths):
+    """Delete spooled uploads, plus the .csv copies auto_cleaning writes next to Excel files"""
+    for path in paths:
+        if not path:
+            continue
+        for candidate in {path, os.path.splitext(path)[0] + '.csv'}:
             try:
-                if isinstance(file_content, bytes):
-                    content = file_content.decode(encoding)
-                else:
-                    content = file_content
-                
-                df = pd.read_csv(io.StringIO(content), header=h)
-                df = clean_and_map_columns(df)
-                
-                if 'Product_SKU' in df.columns:
-                    print(f"✓ Found CSV with encoding {encoding}, header row {h}")
-                    return df, h
-                    
-                errors.append(f"CSV {encoding} header={h}: No SKU column found")
-            except Exception as e:
-                errors.append(f"CSV {encoding} header={h}: {str(e)}")
-    
-    error_msg = "❌ Could not load file as Excel or CSV. Tried:\n" + "\n".join(errors)
-    raise ValueError(error_msg)
+                os.unlink(candidate)
+            except FileNotFoundError:
+                pass
 
-@app.post("/notifications/upload")
-async def upload_stock_files(
-    previous_stock: Optional[UploadFile] = File(None),
-    current_stock: UploadFile = File(...)
-):
-    """Upload stock files and generate notifications"""
-    try:
-        print("[Backend] Processing stock upload...")
-        
-        if not SUPABASE_AVAILABLE:
-            print("[Backend] ⚠️ Supabase not available")
-            raise HTTPException(
-                status_code=503,
-                detail="Database not available. Please check Supabase configuration."
-            )
-        
-        # Read current stock file with fallback headers
-        current_content = await current_stock.read()
+def compute_stock_flags(report_df, df_prev=None):
+    """
+    Flag state machine for every SKU in the report, vectorized:
+      stock unchanged -> unchanged_counter + 1, 'inactive' once it reaches 4
+                         (otherwise the previous flag is kept)
+      stock decreased -> counter reset, 'active'
+      stock increased -> counter reset, 'just added stock'
+    Previous counter/flag come from df_prev (the base_stock snapshot) joined
+    on product_sku; SKUs without history start at 0 / 'stage'.
+    Returns (unchanged_counter, flag) arrays aligned with report_df.
+    """
+    skus = report_df['product_sku']
+    prev_counter = pd.Series(0, index=report_df.index)
+    prev_flag = pd.Series('stage', index=report_df.index, dtype=object)
+    if df_prev is not None and not df_prev.empty:
+        prev = df_prev.drop_duplicates('product_sku', keep='first').set_index('product_sku')
+        if 'unchanged_counter' in prev.columns:
+            prev_counter = skus.map(prev['unchanged_counter']).fillna(0).astype(int)
+        if 'flag' in prev.columns:
+            prev_flag = skus.map(prev['flag']).fillna('stage').astype(object)
+
+    current = report_df['stock_level']
+    last = report_df['last_stock']
+    unchanged = (current == last).to_numpy()
+    decreased = (current < last).to_numpy()
+
+    counters = np.where(unchanged, prev_counter.to_numpy() + 1, 0)
+    flags = np.select(
+        [unchanged & (counters >= 4), unchanged, decreased],
+        ['inactive', prev_flag.to_numpy(), 'active'],
+        default='just added stock',
+    )
+    return counters, flags
+
+
+def chain_stock_states(frames: list, df_base=None) -> list:
+    """
+    Replay consecutive stock snapshots (oldest first) the way successive
+    uploads would: each frame's last_stock is the stock in the state before
+    it and compute_stock_flags carries counters/flags forward, vectorized
+    over all SKUs of a week. df_base is the current base_stock; without it
+    the first frame starts every SKU at 0 / 'stage'.
+    Returns the base_stock frame after each snapshot.
+    """
+    states = []
+    prev = df_base if df_base is not None and not df_base.empty else None
+    for frame in frames:
+        state = frame[['product_name', 'product_sku', 'stock_level', 'category']].copy()
+        if prev is None:
+            state['unchanged_counter'] = 0
+            state['flag'] = 'stage'
+        else:
+            last = prev.drop_duplicates('product_sku', keep='last').set_index('product_sku')['stock_level']
+            state['last_stock'] = state['product_sku'].map(last).fillna(state['stock_level'])
+            counters, flags = compute_stock_flags(state, prev)
+            state = state.drop(columns=['last_stock'])
+            state['unchanged_counter'] = counters.astype(int)
+            state['flag'] = flags
+        states.append(state)
+        prev = state
+    return states
+# Upload jobs rewrite base_stock from a diff against its current contents,
+# so they run one at a time
+upload_job_lock = asyncio.Lock()
+
+
+async def process_stock_upload(job, current_path: str, prev_path: str = None, snapshot_date: str = None) -> dict:
+    """
+    Upload pipeline run by upload jobs, recorded as stages:
+      parse  - load the current (and, on first upload, previous) stock file
+      report - generate the stock report (notifications)
+      diff   - compute flags/counters and the new base_stock frame
+      write  - sync stock_notifications and base_stock through table diffs
+    snapshot_date (ISO) is the week the current file describes; it dates the
+    stock_history entry and bounds the consumption window (today when None).
+    Raises HTTPException with the status the request would have returned.
+    """
+    with job.stage('parse') as stage:
         try:
-            df_curr, header_row = load_file_with_fallback(io.BytesIO(current_content))
+            df_curr, header_row = await run_in_threadpool(load_file_with_fallback, current_path)
             print(f"[Backend] Current stock loaded (header={header_row}): {len(df_curr)} rows")
             
             # Validate required columns exist
@@ -352,65 +416,41 @@ async def upload_stock_files(
         # Check if base_stock exists
         base_stock_exists = False
         df_prev = None
+        base_snapshot = None
         
-        try:
-            df_prev = execute_query("SELECT * FROM base_stock")
-            if not df_prev.empty:
-                base_stock_exists = True
-                print(f"[Backend] Loaded previous stock from database: {len(df_prev)} rows")
-        except Exception as e:
-            print(f"[Backend] base_stock table doesn't exist or error during read: {str(e)}")
+        df_prev = await read_table_async("SELECT * FROM base_stock")
+        if df_prev is None:
+            # Treating a failed read as an empty base_stock would start the chain over
+            raise HTTPException(status_code=503, detail="Could not read base_stock; try the upload again")
+        if not df_prev.empty:
+            base_stock_exists = True
+            base_snapshot = df_prev.copy()
+            print(f"[Backend] Loaded previous stock from database: {len(df_prev)} rows")
         
         # If base_stock doesn't exist, require previous stock file
         if not base_stock_exists:
-            if not previous_stock:
+            if not prev_path:
                 raise HTTPException(
                     status_code=400,
                     detail="Previous stock file is required for first upload"
                 )
-            prev_content = await previous_stock.read()
             try:
-                df_prev, header_row = load_file_with_fallback(io.BytesIO(prev_content))
+                df_prev, header_row = await run_in_threadpool(load_file_with_fallback, prev_path)
                 print(f"[Backend] Previous stock loaded (header={header_row}): {len(df_prev)} rows")
             except Exception as e:
                 print(f"[Backend] Failed to load previous stock file: {str(e)}")
                 raise HTTPException(status_code=400, detail=str(e))
         
-        # Rename columns in current stock data
-        df_curr = df_curr.rename(columns={
-            'ชื่อสินค้า': 'product_name',
-            'รหัสสินค้า': 'product_sku',
-            'จำนวนคงเหลือ': 'stock_level',
-            'จำนวน': 'stock_level',
-            'หมวดหมู่': 'category',
-            "หมวดหมู่ย่อย" : 'category'
-        })
-        
-        # Rename columns in previous stock data
-        if df_prev is not None:
-            df_prev = df_prev.rename(columns={
-                'ชื่อสินค้า': 'product_name',
-                'รหัสสินค้า': 'product_sku',
-                'จำนวนคงเหลือ': 'stock_level',
-                'จำนวน': 'stock_level',
-                'หมวดหมู่': 'category',
-                "หมวดหมู่ย่อย" : 'category' 
-            })
-        df_curr["stock_level"] = pd.to_numeric(df_curr["stock_level"], errors='coerce').fillna(0).astype(int)
+        df_curr = normalize_stock_frame(df_curr)
         if df_prev is not None:
-            df_prev["stock_level"] = pd.to_numeric(df_prev["stock_level"], errors='coerce').fillna(0).astype(int)
-        # Normalize column names (handle upper/lowercase automatically)
-        df_curr.columns = df_curr.columns.str.strip().str.lower()
-        if df_prev is not None:
-            df_prev.columns = df_prev.columns.str.strip().str.lower()
+            df_prev = normalize_stock_frame(df_prev)
         print("[Debug] df_curr columns:", df_curr.columns.tolist())
-        df_curr = df_curr.dropna(subset=['product_sku','category'])
-        if df_prev is not None:
-            df_prev = df_prev.dropna(subset=['product_sku','category'])
+        stage['rows'] = len(df_curr)
+        stage['previous_rows'] = len(df_prev) if df_prev is not None else 0
+        stage['previous_source'] = 'base_stock' if base_stock_exists else 'file'
+
+    with job.stage('report') as stage:
         try:
-            # Save current stock data to Supabase
-            print("[Backend] Saving current stock data to Supabase...")
-            
             # Ensure required columns exist and have correct names
             required_columns = {
                 'product_sku': 'product_sku',
@@ -443,68 +483,13 @@ async def upload_stock_files(
             df_curr['flag'] = 'stage'
             
             print(f"[Backend] Columns being saved: {df_curr.columns.tolist()}")
-            df_curr_dict = df_curr.to_dict(orient='records')
-            # Clear and insert into base_stock (raw current stock)
-            delete_data('base_stock', 'product_sku', '*')  # '*' means all
-            res_base = insert_data('base_stock', df_curr_dict)
-            if res_base is None:
-                print("[Backend] ❌ insert_data returned None for base_stock")
-                raise HTTPException(status_code=500, detail="Failed to insert base_stock records")
-            print(f"[Backend] ✓ Saved {len(df_curr_dict)} records to base_stock (raw upload)")
 
             # Generate stock report (notifications)
             print("[Backend] Generating stock report...")
 
-            # Normalize column names to expected keys so generate_stock_report doesn't KeyError
-            def ensure_sku_column(df):
-                # make a copy to avoid modifying original
-                df = df.copy()
-                cols = {str(c): c for c in df.columns}
-                # find SKU-like column (case-insensitive)
-                sku_col = None
-                for c in cols:
-                    if 'sku' in c.lower():
-                        sku_col = cols[c]
-                        break
-                if sku_col is not None and str(sku_col) != 'product_sku':
-                    df = df.rename(columns={sku_col: 'product_sku'})
-                # product name
-                name_col = None
-                for c in cols:
-                    if 'product' in c.lower() and 'name' in c.lower():
-                        name_col = cols[c]
-                        break
-                if name_col is not None and str(name_col) != 'product_name':
-                    df = df.rename(columns={name_col: 'product_name'})
-                # stock level
-                stock_col = None
-                for c in cols:
-                    if 'stock' in c.lower() or c.lower() == 'จำนวน' or 'quantity' in c.lower():
-                        stock_col = cols[c]
-                        break
-                if stock_col is not None and str(stock_col) != 'stock_level':
-                    df = df.rename(columns={stock_col: 'stock_level'})
-                # category
-                cat_col = None
-                for c in cols:
-                    if 'หมวด' in c or 'category' in c.lower():
-                        cat_col = cols[c]
-                        break
-                if cat_col is not None and str(cat_col) != 'category':
-                    df = df.rename(columns={cat_col: 'category'})
-                return df
-
             # Log columns for debugging
-            try:
-                prev_cols = list(df_prev.columns) if (df_prev is not None and hasattr(df_prev, 'columns')) else None
-            except Exception:
-                prev_cols = None
-            try:
-                curr_cols = list(df_curr.columns) if (df_curr is not None and hasattr(df_curr, 'columns')) else None
-            except Exception:
-                curr_cols = None
-            print(f"[Backend] df_prev columns: {prev_cols}")
-            print(f"[Backend] df_curr columns: {curr_cols}")
+            print(f"[Backend] df_prev columns: {list(df_prev.columns) if df_prev is not None else None}")
+            print(f"[Backend] df_curr columns: {list(df_curr.columns)}")
 
             try:
                 df_prev = ensure_sku_column(df_prev) if df_prev is not None else df_prev
@@ -513,20 +498,15 @@ async def upload_stock_files(
                 print(f"[Backend] Warning: failed to normalize columns: {e}")
 
             # Show a small sample for debugging
-            try:
-                print("[Backend] df_curr sample:")
-                print(df_curr.head(3).to_dict(orient='records'))
-            except Exception:
-                pass
-
-            try:
+            print("[Backend] df_curr sample:")
+            print(df_curr.head(3).to_dict(orient='records'))
+            if df_prev is not None:
                 print("[Backend] df_prev sample:")
-                if df_prev is not None:
-                    print(df_prev.head(3).to_dict(orient='records'))
-            except Exception:
-                pass
+                print(df_prev.head(3).to_dict(orient='records'))
 
-            report_df = generate_stock_report(df_prev, df_curr)
+            # base_stock is the latest history snapshot, so the history window ends with df_prev
+            history = await run_in_threadpool(recent_history, None, snapshot_date) if base_stock_exists else None
+            report_df = await run_in_threadpool(generate_stock_report, df_prev, df_curr, None, history)
             print(f"[Backend] Report generated: {len(report_df)} items")
 
             # Convert report columns to lowercase to match database
@@ -545,107 +525,408 @@ async def upload_stock_files(
             # Rename columns to match the database schema
             report_df = report_df.rename(columns=column_mapping)
 
-            # Save report to stock_notifications
+            # Notifications are stored as freshly staged rows
             report_df['unchanged_counter'] = 0
             report_df['flag'] = 'stage'
             report_df['created_at'] = now
             report_df['updated_at'] = now
-            report_dict = report_df.to_dict(orient='records')
-            delete_data('stock_notifications', 'product_sku', '*')
-
-            # Log sample record before insertion
-            if report_dict:
-                print("[Backend] Sample record before insertion:")
-                for k, v in report_dict[0].items():
-                    print(f"  {k}: {type(v)} = {v}")
-
-            res_notif = insert_data('stock_notifications', report_dict)
-            if res_notif is None:
-                print("[Backend] ❌ insert_data returned None for stock_notifications")
-                raise HTTPException(status_code=500, detail="Failed to insert stock_notifications records")
-            print(f"[Backend] ✓ Saved {len(report_dict)} notifications to stock_notifications")
-
-            # Note: base_stock will be updated later after flags/counters are calculated
 
         except Exception as e:
-            print(f"[Backend] ❌ Failed to save to Supabase: {str(e)}")
+            print(f"[Backend] ❌ Failed to generate stock report: {str(e)}")
             import traceback
             traceback.print_exc()
-            raise HTTPException(
-                status_code=500,
-                detail=f"Failed to save data to Supabase: {str(e)}"
-            )
-        
+            raise HTTPException(status_code=500, detail=f"Failed to generate stock report: {str(e)}")
+        stage['rows'] = len(report_df)
+
+    with job.stage('diff') as stage:
         # Calculate flags based on stock changes
         print("[Backend] Calculating stock flags...")
-        for idx, row in report_df.iterrows():
-            product_sku = row.get('product_sku', '')  # Using lowercase column names
-            current_stock_level = row.get('stock_level', 0)
-            last_stock_level = row.get('last_stock', 0)
-            
-            # Get previous counter and flag from base_stock if exists
-            prev_counter = 0
-            prev_flag = 'stage'
-            
-            if base_stock_exists and df_prev is not None and not df_prev.empty:
-                prev_row = df_prev[df_prev['product_sku'] == product_sku]
-                if not prev_row.empty:
-                    prev_counter = prev_row.iloc[0].get('unchanged_counter', 0)
-                    prev_flag = prev_row.iloc[0].get('flag', 'stage')
-            
-            # Apply flag logic
-            if current_stock_level == last_stock_level:
-                new_counter = prev_counter + 1
-                new_flag = 'inactive' if new_counter >= 4 else prev_flag
-            elif current_stock_level < last_stock_level:
-                new_counter = 0
-                new_flag = 'active'
-            else:  # current_stock_level > last_stock_level
-                new_counter = 0
-                new_flag = 'just added stock'
-            
-            report_df.at[idx, 'unchanged_counter'] = new_counter
-            report_df.at[idx, 'flag'] = new_flag
+        counters, flags = compute_stock_flags(report_df, df_prev if base_stock_exists else None)
+        flagged = pd.DataFrame({'product_sku': report_df['product_sku'], 'unchanged_counter': counters, 'flag': flags})
         
-        # Save to Supabase (already done above)
+        # Build base_stock_df with proper alignment
+        latest = flagged.drop_duplicates('product_sku', keep='last').set_index('product_sku')
+        base_stock_df = df_curr[['product_name', 'product_sku', 'stock_level', 'category']].copy()
+        base_stock_df['unchanged_counter'] = base_stock_df['product_sku'].map(latest['unchanged_counter']).fillna(0).astype(int)
+        base_stock_df['flag'] = base_stock_df['product_sku'].map(latest['flag']).fillna('stage')
+        base_stock_df['updated_at'] = datetime.now()
+        stage['rows'] = len(base_stock_df)
+        stage['flags'] = {str(k): int(v) for k, v in base_stock_df['flag'].value_counts().items()}
+
+    with job.stage('write') as stage:
+        # Log sample record before writing
+        if not report_df.empty:
+            print("[Backend] Sample record before write:")
+            for k, v in report_df.iloc[0].to_dict().items():
+                print(f"  {k}: {type(v)} = {v}")
+
+        # Only send new/changed notifications and delete SKUs that disappeared
+        res_notif = await apply_table_diff_async('stock_notifications', report_df)
+        if res_notif is None:
+            print("[Backend] ❌ apply_table_diff failed for stock_notifications")
+            raise HTTPException(status_code=500, detail="Failed to write stock_notifications records")
+        print(f"[Backend] ✓ Synced {len(report_df)} notifications to stock_notifications: {res_notif}")
         
         print("[Backend] Updating base_stock table...")
         
-        flag_map = dict(zip(report_df['product_sku'], report_df['flag']))
-        counter_map = dict(zip(report_df['product_sku'], report_df['unchanged_counter']))
-        
-        # Build base_stock_df with proper alignment
-        base_stock_data = []
-        for idx, row in df_curr.iterrows():
-            product_sku = row.get('product_sku', '')
-            base_stock_data.append({
-                'product_name': row.get('product_name', ''),
-                'product_sku': product_sku,
-                'stock_level': row.get('stock_level', 0),
-                'category': row.get('category', ''),  # Changed from 'หมวดหมู่' to match schema
-                'unchanged_counter': counter_map.get(product_sku, 0),
-                'flag': flag_map.get(product_sku, 'stage'),
-                'updated_at': datetime.now()
-            })
-        
-        base_stock_df = pd.DataFrame(base_stock_data)
-        
-        # Clear and insert new data into base_stock
-        delete_data('base_stock', 'product_sku', '*')
-        insert_data('base_stock', base_stock_df.to_dict(orient='records'))
-        
-        print("[Backend] ✅ Upload completed successfully")
-        return {
-            "success": True,
-            "message": "Stock files processed successfully",
-            "notifications_count": len(report_df)
-        }
-        
+        # Write only the rows that changed since the previous snapshot
+        res_base = await apply_table_diff_async('base_stock', base_stock_df, base_snapshot)
+        if res_base is None:
+            raise HTTPException(status_code=500, detail="Failed to write base_stock records")
+        print(f"[Backend] ✓ Synced base_stock: {res_base}")
+        stage['rows'] = sum(res_notif[k] + res_base[k] for k in ('inserted', 'updated', 'deleted'))
+        stage['stock_notifications'] = res_notif
+        stage['base_stock'] = res_base
+
+        # History is append-only and secondary: a failure is reported, not fatal
+        res_history = await run_in_threadpool(record_stock_snapshot, base_stock_df, base_snapshot, snapshot_date)
+        if res_history is None:
+            print("[Backend] ⚠️ Failed to record stock history snapshot")
+        stage['stock_history'] = res_history
+
+    print("[Backend] ✅ Upload completed successfully")
+    return {
+        "success": True,
+        "message": "Stock files processed successfully",
+        "notifications_count": len(report_df)
+    }
+
+
+async def run_upload_job(job, current_path: str, prev_path: str = None, fingerprint: str = None, files: dict = None,
+                         snapshot_date: str = None):
+    """Run process_stock_upload for a job, record the outcome and remove the spooled files.
+    Successful outcomes are stored under the upload's fingerprint for deduplication."""
+    try:
+        async with upload_job_lock:
+            job.start()
+            result = await process_stock_upload(job, current_path, prev_path, snapshot_date)
+        job.succeed(result)
+        if fingerprint:
+            await run_in_threadpool(upload_fingerprints.record, 'stock_upload', fingerprint, files, result, job.id)
+    except HTTPException as e:
+        job.fail(str(e.detail), e.status_code)
     except Exception as e:
-        print(f"[Backend] ❌ Error in upload: {str(e)}")
+        print(f"[Backend] ❌ Error in upload job {job.id}: {str(e)}")
         import traceback
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+        job.fail(str(e))
+    finally:
+        remove_spooled(current_path, prev_path)
+        if fingerprint:
+            upload_fingerprints.release(fingerprint, job.id)
+    return job
+
+
+@app.post("/notifications/upload")
+async def upload_stock_files(
+    background_tasks: BackgroundTasks,
+    previous_stock: Optional[UploadFile] = File(None),
+    current_stock: UploadFile = File(...),
+    wait: bool = Query(False, description="Process inside the request and return the final result"),
+    force: bool = Query(False, description="Reprocess even if the same files were just processed"),
+    snapshot_date: Optional[str] = Query(None, description="Week the current file describes (YYYY-MM-DD); defaults to the date in its file name, else today")
+):
+    """
+    Upload stock files and generate notifications.
+    The files are spooled to disk and processed by a background job; the
+    response carries a job_id to poll at /jobs/{job_id}. With wait=true the
+    upload is processed inside the request as before.
+    Re-uploading the files of the latest successful upload returns its
+    result without reprocessing, unless force=true.
+    """
+    print("[Backend] Processing stock upload...")
+    
+    if not DB_AVAILABLE:
+        print("[Backend] ⚠️ Database not available")
+        raise HTTPException(
+            status_code=503,
+            detail="Database not available. Please check Supabase configuration."
+        )
+    
+    # Date the upload like the backfill does, so weeks stay distinct in stock_history
+    snapshot_date = snapshot_date or snapshot_date_from_name(current_stock.filename) or datetime.now().date().isoformat()
+    try:
+        snapshot_date = pd.Timestamp(snapshot_date).date().isoformat()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid snapshot date: {str(e)}")
+    latest = await run_in_threadpool(latest_snapshot_date)
+    if latest and snapshot_date < latest:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Snapshot date {snapshot_date} is before the latest recorded snapshot ({latest}); "
+                   f"use /notifications/backfill for past weeks"
+        )
+    
+    # A previous stock file is only needed until base_stock has data
+    base_stock_exists = await count_rows_async("base_stock") > 0
+    if not base_stock_exists and not previous_stock:
+        raise HTTPException(
+            status_code=400,
+            detail="Previous stock file is required for first upload"
+        )
+    
+    # Spool uploads to disk; the job parses from there and removes them
+    current_path, current_digest = await spool_upload(current_stock)
+    prev_path = None
+    if previous_stock and not base_stock_exists:
+        try:
+            prev_path, _ = await spool_upload(previous_stock)
+        except BaseException:
+            remove_spooled(current_path)
+            raise
+    
+    files = {'current': current_stock.filename, 'previous': previous_stock.filename if prev_path else None}
+    # The current file is what gets applied on top of base_stock; the previous
+    # file only bootstraps the first upload, so it is not part of the fingerprint.
+    # The snapshot date is: an unchanged export for a new week is a real week
+    # (counters and inactive flags advance), only a re-submit is a duplicate.
+    fingerprint = upload_fingerprints.combine(
+        'stock_upload', {'current': current_digest, 'snapshot_date': snapshot_date}
+    )
+    job = jobs.create('stock_upload', meta=dict(files, fingerprint=fingerprint, snapshot_date=snapshot_date))
+    if force:
+        upload_fingerprints.claim(fingerprint, job.id)
+    else:
+        # Claim before anything is awaited so a double click cannot start a second job
+        running = upload_fingerprints.claim_if_absent(fingerprint, job.id)
+        if running:
+            jobs.discard(job.id)
+            remove_spooled(current_path, prev_path)
+            print(f"[Backend] Identical upload already running as job {running}")
+            return {
+                "success": True,
+                "duplicate": True,
+                "message": "The same files are already being processed",
+                "job_id": running,
+                "status": "running",
+                "status_url": f"/jobs/{running}"
+            }
+        try:
+            previous = await run_in_threadpool(upload_fingerprints.find_duplicate, 'stock_upload', fingerprint)
+        except BaseException:
+            upload_fingerprints.release(fingerprint, job.id)
+            jobs.discard(job.id)
+            remove_spooled(current_path, prev_path)
+            raise
+        if previous is not None:
+            upload_fingerprints.release(fingerprint, job.id)
+            jobs.discard(job.id)
+            remove_spooled(current_path, prev_path)
+            print(f"[Backend] Identical to the latest upload ({fingerprint[:12]}), returning its result")
+            return dict(
+                previous['result'] or {},
+                duplicate=True,
+                message="These files were already processed; returning the previous result (use force=true to reprocess)",
+                fingerprint=fingerprint,
+                job_id=previous.get('job_id'),
+                processed_at=str(previous.get('created_at'))
+            )
+    
+    if wait:
+        await run_upload_job(job, current_path, prev_path, fingerprint, files, snapshot_date)
+        if job.status == 'failed':
+            raise HTTPException(status_code=job.status_code, detail=job.error)
+        return dict(job.result, job_id=job.id)
+    
+    background_tasks.add_task(run_upload_job, job, current_path, prev_path, fingerprint, files, snapshot_date)
+    print(f"[Backend] Upload job {job.id} queued")
+    return {
+        "success": True,
+        "message": "Upload accepted; processing in background",
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}"
+    }
+
+
+async def process_stock_backfill(job, uploads: list) -> dict:
+    """
+    Backfill pipeline for dated stock files, recorded as stages:
+      parse  - parse every file in parallel worker processes
+      chain  - replay the snapshots in date order (flags, counters, final report)
+      write  - sync stock_notifications and base_stock to the final state and
+               append every snapshot to stock_history
+    `uploads` is a list of (snapshot_date, filename, path) sorted by date.
+    Raises HTTPException with the status the request would have returned.
+    """
+    with job.stage('parse') as stage:
+        try:
+            frames = await run_in_threadpool(parse_stock_files, [path for _, _, path in uploads])
+        except Exception as e:
+            print(f"[Backend] Failed to parse backfill files: {str(e)}")
+            raise HTTPException(status_code=400, detail=str(e))
+        stage['rows'] = sum(len(f) for f in frames)
+        stage['files'] = len(frames)
+
+        base_snapshot = await read_table_async("SELECT * FROM base_stock")
+        if base_snapshot is None:
+            raise HTTPException(status_code=503, detail="Could not read base_stock; try the backfill again")
+        if base_snapshot.empty:
+            base_snapshot = None
+        if base_snapshot is None and len(frames) < 2:
+            raise HTTPException(
+                status_code=400,
+                detail="At least two stock files are required when base_stock is empty"
+            )
+
+    with job.stage('chain') as stage:
+        states = chain_stock_states(frames, base_snapshot)
+        # The final report compares the last snapshot with the state before it,
+        # smoothing consumption over recorded history plus the backfilled weeks
+        df_prev = states[-2] if len(states) > 1 else base_snapshot
+        windows = [await run_in_threadpool(recent_history)] if base_snapshot is not None else []
+        windows += [
+            state[['product_sku', 'stock_level']].assign(snapshot_date=snapshot_date)
+            for (snapshot_date, _, _), state in zip(uploads[:-1], states[:-1])
+        ]
+        windows = [w for w in windows if not w.empty]
+        history = pd.concat(windows, ignore_index=True) if windows else None
+        report_df = await run_in_threadpool(generate_stock_report, df_prev, frames[-1], None, history)
+        now = pd.Timestamp.now()
+        report_df['unchanged_counter'] = 0
+        report_df['flag'] = 'stage'
+        report_df['created_at'] = now
+        report_df['updated_at'] = now
+
+        base_stock_df = states[-1].copy()
+        base_stock_df['updated_at'] = datetime.now()
+        stage['rows'] = len(report_df)
+        stage['flags'] = {str(k): int(v) for k, v in base_stock_df['flag'].value_counts().items()}
+
+    with job.stage('write') as stage:
+        res_notif = await apply_table_diff_async('stock_notifications', report_df)
+        if res_notif is None:
+            raise HTTPException(status_code=500, detail="Failed to write stock_notifications records")
+        res_base = await apply_table_diff_async('base_stock', base_stock_df, base_snapshot)
+        if res_base is None:
+            raise HTTPException(status_code=500, detail="Failed to write base_stock records")
+        print(f"[Backend] ✓ Backfill synced stock_notifications {res_notif} and base_stock {res_base}")
+
+        snapshots = [(snapshot_date, state) for (snapshot_date, _, _), state in zip(uploads, states)]
+        res_history = await run_in_threadpool(record_stock_snapshots, snapshots, base_snapshot)
+        if res_history is None:
+            raise HTTPException(status_code=500, detail="Failed to write stock_history records")
+        stage['rows'] = sum(res_notif[k] + res_base[k] for k in ('inserted', 'updated', 'deleted'))
+        stage['rows'] += sum(h['changed_rows'] + h['removed_rows'] for h in res_history)
+        stage['stock_notifications'] = res_notif
+        stage['base_stock'] = res_base
+
+    print(f"[Backend] ✅ Backfill of {len(uploads)} snapshots completed")
+    return {
+        "success": True,
+        "message": f"Backfilled {len(uploads)} stock snapshots",
+        "snapshots": res_history,
+        "notifications_count": len(report_df)
+    }
+
+
+async def run_backfill_job(job, uploads: list):
+    """Run process_stock_backfill for a job, record the outcome and remove the spooled files"""
+    try:
+        async with upload_job_lock:
+            job.start()
+            result = await process_stock_backfill(job, uploads)
+        job.succeed(result)
+        # base_stock no longer reflects the latest regular upload
+        await run_in_threadpool(upload_fingerprints.forget, 'stock_upload')
+    except HTTPException as e:
+        job.fail(str(e.detail), e.status_code)
+    except Exception as e:
+        print(f"[Backend] ❌ Error in backfill job {job.id}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        job.fail(str(e))
+    finally:
+        remove_spooled(*[path for _, _, path in uploads])
+    return job
+
+
+@app.post("/notifications/backfill")
+async def backfill_stock_files(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(..., description="Weekly stock exports"),
+    dates: Optional[str] = Query(None, description="Comma-separated snapshot dates (YYYY-MM-DD) in file order; defaults to the date in each file name"),
+    wait: bool = Query(False, description="Process inside the request and return the final result")
+):
+    """
+    Backfill months of weekly stock files in one job.
+    Files are ordered by snapshot date and parsed in parallel; the chain of
+    weekly diffs is replayed in memory and only the final base_stock /
+    stock_notifications state plus the stock_history rows are written.
+    Dates must be later than the latest recorded snapshot.
+    """
+    if not DB_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Database not available. Please check Supabase configuration.")
+
+    if dates:
+        snapshot_dates = [d.strip() for d in dates.split(',')]
+        if len(snapshot_dates) != len(files):
+            raise HTTPException(status_code=400, detail=f"Got {len(snapshot_dates)} dates for {len(files)} files")
+    else:
+        snapshot_dates = [snapshot_date_from_name(f.filename) for f in files]
+        undated = [f.filename for f, d in zip(files, snapshot_dates) if d is None]
+        if undated:
+            raise HTTPException(
+                status_code=400,
+                detail=f"No date in file names: {', '.join(undated)} (pass dates=YYYY-MM-DD,...)"
+            )
+    try:
+        snapshot_dates = [pd.Timestamp(d).date().isoformat() for d in snapshot_dates]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid snapshot date: {str(e)}")
+    if len(set(snapshot_dates)) != len(snapshot_dates):
+        raise HTTPException(status_code=400, detail="Each file needs a different snapshot date")
+
+    latest = await run_in_threadpool(latest_snapshot_date)
+    if latest and min(snapshot_dates) <= latest:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Snapshot dates must be after the latest recorded snapshot ({latest})"
+        )
+
+    uploads = []
+    try:
+        for snapshot_date, upload in sorted(zip(snapshot_dates, files), key=lambda pair: pair[0]):
+            path, _ = await spool_upload(upload)
+            uploads.append((snapshot_date, upload.filename, path))
+    except BaseException:
+        remove_spooled(*[path for _, _, path in uploads])
+        raise
+
+    job = jobs.create('stock_backfill', meta={'files': [
+        {'snapshot_date': snapshot_date, 'filename': filename} for snapshot_date, filename, _ in uploads
+    ]})
+
+    if wait:
+        await run_backfill_job(job, uploads)
+        if job.status == 'failed':
+            raise HTTPException(status_code=job.status_code, detail=job.error)
+        return dict(job.result, job_id=job.id)
+
+    background_tasks.add_task(run_backfill_job, job, uploads)
+    print(f"[Backend] Backfill job {job.id} queued with {len(uploads)} files")
+    return {
+        "success": True,
+        "message": "Backfill accepted; processing in background",
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}"
+    }
+
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Stage-level progress of a background job (parse, report, diff, write)"""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job.to_dict()
+
+
+@app.get("/jobs")
+async def list_jobs(kind: Optional[str] = Query(None, description="Only jobs of this kind, e.g. stock_upload")):
+    """Recent background jobs, newest first"""
+    return {"jobs": [job.to_dict() for job in reversed(jobs.list(kind))]}
 
 @app.delete("/notifications/clear_base_stock")
 async def clear_base_stock():
@@ -654,8 +935,10 @@ async def clear_base_stock():
         print("[Backend] Clearing base_stock and stock_notifications tables...")
         
         # Clear both tables using Supabase
-        delete_data('base_stock', 'product_sku', '*')
-        delete_data('stock_notifications', 'product_sku', '*')
+        await delete_data_async('base_stock', 'product_sku', '*')
+        await delete_data_async('stock_notifications', 'product_sku', '*')
+        # Re-uploading the last files must rebuild the data, not return the stale result
+        await run_in_threadpool(upload_fingerprints.forget, 'stock_upload')
         
         print("[Backend] ✅ base_stock and stock_notifications cleared")
         return {"success": True, "message": "Stock data cleared successfully"}
@@ -670,8 +953,9 @@ async def clear_stock_compat():
     """Compatibility endpoint for frontend: clears base_stock and stock_notifications"""
     try:
         print("[Backend] Compatibility: clearing base_stock and stock_notifications via /clear_stock")
-        delete_data('base_stock', 'product_sku', '*')
-        delete_data('stock_notifications', 'product_sku', '*')
+        await delete_data_async('base_stock', 'product_sku', '*')
+        await delete_data_async('stock_notifications', 'product_sku', '*')
+        await run_in_threadpool(upload_fingerprints.forget, 'stock_upload')
         print("[Backend] ✅ /clear_stock completed")
         return {"success": True, "message": "Stock data cleared successfully"}
     except Exception as e:
@@ -689,113 +973,54 @@ async def update_manual_values_endpoint(
     try:
         print(f"[Backend] Updating manual values for {product_sku}: MinStock={minstock}, Buffer={buffer}")
         
-        df_notification = execute_query(f"SELECT * FROM stock_notifications WHERE product_sku = '{product_sku}'")
+        df_notification = await execute_query_async(
+            "SELECT * FROM stock_notifications WHERE product_sku = :sku LIMIT 1",
+            {"sku": product_sku}
+        )
         
         if df_notification.empty:
             raise HTTPException(status_code=404, detail=f"Product {product_sku} not found in notifications")
         
-        row = df_notification.iloc[0]
-
-        # Robustly read numeric columns
-        def _get_col_value(series, df_cols, candidates, default=0):
-            norm_map = {str(c).strip().lower(): c for c in df_cols}
-            for cand in candidates:
-                key = norm_map.get(str(cand).strip().lower())
-                if key is not None:
-                    val = series.get(key, None)
-                    try:
-                        if pd.notna(val):
-                            return val
-                    except Exception:
-                        return val
-            return default
-
-        stock = _get_col_value(row, df_notification.columns, ['stock', 'stock_level', 'Stock', 'Stock_Level'])
-        last_stock = _get_col_value(row, df_notification.columns, ['last_stock', 'Last_Stock', 'LastStock'])
+        updates = pd.DataFrame([{'product_sku': product_sku, 'min_stock': minstock, 'buffer': buffer}])
+        repriced = recompute_manual_values(df_notification, updates.astype({'min_stock': 'float', 'buffer': 'float'}))
+        row = repriced.iloc[0]
 
-        try:
-            stock = int(stock)
-        except Exception:
-            stock = 0
-        try:
-            last_stock = int(last_stock)
-        except Exception:
-            last_stock = 0
-
-        weekly_sale = max((last_stock - stock), 1)
-        decrease_rate = ((last_stock - stock) / last_stock * 100) if last_stock > 0 else 0
-        weeks_to_empty = stock / weekly_sale if weekly_sale > 0 else 0
-        
-        stored_minstock = minstock if minstock is not None else 0
-        
-        # Calculate buffer dynamically based on decrease_rate (same logic as generate_stock_report)
-        if decrease_rate > 50:
-            calculated_buffer = 20
-        elif decrease_rate > 20:
-            calculated_buffer = 10
-        else:
-            calculated_buffer = 5
-        calculated_buffer = min(calculated_buffer, 50)  # MAX_BUFFER = 50
-        
-        # If user provided a buffer value, use it for this calculation
-        buffer_to_use = buffer if buffer is not None else calculated_buffer
-        
-        print("[Backend] Calculation values:")
-        print(f"  Stock: {stock}")
-        print(f"  Last Stock: {last_stock}")
-        print(f"  Weekly Sale: {weekly_sale}")
-        print(f"  Decrease Rate: {decrease_rate}%")
-        print(f"  MinStock: {stored_minstock}")
-        print(f"  Buffer (calculated): {calculated_buffer}")
-        print(f"  Buffer (to use): {buffer_to_use}")
-        
-        # Calculate new reorder quantity
-        default_reorder = int(weekly_sale * 1.5)
-        new_reorder_qty = max(stored_minstock + buffer_to_use - stock, default_reorder)
-        
-        # Determine status
-        is_red = (stock < stored_minstock) or (decrease_rate > 50)
-        is_yellow = (not is_red) and (decrease_rate > 20)
-        
-        if is_red:
-            new_status = 'Red'
-            new_description = f'Decreasing rapidly and nearly out of stock! Recommend restocking {new_reorder_qty} units'
-        elif is_yellow:
-            new_status = 'Yellow'
-            new_description = f'Decreasing rapidly, should prepare to restock. Recommend restocking {new_reorder_qty} units'
-        else:
-            new_status = 'Green'
-            new_description = 'Stock is sufficient'
-        
-        # Find actual column names
-        cols = [str(c) for c in df_notification.columns]
-        norm_map = {c.strip().lower(): c for c in cols}
-        match_col = norm_map.get('product_sku', 'product_sku')
-
-        def find_col(*candidates):
-            for cand in candidates:
-                key = str(cand).strip().lower()
-                if key in norm_map:
-                    return norm_map[key]
-            return None
+        stored_minstock = int(row['min_stock'])
+        calculated_buffer = int(row['dynamic_buffer'])
+        buffer_to_use = int(row['buffer'])
+        new_reorder_qty = int(row['reorder_qty'])
+        new_status = row['status']
+        new_description = row['description']
+        print(f"[Backend] Repriced {product_sku}: stock={row['stock_level']}, last_stock={row['last_stock']}, "
+              f"decrease_rate={row['decrease_rate']}%, min_stock={stored_minstock}, buffer={buffer_to_use} "
+              f"(calculated {calculated_buffer})")
 
         update_payload = {}
-        min_col = find_col('minstock', 'min_stock', 'min stock', 'MinStock')
-        if min_col and minstock is not None:
-            update_payload[min_col] = int(stored_minstock)
-        
+        if minstock is not None:
+            update_payload['min_stock'] = stored_minstock
+            # Later stock reports keep this value instead of the formula
+            # (a cold index is loaded first, so keep it off the event loop)
+            saved = await run_in_threadpool(manual_overrides.set_min_stock, {product_sku: stored_minstock})
+            try:
+                await asyncio.wrap_future(saved)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Manual MinStock for {product_sku} was not saved: {e}")
+
         # Always update reorder_qty, status, and description
-        update_payload['reorder_qty'] = int(new_reorder_qty)
+        update_payload['reorder_qty'] = new_reorder_qty
         update_payload['status'] = new_status
         update_payload['description'] = new_description
         update_payload['updated_at'] = datetime.now().isoformat()
 
         print(f"[Backend] Updating {product_sku} with: {update_payload}")
-        result = update_data('stock_notifications', update_payload, match_col, product_sku)
+        result = await update_data_async('stock_notifications', update_payload, 'product_sku', product_sku)
         print(f"[Backend] Update result: {result}")
         
         # Get the final updated record
-        final_df = execute_query(f"SELECT * FROM stock_notifications WHERE {match_col} = '{product_sku}'")
+        final_df = await execute_query_async(
+            "SELECT * FROM stock_notifications WHERE product_sku = :sku LIMIT 1",
+            {"sku": product_sku}
+        )
         final_row = None
         if final_df is not None and not final_df.empty:
             final_row = final_df.iloc[0].to_dict()
@@ -834,6 +1059,75 @@ async def update_manual_values_endpoint(
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+class ManualValuesItem(BaseModel):
+    sku: str
+    min_stock: Optional[int] = None
+    buffer: Optional[int] = None
+
+
+class ManualValuesBulkRequest(BaseModel):
+    items: List[ManualValuesItem]
+    rules: Optional[str] = None
+
+
+@app.post("/notifications/update_manual_values/bulk")
+async def update_manual_values_bulk(request: ManualValuesBulkRequest):
+    """
+    Set manual MinStock (and a calculation-only Buffer) for many SKUs at once.
+    Only the listed SKUs are read, reorder_qty/status/description are
+    recomputed for all of them in one vectorized pass (with the named
+    restock rule set, default when omitted) and written back in one batched
+    upsert. SKUs without a notification are reported in not_found.
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No items provided")
+    try:
+        rules = get_rules(request.rules)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    print(f"[Backend] Bulk updating manual values for {len(request.items)} SKUs")
+
+    updates = pd.DataFrame(
+        [{'product_sku': item.sku, 'min_stock': item.min_stock, 'buffer': item.buffer} for item in request.items]
+    ).astype({'min_stock': 'float', 'buffer': 'float'})
+    skus = updates['product_sku'].drop_duplicates().tolist()
+
+    df_notif = await read_rows_async('stock_notifications', 'product_sku', skus)
+    if df_notif is None:
+        raise HTTPException(status_code=500, detail="Failed to read stock_notifications records")
+    if df_notif.empty:
+        raise HTTPException(status_code=404, detail="None of the products were found in notifications")
+    found = set(df_notif['product_sku'])
+    not_found = [sku for sku in skus if sku not in found]
+
+    updated = recompute_manual_values(df_notif, updates, rules)
+    updated['updated_at'] = datetime.now().isoformat()
+    result = await upsert_data_async('stock_notifications', updated.drop(columns=['buffer', 'dynamic_buffer', 'id'], errors='ignore'))
+    if result is None:
+        raise HTTPException(status_code=500, detail="Failed to write stock_notifications records")
+
+    # Later stock reports keep these values instead of the formula
+    overrides = updates.dropna(subset=['min_stock'])
+    overrides = overrides[overrides['product_sku'].isin(found)]
+    if not overrides.empty:
+        saved = await run_in_threadpool(
+            manual_overrides.set_min_stock, dict(zip(overrides['product_sku'], overrides['min_stock'].astype(int)))
+        )
+        try:
+            await asyncio.wrap_future(saved)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Manual MinStock values were not saved: {e}")
+
+    rows = updated[['product_sku', 'min_stock', 'buffer', 'reorder_qty', 'status', 'description']]
+    print(f"[Backend] ✅ Updated manual values for {len(updated)} SKUs ({len(not_found)} not found)")
+    return {
+        "success": True,
+        "message": f"Manual values updated for {len(updated)} products",
+        "updated": len(updated),
+        "not_found": not_found,
+        "rows": rows.to_dict(orient='records')
+    }
+
 # ============================================================================
 # STOCK ENDPOINTS
 # ============================================================================
@@ -847,7 +1141,9 @@ async def get_stock_levels(
     """Get stock levels from base_stock table"""
     try:
         print("[Backend] Fetching stock levels from base_stock...")
-        df = execute_query("SELECT * FROM base_stock")
+        df = await read_table_async("SELECT * FROM base_stock")
+        if df is None:
+            raise RuntimeError("Could not read base_stock")
         if category:
             df = df[df['หมวดหมู่'] == category]
         if status:
@@ -878,7 +1174,7 @@ async def get_stock_categories():
         print("[Backend] Fetching stock categories...")
         
         try:
-            df = execute_query("SELECT DISTINCT \"หมวดหมู่\" as category FROM base_stock")
+            df = await execute_query_async("SELECT DISTINCT \"หมวดหมู่\" as category FROM base_stock")
             df = df[df['category'].notnull()]
             if not df.empty:
                 categories = df['category'].tolist()
@@ -984,11 +1280,51 @@ async def get_analysis_base_skus(search: str = Query("", description="Search ter
     return {"success": False, "message": "Not implemented: endpoint needs Supabase migration", "base_skus": [], "results": [], "total": 0}
 
 @app.get("/analysis/historical")
-async def get_analysis_historical_sales(sku: str = Query(..., description="Product SKU or category to analyze")):
-    """Get historical stock data from base_stock table"""
+async def get_analysis_historical_sales(
+    sku: str = Query(..., description="Product SKU or category to analyze"),
+    start: Optional[str] = Query(None, description="First snapshot date (YYYY-MM-DD)"),
+    end: Optional[str] = Query(None, description="Last snapshot date (YYYY-MM-DD)"),
+    weeks: Optional[int] = Query(None, ge=1, description="Only the last N snapshots when start is not given")
+):
+    """Get weekly stock levels from the stock_history snapshots"""
     print(f"[Backend] Fetching historical stock data for: {sku}")
-    # Not implemented: SQLAlchemy removed, needs Supabase migration
-    return {"success": False, "message": "Not implemented: endpoint needs Supabase migration", "chart_data": [], "table_data": [], "search_type": "unknown"}
+    try:
+        skus, search_type = await run_in_threadpool(find_history_skus, sku.strip())
+        if not skus:
+            return {"success": False, "message": f"No products found for '{sku}'", "chart_data": [], "table_data": [], "sizes": [], "search_type": "unknown"}
+
+        history = await run_in_threadpool(read_stock_history, skus, start, end)
+        if weeks and not start and not history.empty:
+            recent = sorted(history['snapshot_date'].unique())[-weeks:]
+            history = history[history['snapshot_date'].isin(recent)]
+        if history.empty:
+            return {"success": False, "message": f"No stock history recorded for '{sku}'", "chart_data": [], "table_data": [], "sizes": skus, "search_type": search_type}
+
+        history = history.copy()
+        history['stock_level'] = pd.to_numeric(history['stock_level'], errors='coerce')
+        history['change'] = history.groupby('product_sku')['stock_level'].diff()
+        history = history.astype(object).where(history.notna(), None)
+
+        chart_data = [
+            {'date': row['snapshot_date'], 'size': row['product_sku'], 'stock_level': row['stock_level']}
+            for row in history.to_dict(orient='records')
+        ]
+        table_data = history[['snapshot_date', 'product_sku', 'product_name', 'category', 'stock_level', 'change']] \
+            .rename(columns={'snapshot_date': 'date'}).to_dict(orient='records')
+        return {
+            "success": True,
+            "message": "Data fetched successfully",
+            "chart_data": chart_data,
+            "table_data": table_data,
+            "sizes": sorted(history['product_sku'].unique().tolist()),
+            "dates": sorted(history['snapshot_date'].unique().tolist()),
+            "search_type": search_type
+        }
+    except Exception as e:
+        print(f"[Backend] ❌ Error fetching historical stock data: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return {"success": False, "message": f"Error: {str(e)}", "chart_data": [], "table_data": [], "sizes": [], "search_type": "unknown"}
 
 @app.post("/analysis/performance")
 async def get_analysis_performance(request: dict):
@@ -1155,7 +1491,7 @@ def background_predict_task(n_forecast: int):
         # Get the latest training data from base_data
         print("[Background] Fetching training data from Supabase...", flush=True)
         sys.stdout.flush()
-        df_cleaned = execute_query("SELECT * FROM base_data ORDER BY sales_date DESC")
+        df_cleaned = read_table("SELECT * FROM base_data ORDER BY sales_date DESC")
         if df_cleaned is None:
             print("[Background] Failed to retrieve training data from Supabase", flush=True)
             sys.stdout.flush()
@@ -1194,20 +1530,8 @@ def background_predict_task(n_forecast: int):
         forecast_df = pd.DataFrame(forecast_results)
         forecast_df['created_at'] = datetime.now()
         
-        # Clean up data for Supabase
-        records = forecast_df.to_dict(orient='records')
-        for record in records:
-            for key, value in list(record.items()):
-                if pd.isna(value):
-                    record[key] = None
-                elif isinstance(value, pd.Timestamp):
-                    record[key] = value.isoformat()
-                elif isinstance(value, datetime):
-                    record[key] = value.isoformat()
-        
-        # Clear old forecasts and insert new ones
-        delete_data('forecasts', 'product_sku', '*')
-        result = insert_data('forecasts', records)
+        # Stage the new forecasts and flip them live; readers keep the old ones until then
+        result = replace_table_snapshot('forecasts', forecast_df)
         if result is None:
             print("[Background] Failed to save forecasts to Supabase", flush=True)
             sys.stdout.flush()
@@ -1234,66 +1558,55 @@ def background_predict_task(n_forecast: int):
         except:
             pass
 
-async def process_training_in_background(
-    product_content: bytes,
-    sales_content: bytes,
+def process_training_in_background(
+    product_temp_path: str,
+    sales_temp_path: str,
     product_filename: str,
-    sales_filename: str
+    sales_filename: str,
+    job=None,
+    fingerprint: str = None
 ):
-    """Process training in the background to avoid timeout"""
-    import tempfile
-    import os
-    
+    """Process training in the background to avoid timeout.
+    Plain def so BackgroundTasks runs it in the thread pool instead of on the event loop.
+    Takes the spooled upload paths and removes them when done. A completed run
+    is recorded under the upload fingerprint so identical re-uploads skip it."""
+    summary = {
+        "success": True,
+        "data_cleaning": {"status": "processing", "rows_uploaded": 0},
+        "ml_training": {"status": "processing", "forecast_rows": 0},
+    }
+    if job is not None:
+        job.start()
     try:
         print("[Background] Starting background training process...")
         sys.stdout.flush()
         
-        # Create temporary files
-        with tempfile.NamedTemporaryFile(mode='wb', delete=False, suffix='.xlsx') as product_temp:
-            product_temp.write(product_content)
-            product_temp_path = product_temp.name
-        
-        with tempfile.NamedTemporaryFile(mode='wb', delete=False, suffix='.xlsx') as sales_temp:
-            sales_temp.write(sales_content)
-            sales_temp_path = sales_temp.name
-        
         try:
             print(f"[Background] Calling auto_cleaning with sales_path={sales_temp_path}, product_path={product_temp_path}")
             sys.stdout.flush()
             df_cleaned = auto_cleaning(sales_temp_path, product_temp_path)
             rows_uploaded = len(df_cleaned)
+            summary["data_cleaning"]["rows_uploaded"] = rows_uploaded
             print(f"[Background] Cleaned data: {rows_uploaded} rows")
             sys.stdout.flush()
             
-            # Insert cleaned data into Supabase
-            import pandas as pd
-            records = df_cleaned.to_dict(orient='records')
-            print(f"[Background] Preparing to insert {len(records)} records into base_data")
+            # Insert cleaned data into Supabase (sanitized column-wise by insert_data)
+            print(f"[Background] Preparing to insert {len(df_cleaned)} records into base_data")
             sys.stdout.flush()
             
-            # Handle datetime columns and NaN values
-            for record in records:
-                for key, value in list(record.items()):
-                    if pd.isna(value):
-                        record[key] = None
-                    elif isinstance(value, pd.Timestamp):
-                        record[key] = value.isoformat()
-                    elif isinstance(value, float) and pd.isna(value):
-                        record[key] = None
-            
-            print("[Background] Clearing old data from base_data...")
-            sys.stdout.flush()
-            delete_data('base_data', 'product_sku', '*')
-            print("[Background] Old data cleared, now inserting new data...")
+            print("[Background] Staging new base_data snapshot...")
             sys.stdout.flush()
             
-            result = insert_data('base_data', records)
+            result = replace_table_snapshot('base_data', df_cleaned)
             if result is None:
                 print("[Background] ⚠️ Failed to insert data into base_data")
                 sys.stdout.flush()
+                if job is not None:
+                    job.fail("Failed to insert data into base_data")
                 return
+            summary["data_cleaning"]["status"] = "completed"
             
-            print(f"[Background] ✅ Successfully inserted {len(records)} records into base_data")
+            print(f"[Background] ✅ Successfully inserted {len(df_cleaned)} records into base_data")
             sys.stdout.flush()
             
             # Train the model
@@ -1320,77 +1633,127 @@ async def process_training_in_background(
                         now = datetime.now()
                         forecast_df['created_at'] = now
                         
-                        # Clean up data for Supabase
-                        records = forecast_df.to_dict(orient='records')
-                        print(f"[Background] Cleaning {len(records)} forecast records...")
-                        sys.stdout.flush()
-                        for record in records:
-                            for key, value in list(record.items()):
-                                if pd.isna(value):
-                                    record[key] = None
-                                elif isinstance(value, pd.Timestamp):
-                                    record[key] = value.isoformat()
-                                elif isinstance(value, datetime):
-                                    record[key] = value.isoformat()
-                        
-                        # Clear old forecasts and insert new ones
-                        print("[Background] Clearing old forecasts...")
-                        sys.stdout.flush()
-                        delete_data('forecast_output', 'product_sku', '*')
-                        
-                        print("[Background] Inserting new forecasts...")
+                        # Stage new forecasts and flip them live in one step
+                        print("[Background] Writing new forecast snapshot...")
                         sys.stdout.flush()
-                        result = insert_data('forecast_output', records)
+                        result = replace_table_snapshot('forecast_output', forecast_df)
                         if result is not None:
-                            print(f"[Background] ✅ Successfully saved {len(records)} forecasts to forecast_output")
+                            print(f"[Background] ✅ Successfully saved {len(forecast_df)} forecasts to forecast_output")
                             sys.stdout.flush()
+                            summary["ml_training"].update(status="completed", forecast_rows=len(forecast_df))
                         else:
                             print("[Background] ⚠️ Failed to save forecasts to forecast_output")
                             sys.stdout.flush()
+                            summary["ml_training"].update(status="failed", message="Failed to save forecasts to forecast_output")
                     else:
                         print("[Background] No forecasts generated")
                         sys.stdout.flush()
+                        summary["ml_training"].update(status="completed", message="No forecasts generated")
                         
                 except Exception as forecast_error:
+                    summary["ml_training"].update(status="failed", message=str(forecast_error))
                     print(f"[Background] ⚠️ Forecast generation or saving failed: {str(forecast_error)}")
                     import traceback
                     traceback.print_exc()
                     sys.stdout.flush()
                     
             except Exception as train_error:
+                summary["ml_training"].update(status="failed", message=str(train_error))
                 print(f"[Background] ❌ Model training failed: {str(train_error)}")
                 import traceback
                 traceback.print_exc()
                 sys.stdout.flush()
                 
         finally:
-            # Clean up temporary files
-            try:
-                os.unlink(product_temp_path)
-                os.unlink(sales_temp_path)
-            except:
-                pass
+            # Clean up spooled uploads
+            remove_spooled(product_temp_path, sales_temp_path)
+        
+        if summary["ml_training"]["status"] == "completed":
+            summary["message"] = "Training completed"
+            if fingerprint:
+                files = {'product': product_filename, 'sales': sales_filename}
+                upload_fingerprints.record('training', fingerprint, files, summary, job.id if job else None)
+            if job is not None:
+                job.succeed(summary)
+        elif job is not None:
+            job.fail(summary["ml_training"].get("message", "Training failed"))
                 
     except Exception as e:
         print(f"[Background] ❌ Error in background training: {str(e)}")
         import traceback
         traceback.print_exc()
         sys.stdout.flush()
+        if job is not None and not job.done:
+            job.fail(str(e))
+    finally:
+        if fingerprint:
+            upload_fingerprints.release(fingerprint, job.id if job else None)
 
 @app.post("/train")
 async def train_model(
     background_tasks: BackgroundTasks,
     product_file: UploadFile = File(...),
-    sales_file: UploadFile = File(...)
+    sales_file: UploadFile = File(...),
+    force: bool = Query(False, description="Retrain even if the same files were just trained on")
 ):
-    """Train the forecasting model with product and sales data - returns immediately and processes in background"""
+    """Train the forecasting model with product and sales data - returns immediately and processes in background.
+    Re-uploading the files of the latest completed training returns its result unless force=true."""
     try:
         print("[Backend] Starting model training...")
         sys.stdout.flush()
         
-        # Read uploaded files
-        product_content = await product_file.read()
-        sales_content = await sales_file.read()
+        # Spool uploaded files to disk; the background task removes them
+        product_path, product_digest = await spool_upload(product_file)
+        try:
+            sales_path, sales_digest = await spool_upload(sales_file)
+        except BaseException:
+            remove_spooled(product_path)
+            raise
+        
+        fingerprint = upload_fingerprints.combine('training', {'product': product_digest, 'sales': sales_digest})
+        job = jobs.create('training', meta={
+            'product_file': product_file.filename,
+            'sales_file': sales_file.filename,
+            'fingerprint': fingerprint,
+        })
+        if force:
+            upload_fingerprints.claim(fingerprint, job.id)
+        else:
+            # Claim before anything is awaited so a double click cannot start a second job
+            running = upload_fingerprints.claim_if_absent(fingerprint, job.id)
+            if running:
+                jobs.discard(job.id)
+                remove_spooled(product_path, sales_path)
+                print(f"[Backend] Identical training already running as job {running}")
+                return {
+                    "success": True,
+                    "duplicate": True,
+                    "message": "Training on these files is already in progress.",
+                    "job_id": running,
+                    "status_url": f"/jobs/{running}",
+                    "data_cleaning": {"status": "processing", "message": "Data cleaning and upload in progress"},
+                    "ml_training": {"status": "processing", "message": "Training on these files is already in progress"}
+                }
+            try:
+                previous = await run_in_threadpool(upload_fingerprints.find_duplicate, 'training', fingerprint)
+            except BaseException:
+                upload_fingerprints.release(fingerprint, job.id)
+                jobs.discard(job.id)
+                remove_spooled(product_path, sales_path)
+                raise
+            if previous is not None:
+                upload_fingerprints.release(fingerprint, job.id)
+                jobs.discard(job.id)
+                remove_spooled(product_path, sales_path)
+                print(f"[Backend] Identical to the latest training upload ({fingerprint[:12]}), returning its result")
+                return dict(
+                    previous['result'] or {},
+                    duplicate=True,
+                    message="These files were already trained on; returning the previous result (use force=true to retrain)",
+                    fingerprint=fingerprint,
+                    job_id=previous.get('job_id'),
+                    processed_at=str(previous.get('created_at'))
+                )
         
         print(f"[Backend] Product file: {product_file.filename}")
         print(f"[Backend] Sales file: {sales_file.filename}")
@@ -1399,16 +1762,20 @@ async def train_model(
         # Add background task
         background_tasks.add_task(
             process_training_in_background,
-            product_content,
-            sales_content,
+            product_path,
+            sales_path,
             product_file.filename,
-            sales_file.filename
+            sales_file.filename,
+            job,
+            fingerprint
         )
         
         # Return immediately
         return {
             "success": True,
             "message": "Training started in background. Data will be processed shortly.",
+            "job_id": job.id,
+            "status_url": f"/jobs/{job.id}",
             "data_cleaning": {
                 "status": "processing",
                 "message": "Data cleaning and upload in progress"
@@ -1419,6 +1786,8 @@ async def train_model(
             }
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[Backend] ❌ Error in train_model: {str(e)}")
         import traceback
@@ -1432,7 +1801,8 @@ async def train_model_alias(
     sales_file: UploadFile = File(...)
 ):
     """Alias for /train endpoint - for backward compatibility"""
-    return await train_model(background_tasks, product_file, sales_file)
+    # Called directly, so the Query(False) default would be passed as a (truthy) FieldInfo
+    return await train_model(background_tasks, product_file, sales_file, force=False)
 
 @app.get("/predict/existing")
 async def get_existing_forecasts():
@@ -1444,7 +1814,7 @@ async def get_existing_forecasts():
         try:
             print("[Backend] Querying Supabase...")
             sys.stdout.flush()
-            df = execute_query("""
+            df = await execute_query_async("""
                 SELECT 
                     product_sku,
                     forecast_date,
@@ -1498,8 +1868,8 @@ async def predict_sales(background_tasks: BackgroundTasks, n_forecast: int = Que
         print(f"[Backend] Queuing prediction task for {n_forecast} months...")
         sys.stdout.flush()
         
-        if not SUPABASE_AVAILABLE:
-            print("[Backend] ⚠️ Supabase not available")
+        if not DB_AVAILABLE:
+            print("[Backend] ⚠️ Database not available")
             sys.stdout.flush()
             raise HTTPException(
                 status_code=503,
@@ -1510,7 +1880,7 @@ async def predict_sales(background_tasks: BackgroundTasks, n_forecast: int = Que
         try:
             print("[Backend] Checking base_data table...")
             sys.stdout.flush()
-            df = execute_query("SELECT * FROM base_data LIMIT 1")
+            df = await execute_query_async("SELECT * FROM base_data LIMIT 1")
             if df is None or len(df) == 0:
                 print("[Backend] No training data found in base_data")
                 sys.stdout.flush()
@@ -1567,12 +1937,14 @@ async def clear_forecasts():
     try:
         print("[Backend] Clearing forecasts...")
         sys.stdout.flush()
-        result = delete_data('forecasts', 'product_sku', '*')
+        result = await delete_data_async('forecasts', 'product_sku', '*')
         if result is None:
             raise HTTPException(
                 status_code=500, 
                 detail="Failed to clear forecasts from database"
             )
+        # The latest training's result no longer matches the stored forecasts
+        await run_in_threadpool(upload_fingerprints.forget, 'training')
         print("[Backend] ✅ Forecasts cleared")
         sys.stdout.flush()
         return {"success": True, "message": "Forecasts cleared successfully"}
@@ -1,13 +1,127 @@
-from supabase import create_client, Client
+from supabase import Client
 import pandas as pd
+import numpy as np
+from datetime import datetime
 from dotenv import load_dotenv
 import os
+import re
+import json
+import time
+import random
+import httpx
+import asyncio
+import functools
+import contextlib
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from postgrest import SyncPostgrestClient
+from postgrest.utils import SyncClient
+from postgrest.exceptions import APIError
+from postgrest.types import CountMethod, ReturnMethod
+import db_metrics
+from db_metrics import instrumented
 
 # ------------------------------------------------------
 # ⚙️ Load environment variables
 # ------------------------------------------------------
 load_dotenv()
 
+# ------------------------------------------------------
+# 🔌 HTTP connection pool settings
+# ------------------------------------------------------
+# Every PostgREST call in the process goes through one keep-alive pool, so
+# batched writes and multi-query endpoints reuse warm TLS connections.
+DB_HTTP2 = os.getenv("DB_HTTP2", "true").strip().lower() in ("1", "true", "yes")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_KEEPALIVE_EXPIRY = float(os.getenv("DB_KEEPALIVE_EXPIRY", "60"))  # seconds an idle connection is kept
+DB_CONNECT_TIMEOUT = float(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+DB_REQUEST_TIMEOUT = float(os.getenv("DB_REQUEST_TIMEOUT", "120"))  # read/write per request
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # wait for a free connection
+DB_WARM_CONNECTIONS = int(os.getenv("DB_WARM_CONNECTIONS", "4"))
+
+
+class PooledPostgrestClient(SyncPostgrestClient):
+    """PostgREST client whose session uses the process-wide pool settings"""
+
+    def create_session(self, base_url, headers, timeout, verify=True, proxy=None):
+        # postgrest's SyncClient adds the aclose() its close/teardown paths call
+        return SyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=httpx.Timeout(
+                DB_REQUEST_TIMEOUT, connect=DB_CONNECT_TIMEOUT, pool=DB_POOL_TIMEOUT
+            ),
+            limits=httpx.Limits(
+                max_connections=DB_POOL_SIZE,
+                max_keepalive_connections=DB_POOL_SIZE,
+                keepalive_expiry=DB_KEEPALIVE_EXPIRY,
+            ),
+            verify=verify,
+            proxy=proxy,
+            follow_redirects=True,
+            http2=DB_HTTP2,
+            event_hooks={'response': [db_metrics.count_http_bytes]},
+        )
+
+
+class PooledClient(Client):
+    """Supabase client that builds its PostgREST client on the shared pool"""
+
+    @staticmethod
+    def _init_postgrest_client(rest_url, headers, schema, timeout=None, verify=True, proxy=None):
+        return PooledPostgrestClient(
+            rest_url, headers=headers, schema=schema, verify=verify, proxy=proxy
+        )
+
+
+def create_db_client(url: str = None, key: str = None) -> Client:
+    """
+    Client factory for the whole process: a Supabase client whose PostgREST
+    session keeps a persistent HTTP/2 keep-alive pool.
+    """
+    return PooledClient.create(url or SUPABASE_URL, key or SUPABASE_KEY)
+
+
+def warm_up_db_pool(connections: int = None) -> dict:
+    """
+    Open pool connections ahead of the first request so it doesn't pay
+    DNS/TLS setup. With HTTP/2 one connection multiplexes every request.
+    """
+    if supabase is None:
+        return {'connections': 0, 'seconds': 0.0}
+    if connections is None:
+        connections = 1 if DB_HTTP2 else min(DB_WARM_CONNECTIONS, DB_POOL_SIZE)
+    session = supabase.postgrest.session
+    started = time.perf_counter()
+
+    def ping(_):
+        try:
+            session.head("/")
+            return True
+        except httpx.HTTPError as e:
+            print(f"[DB] ⚠️ Pool warm-up request failed: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=max(1, connections)) as pool:
+        opened = sum(pool.map(ping, range(connections)))
+    elapsed = time.perf_counter() - started
+    print(f"[DB] 🔌 Warmed {opened}/{connections} pooled connection(s) in {elapsed:.2f}s "
+          f"(http2={DB_HTTP2}, pool_size={DB_POOL_SIZE})")
+    return {'connections': opened, 'seconds': round(elapsed, 3)}
+
+
+def pool_settings() -> dict:
+    """Connection pool configuration, for the health endpoint"""
+    return {
+        'http2': DB_HTTP2,
+        'pool_size': DB_POOL_SIZE,
+        'keepalive_expiry': DB_KEEPALIVE_EXPIRY,
+        'connect_timeout': DB_CONNECT_TIMEOUT,
+        'request_timeout': DB_REQUEST_TIMEOUT,
+    }
+
+
 # ------------------------------------------------------
 # 🔗 Create Supabase Client
 # ------------------------------------------------------
@@ -19,7 +133,7 @@ SUPABASE_AVAILABLE = False
 
 if SUPABASE_URL and SUPABASE_KEY:
     try:
-        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        supabase: Client = create_db_client(SUPABASE_URL, SUPABASE_KEY)
         # Don't test connection on import - let it fail gracefully when actually used
         print("✅ Supabase client initialized")
         SUPABASE_AVAILABLE = True
@@ -33,20 +147,644 @@ else:
     supabase = None
     SUPABASE_AVAILABLE = False
 
+# ------------------------------------------------------
+# 🗄️ Storage backend (DB_BACKEND=supabase | sqlite)
+# ------------------------------------------------------
+DB_BACKEND = os.getenv("DB_BACKEND", "supabase").strip().lower()
+local_store = None
+
+if DB_BACKEND == "sqlite":
+    from local_store import LocalStore
+    local_store = LocalStore(os.getenv("DB_SQLITE_PATH", "lontuktak_local.db"))
+    print(f"✅ Local SQLite backend initialized at {local_store.path}")
+elif DB_BACKEND != "supabase":
+    print(f"⚠️ Unknown DB_BACKEND '{DB_BACKEND}', falling back to supabase")
+    DB_BACKEND = "supabase"
+
+DB_AVAILABLE = local_store is not None or (SUPABASE_AVAILABLE and supabase is not None)
+
+# ------------------------------------------------------
+# 📄 Paged read settings
+# ------------------------------------------------------
+# PostgREST caps every response at max-rows (1000 by default on Supabase)
+READ_PAGE_SIZE = int(os.getenv("DB_READ_PAGE_SIZE", "1000"))
+READ_CONCURRENCY = int(os.getenv("DB_READ_CONCURRENCY", "4"))
+
+# Rows per upsert request and SKUs per targeted delete (bounded by URL length)
+WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "1000"))
+DELETE_BATCH_SIZE = 200
+WRITE_CONCURRENCY = int(os.getenv("DB_WRITE_CONCURRENCY", "4"))
+WRITE_MAX_RETRIES = int(os.getenv("DB_WRITE_MAX_RETRIES", "3"))
+WRITE_RETRY_BASE_DELAY = 0.5  # seconds, doubled on every retry
+
+# HTTP statuses and Postgres/PostgREST error codes worth retrying
+TRANSIENT_HTTP_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+TRANSIENT_PG_CODES = {'40001', '40P01', '53300', '57014', '57P01', 'PGRST000', 'PGRST001', 'PGRST002', 'PGRST003'}
+
+# ------------------------------------------------------
+# 🚚 Direct COPY bulk loads (optional, needs DATABASE_URL + psycopg2)
+# ------------------------------------------------------
+DATABASE_URL = os.getenv("DATABASE_URL")
+COPY_ENABLED = os.getenv("DB_COPY_ENABLED", "true").lower() in ("1", "true", "yes")
+COPY_MIN_ROWS = int(os.getenv("DB_COPY_MIN_ROWS", "5000"))  # smaller loads stay on REST
+COPY_CHUNK_ROWS = int(os.getenv("DB_COPY_CHUNK_ROWS", "10000"))
+
+
+def copy_available() -> bool:
+    """True when bulk loads can bypass REST and COPY straight into Postgres"""
+    from pg_copy import PSYCOPG2_AVAILABLE, is_postgres_dsn
+    return (COPY_ENABLED and local_store is None and PSYCOPG2_AVAILABLE
+            and is_postgres_dsn(DATABASE_URL))
+
+
+# ------------------------------------------------------
+# 🧠 Query cache settings
+# ------------------------------------------------------
+QUERY_CACHE_ENABLED = os.getenv("DB_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("DB_CACHE_MAX_ENTRIES", "256"))
+QUERY_CACHE_DEFAULT_TTL = float(os.getenv("DB_CACHE_TTL", "30"))
+
+# Seconds a cached result stays valid per table. Writes made through this
+# module invalidate the table immediately; the TTL only bounds staleness
+# from writes made elsewhere (other processes, the Supabase dashboard).
+QUERY_CACHE_TTLS = {
+    'base_stock': 300,
+    'stock_notifications': 300,
+    'base_data': 600,
+    'forecasts': 600,
+    'forecast_output': 600,
+    'table_snapshots': 60,
+    'stock_history': 600,
+    'stock_history_snapshots': 600,
+}
+
+# Key columns appended to ORDER BY so page windows are stable and disjoint
+TABLE_KEYS = {
+    'base_data': ['product_sku', 'sales_date'],
+    'base_stock': ['product_sku'],
+    'stock_notifications': ['product_sku'],
+    'forecasts': ['product_sku', 'forecast_date'],
+    'forecast_output': ['product_sku', 'forecast_date'],
+    'stock_history': ['product_sku', 'snapshot_date'],
+    'stock_history_snapshots': ['snapshot_date'],
+    'manual_overrides': ['product_sku'],
+}
+
+# ------------------------------------------------------
+# 🧮 SQL subset translator (SELECT -> PostgREST)
+# ------------------------------------------------------
+_SQL_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^']|'')*')
+      | (?P<ident>"(?:[^"]|"")+")
+      | (?P<number>-?\d+(?:\.\d+)?)
+      | (?P<param>:[A-Za-z_]\w*)
+      | (?P<op><=|>=|<>|!=|=|<|>)
+      | (?P<punct>[(),*;])
+      | (?P<word>[^\s(),;=<>!'"]+)
+    )""", re.VERBOSE)
+
+_SQL_KEYWORDS = {
+    'select', 'distinct', 'from', 'where', 'and', 'or', 'order', 'by', 'asc', 'desc',
+    'limit', 'offset', 'in', 'is', 'not', 'null', 'like', 'ilike', 'between', 'as',
+    'true', 'false', 'nulls', 'first', 'last', 'join', 'group', 'having', 'union',
+}
+
+_OPERATOR_MAP = {'=': 'eq', '!=': 'neq', '<>': 'neq', '<': 'lt', '<=': 'lte', '>': 'gt', '>=': 'gte'}
+
+
+def _tokenize_sql(query: str) -> list:
+    """Split a SQL string into (kind, value) tokens"""
+    tokens = []
+    pos = 0
+    query = query.strip()
+    while pos < len(query):
+        match = _SQL_TOKEN_RE.match(query, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"Cannot parse SQL near: {query[pos:pos + 20]!r}")
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = value[1:-1].replace("''", "'")
+        elif kind == 'ident':
+            value = value[1:-1].replace('""', '"')
+        elif kind == 'word' and value.lower() in _SQL_KEYWORDS:
+            kind, value = 'keyword', value.lower()
+        tokens.append((kind, value))
+    while tokens and tokens[-1] == ('punct', ';'):
+        tokens.pop()
+    return tokens
+
+
+class _SqlParser:
+    """Recursive-descent parser for the SELECT subset used by the backend"""
+
+    def __init__(self, query: str, params: dict = None):
+        self.tokens = _tokenize_sql(query)
+        self.params = params or {}
+        self.pos = 0
+
+    def peek(self, offset=0):
+        idx = self.pos + offset
+        return self.tokens[idx] if idx < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise ValueError("Unexpected end of SQL")
+        self.pos += 1
+        return token
+
+    def accept_keyword(self, *words):
+        kind, value = self.peek()
+        if kind == 'keyword' and value in words:
+            self.pos += 1
+            return value
+        return None
+
+    def expect_keyword(self, word):
+        if not self.accept_keyword(word):
+            raise ValueError(f"Expected {word.upper()} near token {self.peek()[1]!r}")
+
+    def identifier(self):
+        kind, value = self.next()
+        if kind not in ('word', 'ident'):
+            raise ValueError(f"Expected identifier, got {value!r}")
+        return value
+
+    def literal(self):
+        kind, value = self.next()
+        if kind == 'string':
+            return value
+        if kind == 'number':
+            return float(value) if '.' in value else int(value)
+        if kind == 'param':
+            name = value[1:]
+            if name not in self.params:
+                raise ValueError(f"Missing value for query parameter :{name}")
+            return self.params[name]
+        if kind == 'keyword' and value in ('true', 'false'):
+            return value == 'true'
+        if kind == 'keyword' and value == 'null':
+            return None
+        raise ValueError(f"Expected literal value, got {value!r}")
+
+    def parse_select(self) -> dict:
+        self.expect_keyword('select')
+        spec = {
+            'table': None,
+            'columns': None,
+            'count': None,
+            'distinct': bool(self.accept_keyword('distinct')),
+            'filters': [],
+            'order': [],
+            'limit': None,
+            'offset': None,
+        }
+
+        if self.peek() == ('punct', '*'):
+            self.next()
+        elif str(self.peek()[1]).lower() == 'count' and self.peek(1) == ('punct', '('):
+            # COUNT(*) [AS alias] is answered by a head-only count request
+            self.pos += 2
+            if self.next() != ('punct', '*') or self.next() != ('punct', ')'):
+                raise ValueError("Only COUNT(*) is supported")
+            spec['count'] = self.identifier() if self.accept_keyword('as') else 'count'
+        else:
+            columns = []
+            while True:
+                name = self.identifier()
+                alias = None
+                if self.accept_keyword('as'):
+                    alias = self.identifier()
+                columns.append((name, alias))
+                if self.peek() != ('punct', ','):
+                    break
+                self.next()
+            spec['columns'] = columns
+
+        self.expect_keyword('from')
+        spec['table'] = self.identifier()
+
+        if self.accept_keyword('where'):
+            self.parse_conditions(spec['filters'])
+
+        if self.accept_keyword('order'):
+            self.expect_keyword('by')
+            while True:
+                column = self.identifier()
+                desc = self.accept_keyword('asc', 'desc') == 'desc'
+                if self.accept_keyword('nulls'):
+                    self.accept_keyword('first', 'last')
+                spec['order'].append((column, desc))
+                if self.peek() != ('punct', ','):
+                    break
+                self.next()
+
+        if self.accept_keyword('limit'):
+            spec['limit'] = int(self.literal())
+        if self.accept_keyword('offset'):
+            spec['offset'] = int(self.literal())
+
+        if self.peek()[0] is not None:
+            raise ValueError(f"Unsupported SQL clause near {self.peek()[1]!r}")
+        return spec
+
+    def parse_conditions(self, filters: list):
+        while True:
+            column = self.identifier()
+            negate = bool(self.accept_keyword('not'))
+            kind, value = self.peek()
+
+            if kind == 'op' and not negate:
+                self.next()
+                operand = self.literal()
+                op = _OPERATOR_MAP[value]
+                if operand is None and op in ('eq', 'neq'):
+                    filters.append((column, 'is' if op == 'eq' else 'not_is', None))
+                else:
+                    filters.append((column, op, operand))
+            elif self.accept_keyword('in'):
+                if self.next() != ('punct', '('):
+                    raise ValueError("Expected '(' after IN")
+                values = []
+                while True:
+                    values.append(self.literal())
+                    token = self.next()
+                    if token == ('punct', ')'):
+                        break
+                    if token != ('punct', ','):
+                        raise ValueError("Expected ',' or ')' in IN list")
+                filters.append((column, 'not_in' if negate else 'in', values))
+            elif self.accept_keyword('is'):
+                is_not = bool(self.accept_keyword('not'))
+                self.expect_keyword('null')
+                filters.append((column, 'not_is' if is_not else 'is', None))
+            elif self.accept_keyword('like', 'ilike'):
+                op = self.tokens[self.pos - 1][1]
+                filters.append((column, f'not_{op}' if negate else op, self.literal()))
+            elif self.accept_keyword('between') and not negate:
+                low = self.literal()
+                self.expect_keyword('and')
+                high = self.literal()
+                filters.append((column, 'gte', low))
+                filters.append((column, 'lte', high))
+            else:
+                raise ValueError(f"Unsupported condition on column {column!r}")
+
+            if not self.accept_keyword('and'):
+                break
+
+
+def parse_select(query: str, params: dict = None) -> dict:
+    """
+    Parse a SELECT statement from the supported subset into a query spec:
+    projection (with aliases) or COUNT(*), DISTINCT, AND-ed equality/range/IN/IS/LIKE
+    filters, ORDER BY, LIMIT and OFFSET. Raises ValueError for anything else.
+    Values may be passed as :name placeholders resolved from params.
+    """
+    return _SqlParser(query, params).parse_select()
+
+
+def _or_condition(column: str, op: str, value) -> str:
+    """One condition of a PostgREST or=(...) expression; values are quoted"""
+    if op in ('is', 'not_is'):
+        return f"{column}.{'not.' if op == 'not_is' else ''}is.null"
+    if op not in ('eq', 'neq', 'lt', 'lte', 'gt', 'gte'):
+        raise ValueError(f"Unsupported operator '{op}' inside an OR filter")
+    quoted = '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return f"{column}.{op}.{quoted}"
+
+
+def _or_expression(groups: list) -> str:
+    """PostgREST or= expression matching any of the AND-ed filter groups"""
+    parts = []
+    for group in groups:
+        conditions = [_or_condition(*condition) for condition in group]
+        parts.append(conditions[0] if len(conditions) == 1 else f"and({','.join(conditions)})")
+    return ','.join(parts)
+
+
+def _apply_filters(builder, filters: list):
+    """
+    Apply parsed WHERE filters to a PostgREST request builder.
+    Besides (column, op, value) conditions, (None, 'or', [group, ...]) matches
+    rows satisfying any group of AND-ed (column, op, value) conditions.
+    """
+    for column, op, value in filters:
+        if op == 'or':
+            builder = builder.or_(_or_expression(value))
+        elif op == 'in':
+            builder = builder.in_(column, value)
+        elif op == 'not_in':
+            builder = builder.not_.in_(column, value)
+        elif op == 'is':
+            builder = builder.is_(column, 'null')
+        elif op == 'not_is':
+            builder = builder.not_.is_(column, 'null')
+        elif op.startswith('not_'):
+            builder = getattr(builder.not_, op[4:])(column, value)
+        else:
+            builder = getattr(builder, op)(column, value)
+    return builder
+
+
+def _projection(spec: dict) -> str:
+    """Build the PostgREST select= string for a query spec"""
+    if not spec['columns']:
+        return '*'
+    return ','.join(f'{alias}:{name}' if alias else name for name, alias in spec['columns'])
+
+
+def build_select(spec: dict, **select_kwargs):
+    """Translate a parsed query spec into a PostgREST select request builder"""
+    builder = supabase.table(spec['table']).select(_projection(spec), **select_kwargs)
+    builder = _apply_filters(builder, spec['filters'])
+    for column, desc in spec['order']:
+        builder = builder.order(column, desc=desc)
+
+    # DISTINCT is applied client-side, so the row window must be sliced afterwards
+    if not spec['distinct']:
+        if spec['limit'] is not None:
+            start = spec['offset'] or 0
+            builder = builder.range(start, start + spec['limit'] - 1)
+        elif spec['offset']:
+            builder = builder.offset(spec['offset'])
+    return builder
+
+
+def _finalize_frame(df: pd.DataFrame, spec: dict) -> pd.DataFrame:
+    """Apply the parts of a query spec that PostgREST cannot evaluate"""
+    df = _drop_snapshot_column(df, spec)
+    if spec['distinct'] and not df.empty:
+        df = df.drop_duplicates().reset_index(drop=True)
+        start = spec['offset'] or 0
+        end = start + spec['limit'] if spec['limit'] is not None else None
+        df = df.iloc[start:end].reset_index(drop=True)
+    return df
+
+
+# ------------------------------------------------------
+# 🧠 Read-through query cache
+# ------------------------------------------------------
+_query_cache = OrderedDict()  # key -> (expires_at, table, value)
+_query_cache_lock = threading.Lock()
+_query_cache_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+# Bumped on every invalidation; a read only caches its result if its table's
+# generation did not move while it was in flight
+_cache_generations = {}
+_cache_global_generation = 0
+
+
+def _cache_key(kind: str, spec: dict) -> str:
+    """Normalized key: the parsed spec, so formatting and bound params don't matter"""
+    return kind + ':' + json.dumps(spec, sort_keys=True, default=str)
+
+
+def _cache_get(key: str):
+    with _query_cache_lock:
+        entry = _query_cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            _query_cache.move_to_end(key)
+            _query_cache_stats['hits'] += 1
+            return entry[2]
+        if entry is not None:
+            del _query_cache[key]
+        _query_cache_stats['misses'] += 1
+        return None
+
+
+def _cache_generation(table_name: str) -> tuple:
+    with _query_cache_lock:
+        return _cache_global_generation, _cache_generations.get(table_name, 0)
+
+
+def _cache_put(key: str, table_name: str, value, generation: tuple = None):
+    ttl = QUERY_CACHE_TTLS.get(table_name, QUERY_CACHE_DEFAULT_TTL)
+    if ttl <= 0:
+        return
+    with _query_cache_lock:
+        current = (_cache_global_generation, _cache_generations.get(table_name, 0))
+        if generation is not None and generation != current:
+            # A write touched the table while this result was being read
+            return
+        _query_cache[key] = (time.monotonic() + ttl, table_name, value)
+        _query_cache.move_to_end(key)
+        while len(_query_cache) > QUERY_CACHE_MAX_ENTRIES:
+            _query_cache.popitem(last=False)
+
+
+def invalidate_cache(table_name: str = None):
+    """Drop cached results for one table, or for every table"""
+    global _cache_global_generation
+    with _query_cache_lock:
+        if table_name is None:
+            _cache_global_generation += 1
+        else:
+            _cache_generations[table_name] = _cache_generations.get(table_name, 0) + 1
+        keys = [k for k, entry in _query_cache.items() if table_name is None or entry[1] == table_name]
+        for key in keys:
+            del _query_cache[key]
+        _query_cache_stats['invalidations'] += 1
+
+
+@contextlib.contextmanager
+def _invalidating(table_name: str = None):
+    """
+    Invalidate a table's cached reads around a write: before it, and again
+    after it (also when it fails). Reads that were in flight meanwhile see
+    the generation move and do not cache pre-write rows for a whole TTL.
+    """
+    invalidate_cache(table_name)
+    try:
+        yield
+    finally:
+        invalidate_cache(table_name)
+
+
+def cache_stats() -> dict:
+    """Hit/miss counters and current size of the query cache"""
+    with _query_cache_lock:
+        lookups = _query_cache_stats['hits'] + _query_cache_stats['misses']
+        return dict(
+            _query_cache_stats,
+            enabled=QUERY_CACHE_ENABLED,
+            entries=len(_query_cache),
+            hit_rate=round(_query_cache_stats['hits'] / lookups, 3) if lookups else 0.0,
+        )
+
+
+def metrics_snapshot(reset: bool = False) -> dict:
+    """Per-(operation, table) latency/rows/bytes histograms from db_metrics"""
+    snapshot = db_metrics.registry.snapshot()
+    if reset:
+        db_metrics.registry.reset()
+    return snapshot
+
+
+# ------------------------------------------------------
+# 🧱 Storage primitives (dispatch to Supabase or the local store)
+# ------------------------------------------------------
+def _select_distinct(spec: dict) -> pd.DataFrame:
+    """
+    DISTINCT is evaluated client-side, and one request is capped at the
+    PostgREST max-rows, so every matching row is read in READ_PAGE_SIZE
+    Range windows before de-duplicating and slicing the requested window.
+    """
+    rows_spec = dict(spec, distinct=False, limit=None, offset=None)
+    # Tie-break on the table key so windows neither overlap nor skip rows
+    ordered = [column for column, _ in spec['order']]
+    rows_spec['order'] = spec['order'] + [
+        (column, False) for column in TABLE_KEYS.get(spec['table'], []) if column not in ordered
+    ]
+    total = run_count(rows_spec)
+    pages = [
+        pd.DataFrame(build_select(dict(rows_spec, limit=READ_PAGE_SIZE, offset=start)).execute().data)
+        for start in range(0, total, READ_PAGE_SIZE)
+    ]
+    pages = [page for page in pages if not page.empty]
+    return _finalize_frame(pd.concat(pages, ignore_index=True) if pages else pd.DataFrame(), spec)
+
+
+def run_select(spec: dict) -> pd.DataFrame:
+    """Fetch the rows described by a query spec (served from the cache when fresh)"""
+    key = _cache_key('select', spec) if QUERY_CACHE_ENABLED else None
+    if key is not None:
+        cached = _cache_get(key)
+        if cached is not None:
+            return cached.copy()
+        generation = _cache_generation(spec['table'])
+
+    with db_metrics.timed('select', spec['table'], local_store is None) as call:
+        if local_store is not None:
+            df = pd.DataFrame(local_store.select(spec))
+        elif spec['distinct']:
+            df = _select_distinct(spec)
+        else:
+            df = _finalize_frame(pd.DataFrame(build_select(spec).execute().data), spec)
+        call['rows'] = len(df)
+
+    if key is not None:
+        _cache_put(key, spec['table'], df.copy(), generation)
+    return df
+
+
+def run_count(spec: dict, mode: str = 'exact') -> int:
+    """
+    Count the rows matching a query spec's filters with a head-only request.
+    mode: 'exact' (COUNT(*)), 'planned' (planner estimate) or 'estimated'
+    (exact for small results, planner estimate above PostgREST's threshold).
+    """
+    count_spec = dict(spec, columns=None, count=None, order=[], limit=None, offset=None)
+    key = _cache_key(f'count:{mode}', count_spec) if QUERY_CACHE_ENABLED else None
+    if key is not None:
+        cached = _cache_get(key)
+        if cached is not None:
+            return cached
+        generation = _cache_generation(spec['table'])
+
+    with db_metrics.timed('count', spec['table'], local_store is None):
+        if local_store is not None:
+            count = local_store.count(count_spec)
+        else:
+            result = build_select(count_spec, count=CountMethod(mode), head=True).execute()
+            count = int(result.count or 0)
+
+    if key is not None:
+        _cache_put(key, spec['table'], count, generation)
+    return count
+
+
+def run_write(table_name: str, records: list, on_conflict: str = None, returning: bool = True) -> list:
+    """Insert (or upsert on `on_conflict`) already-sanitized records"""
+    with _invalidating(table_name), \
+            db_metrics.timed('upsert' if on_conflict else 'insert', table_name, local_store is None) as call:
+        call['rows'] = len(records)
+        if local_store is not None:
+            return local_store.write(table_name, records, on_conflict)
+        method = ReturnMethod.representation if returning else ReturnMethod.minimal
+        query = supabase.table(table_name)
+        if on_conflict:
+            query = query.upsert(records, on_conflict=on_conflict, returning=method)
+        else:
+            query = query.insert(records, returning=method)
+        return query.execute().data
+
+
+def run_update(table_name: str, data: dict, filters: list) -> list:
+    """Update the rows matching filters and return them"""
+    with _invalidating(table_name), db_metrics.timed('update', table_name, local_store is None) as call:
+        if local_store is not None:
+            rows = local_store.update(table_name, data, filters)
+        else:
+            rows = _apply_filters(supabase.table(table_name).update(data), filters).execute().data
+        call['rows'] = len(rows or [])
+        return rows
+
+
+def _delete_all_filter(table_name: str) -> list:
+    """PostgREST refuses unfiltered deletes; pick a condition every row matches"""
+    if table_name == 'base_data':
+        # For base_data, use sales_year >= 0 which matches all rows
+        return [('sales_year', 'gte', 0)]
+    elif table_name == 'base_stock':
+        # For base_stock, use stock_level >= 0 which matches all rows
+        return [('stock_level', 'gte', 0)]
+    elif table_name in ['stock_notifications', 'forecasts', 'forecast_output']:
+        return [('product_sku', 'not_is', None)]
+    # For other tables with 'id' column, use id >= 0
+    return [('id', 'gte', 0)]
+
+
+def run_delete(table_name: str, filters: list) -> list:
+    """Delete the rows matching filters; an empty filter list deletes every row"""
+    with _invalidating(table_name), db_metrics.timed('delete', table_name, local_store is None) as call:
+        if local_store is not None:
+            rows = local_store.delete(table_name, filters)
+        else:
+            filters = filters or _delete_all_filter(table_name)
+            rows = _apply_filters(supabase.table(table_name).delete(), filters).execute().data
+        call['rows'] = len(rows or [])
+        return rows
+
+
+def run_sql(query: str):
+    """Execute a DDL statement"""
+    with _invalidating(None), db_metrics.timed('sql', db_metrics.table_label(query), local_store is None):
+        if local_store is not None:
+            return local_store.execute_sql(query)
+        return supabase.rpc('exec_sql', {'query': query}).execute()
+
+
+def _table_spec(table_name: str, filters: list = None, columns: list = None, limit: int = None,
+                order: list = None) -> dict:
+    """Build a query spec programmatically"""
+    return {
+        'table': table_name, 'columns': columns, 'count': None, 'distinct': False,
+        'filters': filters or [], 'order': order or [], 'limit': limit, 'offset': None,
+    }
+
+
+@instrumented('execute_query', none_is_error=False)
 def execute_query(query: str, params: dict = None) -> pd.DataFrame:
     """
-    Execute a query using Supabase and return results as a DataFrame
+    Execute a query against the configured backend and return results as a DataFrame.
+    SELECT statements are translated into PostgREST filters, ordering and
+    ranges (or SQLite SQL for the local backend) so only the requested rows
+    and columns are transferred.
     """
-    if not SUPABASE_AVAILABLE or supabase is None:
-        print("⚠️ Supabase not available - cannot execute query")
+    if not DB_AVAILABLE:
+        print("⚠️ Database not available - cannot execute query")
         return pd.DataFrame()
     
     try:
         # For SELECT queries
         if query.lower().strip().startswith('select'):
-            table_name = query.lower().split('from')[1].split()[0].strip()
-            result = supabase.table(table_name).select('*').execute()
-            return pd.DataFrame(result.data)
+            spec = scope_to_live_snapshot(parse_select(query, params))
+            if spec['count']:
+                return pd.DataFrame({spec['count']: [run_count(spec)]})
+            return _drop_snapshot_column(run_select(spec), spec)
             
         # For CREATE TABLE queries
         elif query.lower().strip().startswith('create table'):
@@ -54,10 +792,7 @@ def execute_query(query: str, params: dict = None) -> pd.DataFrame:
             table_name = query.split('CREATE TABLE IF NOT EXISTS')[1].split('(')[0].strip()
             print(f"[DB] Creating table {table_name}")
             
-            result = supabase.rpc(
-                'exec_sql',
-                {'query': query}
-            ).execute()
+            run_sql(query)
             
             print(f"[DB] ✅ Table {table_name} created successfully")
             return pd.DataFrame()
@@ -70,120 +805,347 @@ def execute_query(query: str, params: dict = None) -> pd.DataFrame:
         print(f"❌ Query failed: {str(e)}")
         return pd.DataFrame()
 
-def insert_data(table_name: str, data: dict | list):
+def count_rows_for(spec: dict) -> int:
+    """Return the exact number of rows matching a query spec's filters"""
+    return run_count(spec)
+
+
+COUNT_MODES = {'exact', 'planned', 'estimated'}
+
+
+@instrumented('count_rows', none_is_error=False)
+def count_rows(table_name: str, where: str = None, params: dict = None, mode: str = 'exact') -> int:
     """
-    Insert data into a table using Supabase
+    Count rows in a table without transferring them. `where` is an optional
+    condition in the same SQL subset as execute_query, e.g.
+        count_rows('base_stock', "flag = :flag", {'flag': 'active'})
+    Returns 0 if the database is unavailable or the count fails.
     """
-    if not SUPABASE_AVAILABLE or supabase is None:
-        print("⚠️ Supabase not available - cannot insert data")
-        return None
-    
+    if mode not in COUNT_MODES:
+        raise ValueError(f"Unknown count mode '{mode}', expected one of {sorted(COUNT_MODES)}")
+    if not DB_AVAILABLE:
+        print("⚠️ Database not available - cannot count rows")
+        return 0
+
+    query = f"SELECT COUNT(*) FROM {table_name}" + (f" WHERE {where}" if where else "")
     try:
-        # Import required libraries inside function for reliability
-        import pandas as _pd
-        import numpy as _np
-        from datetime import datetime as _dt
-        
-        def sanitize_value(v):
-            """Helper function to sanitize a single value"""
-            if v is None:
-                return None
-            elif _pd.isna(v):
-                return None
-            elif isinstance(v, (_pd.Timestamp, _dt)):
-                return v.isoformat()
-            elif isinstance(v, (_np.integer, _np.int64, _np.int32)):
-                return int(v)
-            elif isinstance(v, (_np.floating, _np.float64, _np.float32)):
-                return float(v)
-            elif isinstance(v, _np.bool_):
-                return bool(v)
-            elif isinstance(v, (str, int, float, bool)):
-                return v
-            elif isinstance(v, bytes):
-                return v.decode('utf-8')
-            else:
-                try:
-                    # Try converting to string as last resort
-                    return str(v)
-                except:
-                    return None
-
-        def sanitize_record(rec):
-            """Helper function to sanitize a single record"""
-            if not isinstance(rec, dict):
-                return rec
-            
-            # Define integer fields that should be converted from float
-            integer_fields = {'stock_level', 'last_stock', 'min_stock', 'reorder_qty', 'unchanged_counter'}
-            
-            sanitized = {}
-            for k, v in rec.items():
+        return run_count(scope_to_live_snapshot(parse_select(query, params)), mode)
+    except Exception as e:
+        print(f"❌ Count failed: {str(e)}")
+        return 0
+
+
+def _fetch_page(spec: dict, start: int, size: int) -> pd.DataFrame:
+    page_spec = dict(spec, limit=size, offset=start)
+    return _drop_snapshot_column(run_select(page_spec), spec)
+
+
+def read_table_pages(query: str, params: dict = None, page_size: int = None, max_workers: int = None):
+    """
+    Stream the result of a SELECT as DataFrame chunks of at most page_size rows.
+    The matching row count is fetched first, then Range windows are requested
+    with at most max_workers pages in flight. Chunks are yielded in order.
+    """
+    if not DB_AVAILABLE:
+        print("⚠️ Database not available - cannot read table")
+        return
+
+    page_size = page_size or READ_PAGE_SIZE
+    max_workers = max_workers or READ_CONCURRENCY
+
+    spec = scope_to_live_snapshot(parse_select(query, params))
+    if spec['distinct'] or spec['count']:
+        raise ValueError("DISTINCT and COUNT queries cannot be paged; use execute_query instead")
+
+    # Tie-break on the table key so windows neither overlap nor skip rows
+    ordered = [column for column, _ in spec['order']]
+    spec = dict(spec, order=spec['order'] + [
+        (column, False) for column in TABLE_KEYS.get(spec['table'], []) if column not in ordered
+    ])
+
+    total = count_rows_for(spec)
+    start = spec['offset'] or 0
+    end = total if spec['limit'] is None else min(total, start + spec['limit'])
+    windows = [(i, min(page_size, end - i)) for i in range(start, end, page_size)]
+    print(f"[DB] Reading {max(end - start, 0)} rows from {spec['table']} in {len(windows)} pages")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = deque()
+        for window in windows:
+            pending.append(pool.submit(_fetch_page, spec, *window))
+            if len(pending) >= max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+@instrumented('read_table')
+def read_table(query: str, params: dict = None, page_size: int = None, max_workers: int = None) -> pd.DataFrame:
+    """
+    Read the full result of a SELECT through paged range requests and return
+    it as one DataFrame. Unlike execute_query this is not truncated by the
+    PostgREST max-rows cap. Returns None if the read failed, so a failure is
+    never mistaken for an empty table.
+    """
+    try:
+        chunks = [chunk for chunk in read_table_pages(query, params, page_size, max_workers) if not chunk.empty]
+        if not chunks:
+            return pd.DataFrame()
+        return pd.concat(chunks, ignore_index=True)
+    except Exception as e:
+        print(f"❌ Paged read failed: {str(e)}")
+        return None
+
+
+# ------------------------------------------------------
+# 🧼 Record sanitization
+# ------------------------------------------------------
+# Integer columns that arrive as floats from pandas and must be sent as ints
+INTEGER_FIELDS = {'stock_level', 'last_stock', 'min_stock', 'reorder_qty', 'unchanged_counter'}
+
+
+def sanitize_value(v):
+    """Convert a single value into something JSON-serializable"""
+    if v is None:
+        return None
+    elif pd.isna(v):
+        return None
+    elif isinstance(v, (pd.Timestamp, datetime)):
+        return v.isoformat()
+    elif isinstance(v, (np.integer, np.int64, np.int32)):
+        return int(v)
+    elif isinstance(v, (np.floating, np.float64, np.float32)):
+        return float(v)
+    elif isinstance(v, np.bool_):
+        return bool(v)
+    elif isinstance(v, (str, int, float, bool)):
+        return v
+    elif isinstance(v, bytes):
+        return v.decode('utf-8')
+    else:
+        try:
+            # Try converting to string as last resort
+            return str(v)
+        except:
+            return None
+
+
+def sanitize_record(rec):
+    """Sanitize every value of a single record"""
+    if not isinstance(rec, dict):
+        return rec
+
+    sanitized = {}
+    for k, v in rec.items():
+        try:
+            # Handle float to int conversion for specific fields
+            if k in INTEGER_FIELDS and v is not None and not pd.isna(v):
                 try:
-                    # Handle float to int conversion for specific fields
-                    if k in integer_fields and v is not None and not _pd.isna(v):
-                        try:
-                            sanitized[k] = int(float(v))
-                        except (ValueError, TypeError):
-                            print(f"[DB] Warning: Could not convert {k}={v} to integer")
-                            sanitized[k] = None
-                    else:
-                        sanitized[k] = sanitize_value(v)
-                except Exception as e:
-                    print(f"[DB] Warning: Failed to sanitize value for key {k}: {str(e)}")
+                    sanitized[k] = int(float(v))
+                except (ValueError, TypeError):
+                    print(f"[DB] Warning: Could not convert {k}={v} to integer")
                     sanitized[k] = None
-            return sanitized
+            else:
+                sanitized[k] = sanitize_value(v)
+        except Exception as e:
+            print(f"[DB] Warning: Failed to sanitize value for key {k}: {str(e)}")
+            sanitized[k] = None
+    return sanitized
+
+
+def sanitize_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Column-wise counterpart of sanitize_record: integer fields are truncated
+    to nullable ints and unparseable values become NA. NaN/NaT, timestamps
+    and numpy scalars are handled by the JSON encoder in frame_to_records.
+    """
+    df = df.copy()
+    for column in INTEGER_FIELDS.intersection(df.columns):
+        values = pd.to_numeric(df[column], errors='coerce')
+        invalid = values.isna() & df[column].notna()
+        if invalid.any():
+            print(f"[DB] Warning: Could not convert {int(invalid.sum())} values of {column} to integer")
+        df[column] = np.trunc(values).astype('Int64')
+    return df
+
+
+def frame_to_records(df: pd.DataFrame) -> list:
+    """
+    Convert a DataFrame into JSON-safe records without per-cell Python code:
+    NaN/NaT -> None, timestamps -> ISO strings, numpy scalars -> int/float/bool.
+    """
+    if df.empty:
+        return []
+    # double_precision=15 (the maximum): the default of 10 digits rounds floats
+    payload = sanitize_frame(df).to_json(
+        orient='records', date_format='iso', date_unit='us',
+        default_handler=str, force_ascii=False, double_precision=15
+    )
+    return json.loads(payload)
+
+
+# ------------------------------------------------------
+# 📦 Bulk loader
+# ------------------------------------------------------
+def _is_transient(error: Exception) -> bool:
+    """True for network errors, timeouts, throttling and 5xx responses"""
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, APIError):
+        code = error.code
+        if isinstance(code, int) or (isinstance(code, str) and code.isdigit() and len(code) == 3):
+            return int(code) in TRANSIENT_HTTP_STATUSES
+        return code in TRANSIENT_PG_CODES
+    return False
+
+
+def _send_batch(table_name: str, batch: list, on_conflict: str, max_retries: int):
+    """Send one batch, retrying transient failures with exponential backoff.
+    Returns (retries_used, error) where error is None on success."""
+    attempt = 0
+    while True:
+        try:
+            run_write(table_name, batch, on_conflict, returning=False)
+            return attempt, None
+        except Exception as e:
+            if attempt >= max_retries or not _is_transient(e):
+                return attempt, e
+            delay = WRITE_RETRY_BASE_DELAY * (2 ** attempt) * (1 + random.random())
+            attempt += 1
+            db_metrics.registry.add_retries('upsert' if on_conflict else 'insert', table_name)
+            print(f"[DB] ⚠️ Transient error on {table_name} ({e}), retry {attempt}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def _copy_insert(table_name: str, data: pd.DataFrame, on_conflict: str, report: dict) -> bool:
+    """Load through pg_copy.copy_merge and fill in the bulk_insert report.
+    The merge is transactional, so a failure leaves nothing behind to undo."""
+    from pg_copy import copy_merge
+    started = time.perf_counter()
+    try:
+        print(f"[DB] COPY-loading {report['rows_total']} records into {table_name}")
+        invalidate_cache(table_name)
+        with db_metrics.timed('copy', table_name, count_bytes=False) as call:
+            call['rows'] = report['rows_total']
+            copy_merge(DATABASE_URL, table_name, sanitize_frame(data), on_conflict, chunk_rows=COPY_CHUNK_ROWS)
+    except Exception as e:
+        report['errors'].append(f"copy: {e}")
+        print(f"[DB] ❌ COPY into {table_name} failed: {e}")
+        return False
+    finally:
+        invalidate_cache(table_name)
+
+    report.update(rows_written=report['rows_total'], batches=1, method='copy', complete=True)
+    print(f"[DB] ✅ {table_name}: {report['rows_written']} rows COPY-loaded "
+          f"in {time.perf_counter() - started:.2f}s")
+    return True
+
 
+def bulk_insert(table_name: str, data: list | pd.DataFrame, on_conflict: str = None,
+                batch_size: int = None, max_workers: int = None, max_retries: int = None) -> dict:
+    """
+    Load records in batches with up to max_workers requests in flight.
+    Transient failures are retried with exponential backoff; when
+    on_conflict is given the batches are upserts on that column.
+
+    Large loads use a direct Postgres COPY instead when DATABASE_URL is
+    configured (see pg_copy), falling back to REST batches if it fails.
+
+    Returns a report:
+        {'table', 'rows_total', 'rows_written', 'rows_retried', 'rows_failed',
+         'batches', 'failed_batches', 'errors', 'method', 'complete'}
+    """
+    batch_size = batch_size or WRITE_BATCH_SIZE
+    max_workers = max_workers or WRITE_CONCURRENCY
+    max_retries = WRITE_MAX_RETRIES if max_retries is None else max_retries
+
+    if not isinstance(data, pd.DataFrame):
+        data = pd.DataFrame.from_records(data)
+    records = frame_to_records(data)
+    batches = [records[i:i + batch_size] for i in range(0, len(records), batch_size)]
+
+    report = {
+        'table': table_name,
+        'rows_total': len(records),
+        'rows_written': 0,
+        'rows_retried': 0,
+        'rows_failed': 0,
+        'batches': len(batches),
+        'failed_batches': [],
+        'errors': [],
+        'method': 'rest',
+        'complete': False,
+    }
+
+    if not DB_AVAILABLE:
+        print("⚠️ Database not available - cannot insert data")
+        report['rows_failed'] = len(records)
+        report['errors'].append("Supabase not available")
+        return report
+
+    if len(records) >= COPY_MIN_ROWS and copy_available():
+        if _copy_insert(table_name, data, on_conflict, report):
+            return report
+        print(f"[DB] ⚠️ COPY load into {table_name} failed, falling back to REST batches")
+
+    print(f"[DB] Loading {len(records)} records into {table_name} "
+          f"({len(batches)} batches, {max_workers} in flight)")
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(_send_batch, table_name, batch, on_conflict, max_retries) for batch in batches]
+        for number, (batch, future) in enumerate(zip(batches, futures), start=1):
+            retries, error = future.result()
+            if retries:
+                report['rows_retried'] += len(batch)
+            if error is None:
+                report['rows_written'] += len(batch)
+            else:
+                report['rows_failed'] += len(batch)
+                report['failed_batches'].append(number)
+                report['errors'].append(f"batch {number}: {error}")
+                print(f"[DB] ❌ Batch {number}/{len(batches)} into {table_name} failed: {error}")
+
+    report['complete'] = report['rows_failed'] == 0
+    status = "✅" if report['complete'] else "❌"
+    print(f"[DB] {status} {table_name}: {report['rows_written']}/{report['rows_total']} rows written, "
+          f"{report['rows_retried']} retried, {report['rows_failed']} failed")
+    return report
+
+
+@instrumented('insert_data')
+def insert_data(table_name: str, data: dict | list | pd.DataFrame):
+    """
+    Insert data into a table using Supabase.
+    Lists of records and DataFrames go through bulk_insert and return its
+    report; if any batch fails nothing partial is reported as success and
+    None is returned.
+    """
+    if not DB_AVAILABLE:
+        print("⚠️ Database not available - cannot insert data")
+        return None
+    
+    try:
         # Get record count for logging
-        total_records = len(data) if isinstance(data, list) else 1
+        total_records = len(data) if isinstance(data, (list, pd.DataFrame)) else 1
         print(f"[DB] Inserting {total_records} records into {table_name}")
 
-        # Apply sanitization
-        if isinstance(data, list):
-            clean_data = []
-            for idx, record in enumerate(data):
-                try:
-                    clean_record = sanitize_record(record)
-                    clean_data.append(clean_record)
-                except Exception as e:
-                    print(f"[DB] Warning: Failed to sanitize record {idx}: {str(e)}")
-                    continue
-        else:
-            clean_data = sanitize_record(data)
+        if isinstance(data, (list, pd.DataFrame)):
+            if total_records == 0:
+                raise ValueError("No valid records to insert after sanitization")
+            report = bulk_insert(table_name, data)
+            if not report['complete']:
+                raise Exception(
+                    f"{report['rows_failed']} of {report['rows_total']} rows failed "
+                    f"(batches {report['failed_batches']})"
+                )
+            return report
 
-        if not clean_data or (isinstance(clean_data, list) and not clean_data):
+        clean_data = sanitize_record(data)
+        if not clean_data:
             raise ValueError("No valid records to insert after sanitization")
 
-        # Insert in batches if needed
-        if isinstance(clean_data, list) and len(clean_data) > 1000:
-            batch_size = 1000
-            results = []
-            
-            for i in range(0, len(clean_data), batch_size):
-                batch = clean_data[i:i + batch_size]
-                if not batch:
-                    continue
-                    
-                print(f"[DB] Inserting batch {i//batch_size + 1}/{(len(clean_data) + batch_size - 1)//batch_size}")
-                
-                try:
-                    result = supabase.table(table_name).insert(batch).execute()
-                    print(f"[DB] ✅ Batch {i//batch_size + 1} inserted successfully")
-                    if result and result.data:
-                        results.extend(result.data)
-                except Exception as e:
-                    print(f"[DB] ❌ Batch {i//batch_size + 1} insert failed: {str(e)}")
-                    continue
-            
-            if not results:
-                raise Exception("All batch inserts failed")
-                
-            return results
-            
-        else:
-            result = supabase.table(table_name).insert(clean_data).execute()
-            print(f"[DB] ✅ Successfully inserted {total_records} records into {table_name}")
-            return result.data
+        result = run_write(table_name, [clean_data])
+        print(f"[DB] ✅ Successfully inserted {total_records} records into {table_name}")
+        return result
 
     except Exception as e:
         print(f"[DB] ❌ Insert failed: {str(e)}")
@@ -192,7 +1154,11 @@ def insert_data(table_name: str, data: dict | list):
         print("\n[DB] Debug Information:")
         print("-" * 50)
         
-        if isinstance(data, list) and data:
+        if isinstance(data, pd.DataFrame) and not data.empty:
+            print("Sample record before sanitization:")
+            for k, v in data.iloc[0].items():
+                print(f"  {k}: {type(v)} = {v}")
+        elif isinstance(data, list) and data:
             print("Sample record before sanitization:")
             sample = data[0]
             if isinstance(sample, dict):
@@ -209,53 +1175,387 @@ def insert_data(table_name: str, data: dict | list):
         print("-" * 50)
         return None
 
+@instrumented('update_data')
 def update_data(table_name: str, data: dict, match_column: str, match_value: any):
     """
     Update data in a table using Supabase
     """
-    if not SUPABASE_AVAILABLE or supabase is None:
-        print("⚠️ Supabase not available - cannot update data")
+    if not DB_AVAILABLE:
+        print("⚠️ Database not available - cannot update data")
         return None
     
     try:
-        result = supabase.table(table_name).update(data).eq(match_column, match_value).execute()
-        return result.data
+        return run_update(table_name, data, [(match_column, 'eq', match_value)])
     except Exception as e:
         print(f"❌ Update failed: {str(e)}")
         return None
 
+@instrumented('delete_data')
 def delete_data(table_name: str, match_column: str, match_value: any):
     """
     Delete data from a table using Supabase
     """
-    if not SUPABASE_AVAILABLE or supabase is None:
-        print("⚠️ Supabase not available - cannot delete data")
+    if not DB_AVAILABLE:
+        print("⚠️ Database not available - cannot delete data")
         return None
     
     try:
         # Special case: if match_value == '*' or None, delete all rows from the table
         if match_value == '*' or match_value is None:
-            # Use table-specific logic for deleting all rows
-            if table_name == 'base_data':
-                # For base_data, use sales_year >= 0 which matches all rows
-                result = supabase.table(table_name).delete().gte('sales_year', 0).execute()
-            elif table_name == 'base_stock':
-                # For base_stock, use stock_level >= 0 which matches all rows
-                result = supabase.table(table_name).delete().gte('stock_level', 0).execute()
-            elif table_name == 'stock_notifications':
-                # For stock_notifications, use a condition that matches all rows
-                result = supabase.table(table_name).delete().neq('product_sku', None).execute()
-            elif table_name in ['forecasts', 'forecast_output']:
-                # For forecast tables, use a condition that matches all rows
-                result = supabase.table(table_name).delete().neq('product_sku', None).execute()
-            else:
-                # For other tables with 'id' column, use id >= 0
-                result = supabase.table(table_name).delete().gte('id', 0).execute()
+            result = run_delete(table_name, [])
         else:
-            result = supabase.table(table_name).delete().eq(match_column, match_value).execute()
+            result = run_delete(table_name, [(match_column, 'eq', match_value)])
         
         print(f"[DB] ✅ Successfully deleted from {table_name}")
-        return result.data
+        return result
     except Exception as e:
         print(f"❌ Delete failed: {e}")
         return None
+
+
+# ------------------------------------------------------
+# 🔀 Diff-apply writes
+# ------------------------------------------------------
+# Bookkeeping columns that change on every write and never count as a difference
+DIFF_IGNORED_COLUMNS = {'id', 'created_at', 'updated_at'}
+
+
+def _columns_differ(new: pd.Series, old: pd.Series) -> pd.Series:
+    """Element-wise inequality that treats NaN/None as equal and 5 == 5.0"""
+    new_num = pd.to_numeric(new, errors='coerce')
+    old_num = pd.to_numeric(old, errors='coerce')
+    both_numeric = new_num.notna() & old_num.notna()
+    numeric_diff = (new_num - old_num).abs() > 1e-9
+
+    new_str = new.astype(object).where(new.notna(), '').astype(str)
+    old_str = old.astype(object).where(old.notna(), '').astype(str)
+    text_diff = new_str != old_str
+
+    return (both_numeric & numeric_diff) | (~both_numeric & text_diff)
+
+
+def diff_frames(df_new: pd.DataFrame, df_old: pd.DataFrame, key: str = 'product_sku', compare_columns: list = None) -> dict:
+    """
+    Compare a new snapshot against the current one on `key`.
+    Returns {'inserted': DataFrame, 'changed': DataFrame, 'removed': list of keys, 'unchanged': int}.
+    """
+    df_new = df_new.drop_duplicates(subset=key, keep='last')
+    if df_old is None or df_old.empty or key not in df_old.columns:
+        return {'inserted': df_new, 'changed': df_new.iloc[0:0], 'removed': [], 'unchanged': 0}
+    df_old = df_old.drop_duplicates(subset=key, keep='last')
+
+    if compare_columns is None:
+        compare_columns = [c for c in df_new.columns if c != key and c not in DIFF_IGNORED_COLUMNS]
+    compare_columns = [c for c in compare_columns if c in df_new.columns]
+
+    old_keys = df_old[key].astype(str)
+    new_keys = df_new[key].astype(str)
+    is_new = ~new_keys.isin(old_keys)
+    removed = df_old.loc[~old_keys.isin(new_keys), key].tolist()
+
+    existing = df_new[~is_new]
+    old_by_key = df_old.set_index(old_keys)
+    existing_keys = new_keys[~is_new]
+    changed_mask = pd.Series(False, index=existing.index)
+    for column in compare_columns:
+        if column in old_by_key.columns:
+            old_values = old_by_key[column].reindex(existing_keys).set_axis(existing.index)
+        else:
+            old_values = pd.Series(None, index=existing.index, dtype=object)
+        changed_mask |= _columns_differ(existing[column], old_values)
+    changed = existing[changed_mask]
+
+    return {
+        'inserted': df_new[is_new],
+        'changed': changed,
+        'removed': removed,
+        'unchanged': int(len(existing) - len(changed)),
+    }
+
+
+@instrumented('upsert_data')
+def upsert_data(table_name: str, data: list | pd.DataFrame, on_conflict: str = 'product_sku'):
+    """
+    Insert-or-update records keyed on `on_conflict` through bulk_insert.
+    Requires a unique constraint on that column. Returns the load report,
+    or None if any batch failed.
+    """
+    if not DB_AVAILABLE:
+        print("⚠️ Database not available - cannot upsert data")
+        return None
+
+    try:
+        report = bulk_insert(table_name, data, on_conflict=on_conflict)
+        if not report['complete']:
+            print(f"[DB] ❌ Upsert into {table_name} incomplete: {report['errors']}")
+            return None
+        return report
+    except Exception as e:
+        print(f"[DB] ❌ Upsert failed: {str(e)}")
+        return None
+
+
+@instrumented('read_rows')
+def read_rows(table_name: str, match_column: str, match_values: list, columns: list = None) -> pd.DataFrame:
+    """
+    Read the rows whose match_column is in match_values, in batches.
+    Returns None if the read fails, so callers can tell it from no matches.
+    """
+    if not DB_AVAILABLE:
+        print("⚠️ Database not available - cannot read data")
+        return pd.DataFrame()
+
+    try:
+        match_values = list(dict.fromkeys(match_values))
+        frames = []
+        for i in range(0, len(match_values), DELETE_BATCH_SIZE):
+            batch = match_values[i:i + DELETE_BATCH_SIZE]
+            spec = scope_to_live_snapshot(_table_spec(
+                table_name, [(match_column, 'in', batch)], [(c, None) for c in columns] if columns else None
+            ))
+            frames.append(_drop_snapshot_column(run_select(spec), spec))
+        frames = [f for f in frames if not f.empty]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    except Exception as e:
+        print(f"❌ Read failed: {e}")
+        return None
+
+
+@instrumented('select_rows')
+def select_rows(table_name: str, filters: list = None, order: list = None, limit: int = None,
+                columns: list = None) -> pd.DataFrame:
+    """
+    Read one window of rows with filters, ordering and the limit evaluated by
+    the backend, e.g.
+        select_rows('stock_notifications', [('status', 'in', ['Red'])],
+                    order=[('decrease_rate', True)], limit=50)
+    filters: (column, op, value) tuples as produced by parse_select, plus
+             (None, 'or', [[(column, op, value), ...], ...]) groups
+    order:   (column, descending) pairs
+    Returns None if the read fails, so callers can tell it from no rows.
+    """
+    if not DB_AVAILABLE:
+        print("⚠️ Database not available - cannot read data")
+        return pd.DataFrame()
+
+    try:
+        spec = scope_to_live_snapshot(_table_spec(
+            table_name, filters, [(c, None) for c in columns] if columns else None, limit, order
+        ))
+        return _drop_snapshot_column(run_select(spec), spec)
+    except Exception as e:
+        print(f"❌ Read failed: {e}")
+        return None
+
+
+@instrumented('delete_rows')
+def delete_rows(table_name: str, match_column: str, match_values: list):
+    """Delete the rows whose match_column is in match_values, in batches"""
+    if not DB_AVAILABLE:
+        print("⚠️ Database not available - cannot delete data")
+        return None
+
+    try:
+        results = []
+        for i in range(0, len(match_values), DELETE_BATCH_SIZE):
+            batch = match_values[i:i + DELETE_BATCH_SIZE]
+            result = run_delete(table_name, [(match_column, 'in', batch)])
+            if result:
+                results.extend(result)
+        print(f"[DB] ✅ Deleted {len(match_values)} rows from {table_name}")
+        return results
+    except Exception as e:
+        print(f"❌ Delete failed: {e}")
+        return None
+
+
+@instrumented('apply_table_diff')
+def apply_table_diff(table_name: str, df_new: pd.DataFrame, df_old: pd.DataFrame = None,
+                     key: str = 'product_sku', compare_columns: list = None):
+    """
+    Make `table_name` match `df_new` by upserting only inserted/changed rows
+    and deleting only rows whose key disappeared. `df_old` is the current
+    table snapshot; it is read from the database when not supplied.
+    Returns a summary dict, or None if the table could not be read or a write failed.
+    """
+    if df_old is None:
+        df_old = read_table(f"SELECT * FROM {table_name}")
+        if df_old is None:
+            # Diffing against nothing would re-upsert every row and delete none
+            print(f"❌ Could not read {table_name}; diff not applied")
+            return None
+
+    diff = diff_frames(df_new, df_old, key, compare_columns)
+    summary = {
+        'inserted': len(diff['inserted']),
+        'updated': len(diff['changed']),
+        'deleted': len(diff['removed']),
+        'unchanged': diff['unchanged'],
+    }
+    print(f"[DB] Diff for {table_name}: {summary}")
+
+    to_upsert = pd.concat([diff['inserted'], diff['changed']], ignore_index=True)
+    if not to_upsert.empty:
+        # Let the database assign ids for new rows instead of sending stale ones
+        to_upsert = to_upsert.drop(columns=['id'], errors='ignore')
+        if upsert_data(table_name, to_upsert, on_conflict=key) is None:
+            return None
+    if diff['removed']:
+        if delete_rows(table_name, key, diff['removed']) is None:
+            return None
+    return summary
+
+
+# ------------------------------------------------------
+# 🔄 Versioned snapshots for full-table refreshes
+# ------------------------------------------------------
+# Tables refreshed as a whole: every row carries the snapshot_version it was
+# written with and readers only see the version table_snapshots points at.
+SNAPSHOT_TABLES = {'base_data', 'forecasts', 'forecast_output'}
+SNAPSHOT_COLUMN = 'snapshot_version'
+SNAPSHOT_POINTER_TABLE = 'table_snapshots'
+
+# PostgREST / Postgres codes meaning the pointer table (or a column) does not exist
+MISSING_RELATION_CODES = {'42P01', '42703', 'PGRST204', 'PGRST205'}
+
+_snapshots_supported = None
+
+
+def snapshots_supported() -> bool:
+    """
+    Check whether the table_snapshots pointer table exists. Only a definite
+    answer is remembered: any other error (network, timeout, 5xx) is raised
+    and the check is retried on the next call, so a blip never switches the
+    process to unscoped reads and delete + insert refreshes.
+    """
+    global _snapshots_supported
+    if _snapshots_supported is None:
+        try:
+            run_select(_table_spec(SNAPSHOT_POINTER_TABLE, columns=[('table_name', None)], limit=1))
+            _snapshots_supported = True
+        except APIError as e:
+            if e.code not in MISSING_RELATION_CODES:
+                raise
+            print(f"[DB] ⚠️ Snapshot pointers unavailable ({e}); using delete + insert refreshes")
+            _snapshots_supported = False
+    return _snapshots_supported
+
+
+def get_snapshot_pointer(table_name: str) -> dict:
+    """Return the table_snapshots row for a table, or None if it has no live version"""
+    if not snapshots_supported():
+        return None
+    rows = run_select(_table_spec(
+        SNAPSHOT_POINTER_TABLE, [('table_name', 'eq', table_name)],
+        columns=[('live_version', None), ('previous_version', None)], limit=1
+    ))
+    if rows.empty:
+        return None
+    return {k: None if pd.isna(v) else int(v) for k, v in rows.iloc[0].items()}
+
+
+def scope_to_live_snapshot(spec: dict) -> dict:
+    """Restrict a query spec on a snapshot table to its live version"""
+    if spec['table'] not in SNAPSHOT_TABLES:
+        return spec
+    if any(column == SNAPSHOT_COLUMN for column, _, _ in spec['filters']):
+        return spec
+    pointer = get_snapshot_pointer(spec['table'])
+    if pointer is None:
+        # Never refreshed through replace_table_snapshot: serve legacy rows
+        return spec
+    return dict(spec, filters=spec['filters'] + [(SNAPSHOT_COLUMN, 'eq', pointer['live_version'])])
+
+
+def _drop_snapshot_column(df: pd.DataFrame, spec: dict) -> pd.DataFrame:
+    """Hide the version column from SELECT * results"""
+    if spec['columns'] is None and SNAPSHOT_COLUMN in df.columns:
+        df = df.drop(columns=[SNAPSHOT_COLUMN])
+    return df
+
+
+@instrumented('replace_table_snapshot')
+def replace_table_snapshot(table_name: str, data: pd.DataFrame):
+    """
+    Replace the contents of a snapshot table without an empty window:
+    rows are loaded under a new staging version while readers keep the
+    live one, then the table_snapshots pointer is flipped in a single
+    upsert. Versions older than the previous one are garbage-collected.
+    If loading fails the staging rows are removed and the live version is
+    untouched. Returns the load report, or None on failure.
+    """
+    if not DB_AVAILABLE:
+        print("⚠️ Database not available - cannot replace table")
+        return None
+
+    try:
+        if not snapshots_supported():
+            delete_data(table_name, 'product_sku', '*')
+            return insert_data(table_name, data)
+
+        pointer = get_snapshot_pointer(table_name)
+        previous = pointer['live_version'] if pointer else None
+        version = time.time_ns() // 1000
+
+        print(f"[DB] Staging {len(data)} rows for {table_name} as version {version}")
+        report = bulk_insert(table_name, data.assign(**{SNAPSHOT_COLUMN: version}))
+        if not report['complete']:
+            print(f"[DB] ❌ Staging {table_name} v{version} failed; live version unchanged")
+            run_delete(table_name, [(SNAPSHOT_COLUMN, 'eq', version)])
+            return None
+
+        # The flip: one single-row upsert makes the new version live
+        run_write(SNAPSHOT_POINTER_TABLE, [{
+            'table_name': table_name,
+            'live_version': version,
+            'previous_version': previous,
+            'updated_at': datetime.now().isoformat(),
+        }], on_conflict='table_name')
+        print(f"[DB] ✅ {table_name} now serving version {version}")
+
+        # Keep the previous version for readers that resolved it before the flip
+        keep = [version] + ([previous] if previous is not None else [])
+        try:
+            run_delete(table_name, [(SNAPSHOT_COLUMN, 'not_in', keep)])
+        except Exception as e:
+            print(f"[DB] ⚠️ Garbage collection of old {table_name} versions failed: {e}")
+
+        report['snapshot_version'] = version
+        return report
+    except Exception as e:
+        print(f"[DB] ❌ Snapshot replace failed for {table_name}: {str(e)}")
+        return None
+
+
+# ------------------------------------------------------
+# ⚡ Async variants for the FastAPI event loop
+# ------------------------------------------------------
+# The Supabase client is synchronous; calling it from an async endpoint
+# blocks the event loop for the whole round trip. These wrappers run the
+# call on a dedicated, bounded thread pool so other requests keep flowing.
+DB_ASYNC_WORKERS = int(os.getenv("DB_ASYNC_WORKERS", "8"))
+_db_executor = ThreadPoolExecutor(max_workers=DB_ASYNC_WORKERS, thread_name_prefix="db")
+
+
+def _offload(func):
+    """Build an awaitable version of a blocking DB_server function"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_db_executor, functools.partial(func, *args, **kwargs))
+    wrapper.__name__ = wrapper.__qualname__ = f"{func.__name__}_async"
+    return wrapper
+
+
+execute_query_async = _offload(execute_query)
+read_table_async = _offload(read_table)
+count_rows_async = _offload(count_rows)
+insert_data_async = _offload(insert_data)
+bulk_insert_async = _offload(bulk_insert)
+update_data_async = _offload(update_data)
+delete_data_async = _offload(delete_data)
+delete_rows_async = _offload(delete_rows)
+read_rows_async = _offload(read_rows)
+upsert_data_async = _offload(upsert_data)
+apply_table_diff_async = _offload(apply_table_diff)
+replace_table_snapshot_async = _offload(replace_table_snapshot)
@@ -1,19 +1,23 @@
 # ================= Backend: Postgres Version =================
+import os
+import json
+import base64
 import pandas as pd
 import numpy as np  # Added numpy import for vectorized operations
 # from DB_server import engine  # Removed: SQLAlchemy engine no longer used
 
-# Configuration constants
-SAFETY_FACTOR = 1.5
-WEEKS_TO_COVER = 2
-MAX_BUFFER = 50
-
 from DB_server import execute_query
+import manual_overrides
+from restock_rules import compute_restock, reprice, STORED_COLUMNS  # restock formulas and rule sets
+from consumption import rolling_consumption
 
 def get_manual_values(product_sku: str):
     """Get manual MinStock and Buffer values from database"""
     try:
-        df = execute_query(f"SELECT min_stock, buffer FROM stock_notifications WHERE product_sku = '{product_sku}'")
+        df = execute_query(
+            "SELECT min_stock, buffer FROM stock_notifications WHERE product_sku = :sku LIMIT 1",
+            {"sku": product_sku}
+        )
         if df is not None and not df.empty:
             return {
                 'min_stock': df.iloc[0]['min_stock'] if pd.notna(df.iloc[0]['min_stock']) else None,
@@ -29,10 +33,15 @@ def get_data(week_date):
     raise NotImplementedError("get_data() needs to be migrated to use Supabase client.")
 
 # ================= Generate Stock Report =================
-def generate_stock_report(df_prev, df_curr):
+def generate_stock_report(df_prev, df_curr, rules=None, history=None):
     """
     df_curr: columns ['product_name', 'product_sku', 'stock_level', 'category']
     df_prev: columns ['product_name', 'product_sku', 'stock_level', 'category']
+    rules: restock rule set name or RestockRules (default rule set when None)
+    history: stock snapshots up to and including df_prev's, as rows of
+             (snapshot_date, product_sku, stock_level); weekly consumption is
+             smoothed over them (see consumption.py). Without it only the
+             prev/curr diff is used.
     """
     df_prev_unique = df_prev.drop_duplicates(subset='product_sku', keep='last')
     prev_lookup = df_prev_unique.set_index('product_sku')['stock_level']
@@ -49,62 +58,26 @@ def generate_stock_report(df_prev, df_curr):
     # Map last_stock from previous data
     curr['last_stock'] = curr['product_sku'].map(prev_lookup).fillna(curr['stock_level'])
 
-    # Weekly sales and decrease rate
-    curr['weekly_sale'] = (curr['last_stock'] - curr['stock_level']).clip(lower=1)
-    curr['decrease_rate'] = np.where(
-        curr['last_stock'] > 0,
-        (curr['last_stock'] - curr['stock_level']) / curr['last_stock'] * 100,
-        0
-    ).round(1)
+    # Weekly consumption smoothed over the snapshot window
+    if history is None or history.empty:
+        history = df_prev_unique[['product_sku', 'stock_level']].assign(snapshot_date='previous')
+    consumption = curr['product_sku'].astype(str).map(rolling_consumption(history, curr))
 
-    # Weeks to empty
-    curr['weeks_to_empty'] = (curr['stock_level'] / curr['weekly_sale']).round(2)
-
-    manual_values_df = execute_query("SELECT product_sku, min_stock FROM stock_notifications")
-    manual_min_map = {}
-    
-    if manual_values_df is not None and not manual_values_df.empty:
-        manual_min_map = manual_values_df.set_index('product_sku')['min_stock'].to_dict()
-    
     # min_stock: manual override, else formula
-    default_min = (curr['weekly_sale'] * WEEKS_TO_COVER * SAFETY_FACTOR).astype(int)
-    manual_min = curr['product_sku'].map(manual_min_map)
-    curr['min_stock'] = np.where(manual_min.notna(), manual_min, default_min).astype(int)
-
-    dyn_buf = np.select(
-        [curr['decrease_rate'] > 50, curr['decrease_rate'] > 20],
-        [20, 10],
-        default=5
-    )
-    buffer_values = np.minimum(dyn_buf, MAX_BUFFER).astype(int)
-
-    # Reorder quantity (at least SAFETY_FACTOR * weekly sale)
-    default_reorder = (curr['weekly_sale'] * SAFETY_FACTOR).astype(int)
-    curr['reorder_qty'] = np.maximum(curr['min_stock'] + buffer_values - curr['stock_level'], default_reorder).astype(int)
-
-    # status + description
-    is_red = (curr['stock_level'] < curr['min_stock']) | (curr['decrease_rate'] > 50)
-    is_yellow = (~is_red) & (curr['decrease_rate'] > 20)
-
-    curr['status'] = np.where(is_red, 'Red', np.where(is_yellow, 'Yellow', 'Green'))
-    curr['description'] = np.where(
-        is_red,
-        'Decreasing rapidly and nearly out of stock! Recommend restocking ' + curr['reorder_qty'].astype(str) + ' units',
-        np.where(
-            is_yellow,
-            'Decreasing rapidly, should prepare to restock. Recommend restocking ' + curr['reorder_qty'].astype(str) + ' units',
-            'Stock is sufficient'
-        )
+    manual_min = curr['product_sku'].astype(str).map(manual_overrides.get_overrides())
+    derived = compute_restock(
+        curr['stock_level'], curr['last_stock'], min_stock=manual_min, rules=rules, consumption=consumption
     )
+    curr[STORED_COLUMNS] = derived[STORED_COLUMNS]
 
     # Return only the columns that match our DB schema
     return curr[[
         'product_name', 'product_sku', 'category', 'stock_level', 'last_stock',
-        'decrease_rate', 'weeks_to_empty', 'min_stock', 'reorder_qty',
+        'weekly_consumption', 'decrease_rate', 'weeks_to_empty', 'min_stock', 'reorder_qty',
         'status', 'description'
     ]].reset_index(drop=True)
 
-from DB_server import update_data
+from DB_server import update_data, select_rows, frame_to_records
 
 def update_manual_values(product_sku: str, minstock: int = None, buffer: int = None):
     """Update manual MinStock value in the database
@@ -112,6 +85,11 @@ def update_manual_values(product_sku: str, minstock: int = None, buffer: int = N
     update_payload = {}
     if minstock is not None:
         update_payload['min_stock'] = minstock
+        try:
+            manual_overrides.set_min_stock({product_sku: minstock}).result()
+        except Exception as e:
+            print(f"Error saving manual override: {e}")
+            return False
     # Buffer is now calculated dynamically based on decrease_rate
         
     if update_payload:
@@ -126,20 +104,138 @@ def update_manual_values(product_sku: str, minstock: int = None, buffer: int = N
             return False
     return True
 
-# ================= Get Notifications =================
-def get_notifications():
+
+def recompute_manual_values(df_notif: pd.DataFrame, updates: pd.DataFrame, rules=None) -> pd.DataFrame:
     """
-    Returns notification list (summary view).
+    Apply manual min_stock / buffer values to many notification rows at once
+    and reprice them with the restock rule engine.
+    df_notif: stock_notifications rows (product_sku, stock_level, last_stock, min_stock, ...)
+    updates:  product_sku with optional min_stock and buffer columns; a missing
+              value keeps the stored min_stock / the dynamic buffer
+    Returns the updated df_notif rows for the SKUs in updates, plus buffer
+    and dynamic_buffer columns.
     """
-    print("[Notification] get_notifications() called")
-    
-    # Not implemented: Needs migration to Supabase
-    raise NotImplementedError("get_notifications() needs to be migrated to use Supabase client.")
+    updates = updates.drop_duplicates('product_sku', keep='last').set_index('product_sku')
+    rows = df_notif[df_notif['product_sku'].isin(updates.index)].drop_duplicates('product_sku', keep='last')
+    rows = rows.reset_index(drop=True)
+
+    min_stock = pd.to_numeric(rows['min_stock'], errors='coerce')
+    if 'min_stock' in updates:
+        new_min = rows['product_sku'].map(updates['min_stock'])
+        min_stock = new_min.where(new_min.notna(), min_stock)
+    buffer = rows['product_sku'].map(updates['buffer']) if 'buffer' in updates else None
 
+    derived = reprice(rows, min_stock=min_stock, buffer=buffer, rules=rules)
+    rows['buffer'] = derived['buffer']
+    rows['dynamic_buffer'] = derived['dynamic_buffer']
+    return rows
 
-def get_notification_detail(product_name: str):
+
+# ================= Get Notifications =================
+NOTIFICATION_SORTS = ('product_sku', 'decrease_rate', 'weeks_to_empty')
+NOTIFICATION_FILTERS = ('status', 'category', 'flag')
+NOTIFICATIONS_PAGE_SIZE = int(os.getenv("NOTIFICATIONS_PAGE_SIZE", "100"))
+NOTIFICATIONS_MAX_PAGE_SIZE = int(os.getenv("NOTIFICATIONS_MAX_PAGE_SIZE", "1000"))
+
+
+def encode_cursor(sort: str, value, product_sku: str) -> str:
+    """Opaque cursor pointing just after the row (value, product_sku) of a sort order"""
+    payload = json.dumps({'s': sort, 'v': value, 'k': product_sku}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    """(value, product_sku) of a cursor; ValueError if it is malformed or from another sort"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        cursor_sort, value, product_sku = payload['s'], payload['v'], payload['k']
+    except Exception:
+        raise ValueError("Malformed cursor")
+    if cursor_sort != sort:
+        raise ValueError(f"Cursor belongs to sort '{cursor_sort}', not '{sort}'")
+    return value, product_sku
+
+
+def _after_cursor(sort: str, descending: bool, value, product_sku: str) -> list:
     """
-    Returns detailed metrics for one product.
+    Keyset filters for the rows after (value, product_sku) in ORDER BY sort,
+    product_sku. NULL sort values come last ascending and first descending,
+    as in Postgres.
     """
-    # Not implemented: Needs migration to Supabase
-    raise NotImplementedError("get_notification_detail() needs to be migrated to use Supabase client.")
+    if sort == 'product_sku':
+        return [('product_sku', 'lt' if descending else 'gt', product_sku)]
+    tie = [('product_sku', 'gt', product_sku)]
+    if value is None:
+        groups = [[(sort, 'is', None)] + tie]
+        if descending:
+            groups.append([(sort, 'not_is', None)])
+    else:
+        groups = [[(sort, 'lt' if descending else 'gt', value)], [(sort, 'eq', value)] + tie]
+        if not descending:
+            groups.append([(sort, 'is', None)])
+    return [(None, 'or', groups)]
+
+
+def get_notifications(status=None, category=None, flag=None, sort: str = 'product_sku',
+                      descending: bool = False, limit: int = None, cursor: str = None) -> dict:
+    """
+    Returns one page of the notification list (summary view).
+    status / category / flag: a value or a list of accepted values
+    sort: one of NOTIFICATION_SORTS; ties are broken by product_sku
+    cursor: next_cursor of the previous page
+    Filtering, ordering and the page window are evaluated by the database,
+    so a page costs the same however many SKUs are stored.
+    Returns {'items', 'next_cursor', 'has_more', 'limit', 'sort', 'order'}.
+    Raises ValueError for an unknown sort or a bad cursor and RuntimeError
+    if the page cannot be read (never an empty page that looks like the end).
+    """
+    if sort not in NOTIFICATION_SORTS:
+        raise ValueError(f"Unknown sort '{sort}', expected one of {', '.join(NOTIFICATION_SORTS)}")
+    limit = min(max(int(limit or NOTIFICATIONS_PAGE_SIZE), 1), NOTIFICATIONS_MAX_PAGE_SIZE)
+
+    filters = []
+    for column, values in zip(NOTIFICATION_FILTERS, (status, category, flag)):
+        if values is None:
+            continue
+        values = [values] if isinstance(values, str) else list(values)
+        if values:
+            filters.append((column, 'in', values))
+    if cursor:
+        filters += _after_cursor(sort, descending, *decode_cursor(cursor, sort))
+
+    order = [(sort, descending)] + ([('product_sku', False)] if sort != 'product_sku' else [])
+    # One extra row tells whether another page exists
+    df = select_rows('stock_notifications', filters, order=order, limit=limit + 1)
+    if df is None:
+        raise RuntimeError("Failed to read stock_notifications")
+    items = frame_to_records(df)
+    has_more = len(items) > limit
+    items = items[:limit]
+    print(f"[Notification] get_notifications(sort={sort}, limit={limit}) -> {len(items)} rows")
+
+    next_cursor = None
+    if has_more:
+        last = items[-1]
+        next_cursor = encode_cursor(sort, last.get(sort), last['product_sku'])
+    return {
+        'items': items,
+        'next_cursor': next_cursor,
+        'has_more': has_more,
+        'limit': limit,
+        'sort': sort,
+        'order': 'desc' if descending else 'asc',
+    }
+
+
+def get_notification_detail(product_sku: str):
+    """
+    Returns detailed metrics for one product (None if it has no notification),
+    read with a single lookup on the unique product_sku index.
+    Raises RuntimeError if the lookup fails.
+    """
+    df = select_rows('stock_notifications', [('product_sku', 'eq', product_sku)], limit=1)
+    if df is None:
+        raise RuntimeError(f"Failed to read the notification of {product_sku}")
+    records = frame_to_records(df)
+    return records[0] if records else None
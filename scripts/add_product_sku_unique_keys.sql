@@ -0,0 +1,19 @@
+-- Unique product_sku keys required for upsert-based diff writes
+-- (ON CONFLICT (product_sku) in apply_table_diff)
+
+-- Remove duplicate SKUs, keeping the most recent row
+DELETE FROM base_stock a
+USING base_stock b
+WHERE a.product_sku = b.product_sku
+  AND a.id < b.id;
+
+DELETE FROM stock_notifications a
+USING stock_notifications b
+WHERE a.product_sku = b.product_sku
+  AND a.id < b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_base_stock_product_sku
+ON base_stock(product_sku);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_stock_notifications_product_sku
+ON stock_notifications(product_sku);
@@ -0,0 +1,54 @@
+-- Versioned snapshots for tables refreshed as a whole
+-- (replace_table_snapshot in DB_server.py)
+--
+-- Rows are written under a new snapshot_version and become visible when
+-- table_snapshots.live_version is flipped to it. Existing rows get
+-- version 0 and stay visible until the first versioned refresh.
+
+CREATE TABLE IF NOT EXISTS table_snapshots (
+    table_name VARCHAR(100) PRIMARY KEY,
+    live_version BIGINT NOT NULL,
+    previous_version BIGINT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- base_data: the natural key is now unique per version
+ALTER TABLE base_data ADD COLUMN IF NOT EXISTS snapshot_version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE base_data DROP CONSTRAINT IF EXISTS pk_base_data;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_base_data_snapshot
+ON base_data(snapshot_version, product_sku, sales_date);
+
+-- forecasts
+ALTER TABLE forecasts ADD COLUMN IF NOT EXISTS snapshot_version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE forecasts DROP CONSTRAINT IF EXISTS forecasts_unique;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_forecasts_snapshot
+ON forecasts(snapshot_version, product_sku, forecast_date, created_at);
+
+-- forecast_output
+ALTER TABLE forecast_output ADD COLUMN IF NOT EXISTS snapshot_version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE forecast_output DROP CONSTRAINT IF EXISTS pk_forecast_output;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_forecast_output_snapshot
+ON forecast_output(snapshot_version, product_sku, forecast_date);
+
+-- Live-version views for clients that query the tables directly (the
+-- dashboard's Supabase reads). Without a table_snapshots row only the
+-- version-0 rows exist, so those are shown.
+CREATE OR REPLACE VIEW base_data_live WITH (security_invoker = true) AS
+SELECT * FROM base_data
+WHERE snapshot_version = COALESCE(
+    (SELECT live_version FROM table_snapshots WHERE table_name = 'base_data'), 0
+);
+
+CREATE OR REPLACE VIEW forecasts_live WITH (security_invoker = true) AS
+SELECT * FROM forecasts
+WHERE snapshot_version = COALESCE(
+    (SELECT live_version FROM table_snapshots WHERE table_name = 'forecasts'), 0
+);
+
+CREATE OR REPLACE VIEW forecast_output_live WITH (security_invoker = true) AS
+SELECT * FROM forecast_output
+WHERE snapshot_version = COALESCE(
+    (SELECT live_version FROM table_snapshots WHERE table_name = 'forecast_output'), 0
+);
+
+GRANT SELECT ON table_snapshots, base_data_live, forecasts_live, forecast_output_live TO anon, authenticated;
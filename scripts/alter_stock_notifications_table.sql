@@ -5,6 +5,23 @@ ADD COLUMN IF NOT EXISTS unchanged_counter NUMERIC(10, 2) DEFAULT 0;
 ALTER TABLE stock_notifications 
 ADD COLUMN IF NOT EXISTS flag VARCHAR(50) DEFAULT 'stage';
 
+-- Smoothed weekly consumption behind decrease_rate / weeks_to_empty
+ALTER TABLE stock_notifications 
+ADD COLUMN IF NOT EXISTS weekly_consumption NUMERIC(10, 2);
+
 -- Create index for flag column
 CREATE INDEX IF NOT EXISTS idx_stock_notifications_flag 
 ON stock_notifications(flag);
+
+-- Filter and keyset-pagination indexes for the paged notifications API
+CREATE INDEX IF NOT EXISTS idx_stock_notifications_status
+ON stock_notifications(status);
+
+CREATE INDEX IF NOT EXISTS idx_stock_notifications_category
+ON stock_notifications(category);
+
+CREATE INDEX IF NOT EXISTS idx_stock_notifications_decrease_rate_sku
+ON stock_notifications(decrease_rate, product_sku);
+
+CREATE INDEX IF NOT EXISTS idx_stock_notifications_weeks_to_empty_sku
+ON stock_notifications(weeks_to_empty, product_sku);
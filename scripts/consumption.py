@@ -0,0 +1,96 @@
+"""
+Rolling weekly consumption model
+Estimates each SKU's weekly consumption from the last WINDOW_WEEKS stock
+snapshots instead of a single prev/curr diff, so one restock or one quiet
+week does not flip its status on its own.
+
+The snapshots form an SKU x week matrix of stock levels (oldest week
+first). Week t consumed levels[t-1] - levels[t]; weeks where the stock rose
+(a delivery arrived) or a level is missing say nothing about sales and are
+skipped. The remaining weekly figures are averaged with exponentially
+decaying weights (EWMA_ALPHA), newest week first.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+from stock_history import snapshot_dates, read_stock_history
+
+# Weeks of stock levels per SKU, including the current upload
+WINDOW_WEEKS = int(os.getenv("CONSUMPTION_WINDOW_WEEKS", "8"))
+# Weight of the newest week; older weeks decay by (1 - alpha) per week
+EWMA_ALPHA = float(os.getenv("CONSUMPTION_EWMA_ALPHA", "0.4"))
+
+
+def recent_history(weeks: int = None, before=None) -> pd.DataFrame:
+    """
+    Dense stock_history rows (snapshot_date, product_sku, stock_level) for the
+    latest weeks - 1 snapshots, i.e. the weeks that precede a new upload.
+    before: the new upload's snapshot date; only strictly earlier snapshots
+    count, so re-uploading a week is not mistaken for the week before it.
+    """
+    weeks = weeks or WINDOW_WEEKS
+    if weeks < 2:
+        return pd.DataFrame(columns=['snapshot_date', 'product_sku', 'stock_level'])
+    dates = snapshot_dates(end=before)
+    if before is not None:
+        before = pd.Timestamp(before).date().isoformat()
+        dates = [d for d in dates if d < before]
+    dates = dates[-(weeks - 1):]
+    if not dates:
+        return pd.DataFrame(columns=['snapshot_date', 'product_sku', 'stock_level'])
+    return read_stock_history(start=dates[0], end=dates[-1])[['snapshot_date', 'product_sku', 'stock_level']]
+
+
+def stock_matrix(history: pd.DataFrame, df_curr: pd.DataFrame, weeks: int = None) -> tuple:
+    """
+    SKU x week float matrix of stock levels for the SKUs of df_curr: the last
+    weeks - 1 snapshot dates of `history` (oldest first) followed by df_curr.
+    Returns (product_sku index, matrix); SKUs absent on a date are NaN.
+    """
+    weeks = weeks or WINDOW_WEEKS
+    curr = df_curr.drop_duplicates('product_sku', keep='last')
+    skus = pd.Index(curr['product_sku'].astype(str))
+    current = pd.to_numeric(curr['stock_level'], errors='coerce').to_numpy(dtype=float)
+
+    if history is None or history.empty or weeks < 2:
+        return skus, current.reshape(-1, 1)
+
+    history = history.assign(product_sku=history['product_sku'].astype(str))
+    wide = (
+        history.drop_duplicates(['snapshot_date', 'product_sku'], keep='last')
+        .pivot(index='product_sku', columns='snapshot_date', values='stock_level')
+        .sort_index(axis=1)
+        .iloc[:, -(weeks - 1):]
+        .reindex(skus)
+    )
+    past = wide.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    return skus, np.column_stack([past, current])
+
+
+def ewma_consumption(levels: np.ndarray, alpha: float = None) -> np.ndarray:
+    """
+    Exponentially weighted weekly consumption for each row of an SKU x week
+    stock matrix, skipping restock weeks and missing levels.
+    Rows without a single usable week are NaN.
+    """
+    alpha = EWMA_ALPHA if alpha is None else alpha
+    if levels.shape[1] < 2:
+        return np.full(levels.shape[0], np.nan)
+
+    used = levels[:, :-1] - levels[:, 1:]
+    valid = ~np.isnan(used) & (used >= 0)
+    ages = np.arange(used.shape[1])[::-1]
+    weights = np.where(valid, (1 - alpha) ** ages, 0.0)
+    total = weights.sum(axis=1)
+    weighted = np.where(valid, used, 0.0) * weights
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, weighted.sum(axis=1) / total, np.nan)
+
+
+def rolling_consumption(history: pd.DataFrame, df_curr: pd.DataFrame,
+                        weeks: int = None, alpha: float = None) -> pd.Series:
+    """Smoothed weekly consumption per product_sku of df_curr (NaN when unknown)"""
+    skus, levels = stock_matrix(history, df_curr, weeks)
+    return pd.Series(ewma_consumption(levels, alpha), index=skus)
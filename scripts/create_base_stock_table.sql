@@ -20,3 +20,7 @@ ON base_stock(category);
 
 CREATE INDEX IF NOT EXISTS idx_base_stock_flag 
 ON base_stock(flag);
+
+-- Unique SKU key used by upsert-based writes
+CREATE UNIQUE INDEX IF NOT EXISTS uq_base_stock_product_sku
+ON base_stock(product_sku);
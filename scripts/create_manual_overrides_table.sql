@@ -0,0 +1,22 @@
+-- Manual min_stock overrides (manual_overrides.py)
+--
+-- One row per SKU whose min_stock was set by hand. generate_stock_report
+-- uses these instead of the formula value; SKUs without a row follow the
+-- formula.
+
+CREATE TABLE IF NOT EXISTS manual_overrides (
+    product_sku VARCHAR(255) PRIMARY KEY,
+    min_stock INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Carry over the min_stock values currently in stock_notifications. Before
+-- this table existed every stored min_stock was reused by the next report,
+-- and hand-set values cannot be told apart from formula ones, so all of
+-- them are kept; clear an override to return a SKU to the formula.
+INSERT INTO manual_overrides (product_sku, min_stock, updated_at)
+SELECT DISTINCT ON (product_sku) product_sku, min_stock, COALESCE(updated_at, CURRENT_TIMESTAMP)
+FROM stock_notifications
+WHERE min_stock IS NOT NULL
+ORDER BY product_sku, updated_at DESC NULLS LAST
+ON CONFLICT (product_sku) DO NOTHING;
@@ -0,0 +1,29 @@
+-- Weekly stock snapshot history (stock_history.py)
+--
+-- Each stock upload stores only the SKUs whose stock level, name or category
+-- changed since the previous upload; a SKU's state on a snapshot date is its
+-- latest row on or before that date. Rows with removed = true mark SKUs that
+-- disappeared from the upload.
+
+CREATE TABLE IF NOT EXISTS stock_history (
+    snapshot_date DATE NOT NULL,
+    product_sku VARCHAR(255) NOT NULL,
+    product_name VARCHAR(255),
+    category VARCHAR(100),
+    stock_level INTEGER,
+    removed BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (snapshot_date, product_sku)
+);
+
+-- Range reads by SKU (the primary key already serves reads by date)
+CREATE INDEX IF NOT EXISTS idx_stock_history_sku_date ON stock_history(product_sku, snapshot_date);
+
+CREATE TABLE IF NOT EXISTS stock_history_snapshots (
+    snapshot_date DATE PRIMARY KEY,
+    skus INTEGER,
+    changed_rows INTEGER,
+    removed_rows INTEGER,
+    unchanged_rows INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -6,6 +6,7 @@ CREATE TABLE IF NOT EXISTS stock_notifications (
     category VARCHAR(255),
     stock_level INTEGER NOT NULL,
     last_stock INTEGER NOT NULL,
+    weekly_consumption NUMERIC(10, 2),
     decrease_rate NUMERIC(10, 2),
     weeks_to_empty NUMERIC(10, 2),
     min_stock INTEGER,
@@ -28,3 +29,20 @@ ON stock_notifications(product_sku);
 
 CREATE INDEX IF NOT EXISTS idx_stock_notifications_flag 
 ON stock_notifications(flag);
+
+-- Unique SKU key used by upsert-based writes
+CREATE UNIQUE INDEX IF NOT EXISTS uq_stock_notifications_product_sku
+ON stock_notifications(product_sku);
+
+-- Filter and keyset-pagination indexes for the paged notifications API
+CREATE INDEX IF NOT EXISTS idx_stock_notifications_status
+ON stock_notifications(status);
+
+CREATE INDEX IF NOT EXISTS idx_stock_notifications_category
+ON stock_notifications(category);
+
+CREATE INDEX IF NOT EXISTS idx_stock_notifications_decrease_rate_sku
+ON stock_notifications(decrease_rate, product_sku);
+
+CREATE INDEX IF NOT EXISTS idx_stock_notifications_weeks_to_empty_sku
+ON stock_notifications(weeks_to_empty, product_sku);
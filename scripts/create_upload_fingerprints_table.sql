@@ -0,0 +1,18 @@
+-- Content fingerprints of processed uploads (upload_fingerprints.py)
+--
+-- One row per distinct set of uploaded files: the SHA-256 fingerprint, what
+-- kind of upload it was and the result it produced. An upload identical to
+-- the latest successful one of its kind returns the stored result instead
+-- of being reprocessed (unless force=true).
+
+CREATE TABLE IF NOT EXISTS upload_fingerprints (
+    fingerprint VARCHAR(64) PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL,
+    files TEXT,
+    result TEXT,
+    job_id VARCHAR(64),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_fingerprints_kind_created
+ON upload_fingerprints(kind, created_at DESC);
@@ -0,0 +1,203 @@
+"""
+In-process DB call metrics
+Latency, row and byte histograms per (operation, table), recorded by
+DB_server around every storage round trip and public read/write call and
+exposed through the backend's /metrics endpoint.
+
+Histograms keep the last HISTOGRAM_SAMPLES observations for percentiles
+plus running totals since the last reset.
+"""
+
+import os
+import re
+import time
+import inspect
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+HISTOGRAM_SAMPLES = int(os.getenv("DB_METRICS_SAMPLES", "1024"))
+PERCENTILES = (50, 90, 95, 99)
+
+
+class Histogram:
+    """Running count/sum/max plus a bounded sample window for percentiles"""
+
+    def __init__(self, samples: int = HISTOGRAM_SAMPLES):
+        self._samples = deque(maxlen=samples)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self._samples.append(value)
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def summary(self) -> dict:
+        summary = {'count': self.count, 'sum': round(self.total, 3), 'max': round(self.max, 3)}
+        if self._samples:
+            values = np.percentile(np.fromiter(self._samples, dtype=float), PERCENTILES)
+            summary.update({f"p{p}": round(float(v), 3) for p, v in zip(PERCENTILES, values)})
+        return summary
+
+
+class MetricsRegistry:
+    """Thread-safe collection of per-(operation, table) series"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+            self._started = time.time()
+
+    def _get(self, operation: str, table: str) -> dict:
+        key = (operation, table or '-')
+        if key not in self._series:
+            self._series[key] = {
+                'calls': 0, 'errors': 0, 'retries': 0,
+                'latency_ms': Histogram(), 'rows': Histogram(), 'bytes': Histogram(),
+            }
+        return self._series[key]
+
+    def observe(self, operation: str, table: str, seconds: float, rows: int = 0,
+                nbytes: int = None, error: bool = False):
+        with self._lock:
+            series = self._get(operation, table)
+            series['calls'] += 1
+            series['errors'] += int(error)
+            series['latency_ms'].observe(seconds * 1000)
+            series['rows'].observe(rows)
+            if nbytes is not None:
+                series['bytes'].observe(nbytes)
+
+    def add_retries(self, operation: str, table: str, retries: int = 1):
+        with self._lock:
+            self._get(operation, table)['retries'] += retries
+
+    def snapshot(self) -> dict:
+        """All series, slowest (by total time spent) first"""
+        with self._lock:
+            series = [
+                {
+                    'operation': operation,
+                    'table': table,
+                    'calls': data['calls'],
+                    'errors': data['errors'],
+                    'retries': data['retries'],
+                    'latency_ms': data['latency_ms'].summary(),
+                    'rows': data['rows'].summary(),
+                    'bytes': data['bytes'].summary() if data['bytes'].count else None,
+                }
+                for (operation, table), data in self._series.items()
+            ]
+            started = self._started
+        series.sort(key=lambda s: s['latency_ms']['sum'], reverse=True)
+        return {'since': started, 'uptime_seconds': round(time.time() - started, 1), 'series': series}
+
+
+registry = MetricsRegistry()
+
+# ------------------------------------------------------
+# Byte accounting: the HTTP response hook adds wire bytes to whatever
+# round trip is being timed on the same thread.
+# ------------------------------------------------------
+_local = threading.local()
+
+
+def track_bytes(nbytes: int):
+    if getattr(_local, 'bytes', None) is not None:
+        _local.bytes += nbytes
+
+
+def count_http_bytes(response):
+    """httpx response hook: request body plus response body"""
+    response.read()
+    track_bytes(len(response.request.content) + len(response.content))
+
+
+@contextmanager
+def timed(operation: str, table: str, count_bytes: bool = True):
+    """
+    Time one storage round trip. The body may set call['rows'];
+    bytes seen by count_http_bytes on this thread are attributed to it
+    (pass count_bytes=False when the call does not go over HTTP).
+    """
+    call = {'rows': 0}
+    outer_bytes = getattr(_local, 'bytes', None)
+    _local.bytes = 0
+    error = False
+    started = time.perf_counter()
+    try:
+        yield call
+    except Exception:
+        error = True
+        raise
+    finally:
+        own_bytes = _local.bytes
+        _local.bytes = None if outer_bytes is None else outer_bytes + own_bytes
+        registry.observe(operation, table, time.perf_counter() - started,
+                         call['rows'], own_bytes if count_bytes else None, error)
+
+
+# ------------------------------------------------------
+# Decorator for public DB_server functions
+# ------------------------------------------------------
+_TABLE_IN_QUERY_RE = re.compile(
+    r'\b(?:from|into|update|table(?:\s+if\s+not\s+exists)?)\s+"?([A-Za-z_]\w*)', re.IGNORECASE
+)
+
+
+def table_label(value) -> str:
+    """First argument of a DB_server call: a table name or a SQL query"""
+    if not isinstance(value, str):
+        return None
+    if not re.search(r'\s', value.strip()):
+        return value
+    match = _TABLE_IN_QUERY_RE.search(value)
+    return match.group(1) if match else None
+
+
+def _result_rows(result) -> int:
+    if isinstance(result, (pd.DataFrame, list)):
+        return len(result)
+    if isinstance(result, dict):
+        if 'rows_written' in result:
+            return result['rows_written']
+        return sum(result.get(k, 0) for k in ('inserted', 'updated', 'deleted'))
+    if isinstance(result, (int, np.integer)) and not isinstance(result, bool):
+        return int(result)
+    return 0
+
+
+def instrumented(operation: str, none_is_error: bool = True):
+    """
+    Record latency and result rows of a public DB_server call, labelled by
+    the table in its first argument. DB_server functions report failure by
+    returning None, which counts as an error unless none_is_error is False.
+    """
+    def decorate(func):
+        first_param = next(iter(inspect.signature(func).parameters))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            table = table_label(args[0] if args else kwargs.get(first_param))
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                registry.observe(operation, table, time.perf_counter() - started, error=True)
+                raise
+            registry.observe(operation, table, time.perf_counter() - started,
+                             _result_rows(result), error=none_is_error and result is None)
+            return result
+        return wrapper
+    return decorate
@@ -3,17 +3,19 @@ Generate forecasts and save to Supabase
 """
 import pandas as pd
 import numpy as np
-from datetime import datetime
 from Auto_cleaning import auto_cleaning
 from Predict import update_model_and_train, forcast_loop
-from DB_server import insert_data, delete_data, execute_query
+from DB_server import read_table, replace_table_snapshot
 import joblib
 
 def main():
     print("Loading test data...")
     # Use the last month of data from base_data as test data
-    df_cleaned = execute_query("SELECT * FROM base_data ORDER BY sales_date DESC")
+    df_cleaned = read_table("SELECT * FROM base_data ORDER BY sales_date DESC")
     
+    if df_cleaned is None:
+        print("❌ Failed to read base_data table")
+        return
     if df_cleaned.empty:
         print("❌ No data found in base_data table")
         return
@@ -41,26 +43,11 @@ def main():
             forecast_df = pd.DataFrame(forecast_results)
             print(f"Forecast columns: {forecast_df.columns.tolist()}")
             
-            # Clean up data for Supabase
-            records = forecast_df.to_dict(orient='records')
-            print(f"Cleaning {len(records)} forecast records...")
-            for record in records:
-                for key, value in list(record.items()):
-                    if pd.isna(value):
-                        record[key] = None
-                    elif isinstance(value, pd.Timestamp):
-                        record[key] = value.isoformat()
-                    elif isinstance(value, datetime):
-                        record[key] = value.isoformat()
-            
-            # Clear old forecasts and insert new ones
-            print("Clearing old forecasts...")
-            delete_data('forecasts', 'product_sku', '*')
-            
-            print("Inserting new forecasts...")
-            result = insert_data('forecasts', records)
+            # Stage the new forecasts and flip them live
+            print("Writing new forecast snapshot...")
+            result = replace_table_snapshot('forecasts', forecast_df)
             if result is not None:
-                print(f"✅ Successfully saved {len(records)} forecasts to forecasts table")
+                print(f"✅ Successfully saved {len(forecast_df)} forecasts to forecasts table")
             else:
                 print("⚠️ Failed to save forecasts to forecasts table")
         else:
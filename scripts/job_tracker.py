@@ -0,0 +1,146 @@
+"""
+In-process background job tracking
+Long-running requests (stock uploads) return a job id immediately and run
+in a worker; the job records stage-level progress that GET /jobs/{id}
+reports back to the frontend.
+
+Jobs live in memory only and the most recent JOB_HISTORY finished jobs are
+kept; a restart forgets them.
+"""
+
+import os
+import time
+import uuid
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "200"))
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+class Job:
+    """A unit of background work with named, timed stages"""
+
+    def __init__(self, kind: str, meta: dict = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.meta = meta or {}
+        self.status = 'queued'
+        self.created_at = _now()
+        self.started_at = None
+        self.finished_at = None
+        self.stages = []
+        self.result = None
+        self.error = None
+        self.status_code = None
+        self._started = None
+        self._finished = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self.status = 'running'
+            self.started_at = _now()
+            self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Record one pipeline stage. The body may set entry['rows'] and add
+        other counters to entry; duration and outcome are filled in on exit.
+        """
+        entry = {'name': name, 'status': 'running', 'rows': None, 'seconds': None, 'started_at': _now()}
+        with self._lock:
+            self.stages.append(entry)
+        started = time.perf_counter()
+        try:
+            yield entry
+        except BaseException:
+            entry['status'] = 'failed'
+            raise
+        else:
+            entry['status'] = 'done'
+        finally:
+            entry['seconds'] = round(time.perf_counter() - started, 3)
+
+    def succeed(self, result: dict = None):
+        with self._lock:
+            self.status = 'succeeded'
+            self.result = result
+            self._finish()
+
+    def fail(self, error: str, status_code: int = 500):
+        with self._lock:
+            self.status = 'failed'
+            self.error = error
+            self.status_code = status_code
+            self._finish()
+
+    def _finish(self):
+        self.finished_at = _now()
+        self._finished = time.perf_counter()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ('succeeded', 'failed')
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            running = next((s['name'] for s in self.stages if s['status'] == 'running'), None)
+            elapsed = None
+            if self._started is not None:
+                elapsed = round((self._finished or time.perf_counter()) - self._started, 3)
+            return {
+                'job_id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'current_stage': running,
+                'stages': [dict(s) for s in self.stages],
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'elapsed_seconds': elapsed,
+                'meta': dict(self.meta),
+                'result': self.result,
+                'error': self.error,
+                'status_code': self.status_code,
+            }
+
+
+class JobRegistry:
+    """Thread-safe id -> Job map that forgets the oldest finished jobs"""
+
+    def __init__(self, history: int = JOB_HISTORY):
+        self._jobs = {}
+        self._history = history
+        self._lock = threading.Lock()
+
+    def create(self, kind: str, meta: dict = None) -> Job:
+        job = Job(kind, meta)
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = [j for j in self._jobs.values() if j.done]
+            for old in finished[:max(0, len(finished) - self._history)]:
+                del self._jobs[old.id]
+        return job
+
+    def discard(self, job_id: str):
+        """Forget a job that was never started, e.g. one a deduplicated request created"""
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, kind: str = None) -> list:
+        with self._lock:
+            jobs = [j for j in self._jobs.values() if kind is None or j.kind == kind]
+        return jobs
+
+
+jobs = JobRegistry()
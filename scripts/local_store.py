@@ -0,0 +1,195 @@
+"""
+Local embedded storage backend
+SQLite implementation of the storage primitives used by DB_server, so the
+upload -> notify -> train -> predict pipeline can run without Supabase.
+
+Enable with:
+    DB_BACKEND=sqlite
+    DB_SQLITE_PATH=./lontuktak_local.db   (or :memory:)
+
+Tables are created on first write and gain columns as new keys appear,
+mirroring the schemaless way the backend writes records through PostgREST.
+Reading a table that was never written returns no rows.
+"""
+
+import sqlite3
+import threading
+
+
+def _quote(identifier: str) -> str:
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+# Case-sensitive LIKE runs as GLOB: SQL wildcards map to GLOB ones and GLOB's
+# own metacharacters are matched literally through single-character classes
+_GLOB_TRANSLATION = {'%': '*', '_': '?', '*': '[*]', '?': '[?]', '[': '[[]'}
+
+
+def _like_to_glob(pattern: str) -> str:
+    return ''.join(_GLOB_TRANSLATION.get(char, char) for char in pattern)
+
+
+class LocalStore:
+    """Thread-safe SQLite store that evaluates DB_server query specs"""
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._columns = {}
+
+    # ------------------------------------------------------
+    # Schema helpers
+    # ------------------------------------------------------
+    def _table_columns(self, table: str) -> list:
+        if table not in self._columns:
+            rows = self._conn.execute(f"PRAGMA table_info({_quote(table)})").fetchall()
+            if not rows:
+                return []
+            self._columns[table] = [row['name'] for row in rows]
+        return self._columns[table]
+
+    def _ensure_columns(self, table: str, columns: list):
+        existing = self._table_columns(table)
+        if not existing:
+            column_sql = ', '.join(_quote(c) for c in columns)
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {_quote(table)} ({column_sql})")
+            self._columns[table] = list(columns)
+            return
+        for column in columns:
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(column)}")
+                existing.append(column)
+
+    def _ensure_unique(self, table: str, columns: list):
+        name = f"uq_{table}_{'_'.join(columns)}"
+        column_sql = ', '.join(_quote(c) for c in columns)
+        self._conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {_quote(name)} ON {_quote(table)} ({column_sql})")
+
+    # ------------------------------------------------------
+    # Spec translation
+    # ------------------------------------------------------
+    @staticmethod
+    def _conditions(filters: list):
+        clauses, args = [], []
+        for column, op, value in filters:
+            if op == 'or':
+                groups = []
+                for group in value:
+                    group_clauses, group_args = LocalStore._conditions(group)
+                    groups.append('(' + (' AND '.join(group_clauses) or '1') + ')')
+                    args.extend(group_args)
+                clauses.append('(' + (' OR '.join(groups) or '0') + ')')
+                continue
+            col = _quote(column)
+            if op in ('in', 'not_in'):
+                if not value:
+                    clauses.append('0' if op == 'in' else '1')
+                    continue
+                placeholders = ', '.join('?' for _ in value)
+                clauses.append(f"{col} {'NOT IN' if op == 'not_in' else 'IN'} ({placeholders})")
+                args.extend(value)
+            elif op == 'is':
+                clauses.append(f"{col} IS NULL")
+            elif op == 'not_is':
+                clauses.append(f"{col} IS NOT NULL")
+            elif op in ('like', 'not_like'):
+                clauses.append(f"{col} {'NOT ' if op == 'not_like' else ''}GLOB ?")
+                args.append(_like_to_glob(str(value)))
+            elif op in ('ilike', 'not_ilike'):
+                clauses.append(f"{col} {'NOT ' if op == 'not_ilike' else ''}LIKE ?")
+                args.append(value)
+            else:
+                sql_op = {'eq': '=', 'neq': '!=', 'lt': '<', 'lte': '<=', 'gt': '>', 'gte': '>='}[op]
+                clauses.append(f"{col} {sql_op} ?")
+                args.append(value)
+        return clauses, args
+
+    @staticmethod
+    def _where(filters: list):
+        clauses, args = LocalStore._conditions(filters)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', args
+
+    # ------------------------------------------------------
+    # Primitives
+    # ------------------------------------------------------
+    def select(self, spec: dict) -> list:
+        with self._lock:
+            if not self._table_columns(spec['table']):
+                return []
+            if spec['columns']:
+                projection = ', '.join(
+                    f"{_quote(name)} AS {_quote(alias or name)}" for name, alias in spec['columns']
+                )
+            else:
+                projection = '*'
+            where, args = self._where(spec['filters'])
+            sql = f"SELECT {'DISTINCT ' if spec['distinct'] else ''}{projection} FROM {_quote(spec['table'])}{where}"
+            if spec['order']:
+                # Match Postgres: NULLs sort last ascending and first descending
+                sql += ' ORDER BY ' + ', '.join(
+                    f"{_quote(column)} {'DESC NULLS FIRST' if desc else 'ASC NULLS LAST'}"
+                    for column, desc in spec['order']
+                )
+            if spec['limit'] is not None or spec['offset']:
+                sql += ' LIMIT ? OFFSET ?'
+                args += [spec['limit'] if spec['limit'] is not None else -1, spec['offset'] or 0]
+            return [dict(row) for row in self._conn.execute(sql, args).fetchall()]
+
+    def count(self, spec: dict) -> int:
+        with self._lock:
+            if not self._table_columns(spec['table']):
+                return 0
+            where, args = self._where(spec['filters'])
+            return self._conn.execute(f"SELECT COUNT(*) FROM {_quote(spec['table'])}{where}", args).fetchone()[0]
+
+    def write(self, table: str, records: list, on_conflict: str = None) -> list:
+        if not records:
+            return []
+        columns = list(dict.fromkeys(key for record in records for key in record))
+        with self._lock:
+            self._ensure_columns(table, columns)
+            column_sql = ', '.join(_quote(c) for c in columns)
+            sql = f"INSERT INTO {_quote(table)} ({column_sql}) VALUES ({', '.join('?' for _ in columns)})"
+            if on_conflict:
+                keys = [c.strip() for c in on_conflict.split(',')]
+                self._ensure_unique(table, keys)
+                updates = ', '.join(f"{_quote(c)} = excluded.{_quote(c)}" for c in columns if c not in keys)
+                sql += f" ON CONFLICT ({', '.join(_quote(k) for k in keys)}) "
+                sql += f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+            rows = [tuple(record.get(c) for c in columns) for record in records]
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(sql, rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return records
+
+    def update(self, table: str, data: dict, filters: list) -> list:
+        with self._lock:
+            if not self._table_columns(table):
+                return []
+            self._ensure_columns(table, list(data))
+            where, args = self._where(filters)
+            assignments = ', '.join(f"{_quote(c)} = ?" for c in data)
+            self._conn.execute(f"UPDATE {_quote(table)} SET {assignments}{where}", list(data.values()) + args)
+            return self.select({'table': table, 'columns': None, 'distinct': False, 'filters': filters,
+                                'order': [], 'limit': None, 'offset': None})
+
+    def delete(self, table: str, filters: list) -> list:
+        with self._lock:
+            if not self._table_columns(table):
+                return []
+            where, args = self._where(filters)
+            self._conn.execute(f"DELETE FROM {_quote(table)}{where}", args)
+            return []
+
+    def execute_sql(self, query: str):
+        with self._lock:
+            self._conn.executescript(query)
+            self._columns.clear()
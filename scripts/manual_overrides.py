@@ -0,0 +1,140 @@
+"""
+Manual min_stock overrides
+An in-memory SKU -> min_stock index, loaded once from the manual_overrides
+table (see create_manual_overrides_table.sql). generate_stock_report looks
+overrides up here instead of downloading stock_notifications on every call.
+
+set_min_stock updates the index immediately and persists the change on a
+single background writer thread, so writes reach the table in call order
+without holding up the request. A write that still fails after
+WRITE_RETRIES attempts rolls its SKUs back in the index and raises through
+the returned future, so callers can report that the value was not saved.
+
+A failed load (e.g. the table has not been created yet) is logged and the
+index serves no overrides until a later call loads it; the table stays the
+source of truth, so the next report after a successful load restores them.
+"""
+
+import time
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from DB_server import read_table_pages, upsert_data, delete_rows
+
+OVERRIDES_TABLE = 'manual_overrides'
+WRITE_RETRIES = 2
+WRITE_RETRY_DELAY = 0.5  # seconds, doubled on every retry
+
+_overrides = {}
+_loaded = False
+_lock = threading.Lock()
+
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='manual-overrides')
+_pending = set()
+
+
+def load(force: bool = False) -> dict:
+    """
+    Load the index from the database once (again with force=True).
+    If the table cannot be read the index stays unloaded (no overrides) and
+    the load is retried on the next call.
+    """
+    global _loaded
+    with _lock:
+        if _loaded and not force:
+            return _overrides
+        try:
+            # read_table would turn a failed read into an empty table
+            chunks = list(read_table_pages(f"SELECT product_sku, min_stock FROM {OVERRIDES_TABLE}"))
+        except Exception as e:
+            print(f"[Overrides] ⚠️ Could not load manual overrides ({e}); using none until the next attempt")
+            return _overrides
+        _overrides.clear()
+        for df in chunks:
+            if df.empty:
+                continue
+            df = df.dropna(subset=['min_stock'])
+            _overrides.update(zip(df['product_sku'].astype(str), df['min_stock'].astype(int)))
+        _loaded = True
+    print(f"[Overrides] Loaded {len(_overrides)} manual min_stock overrides")
+    return _overrides
+
+
+def get_overrides() -> dict:
+    """Snapshot of the SKU -> min_stock index"""
+    load()
+    with _lock:
+        return dict(_overrides)
+
+
+def get_min_stock(product_sku: str):
+    """Manual min_stock of one SKU, or None"""
+    load()
+    with _lock:
+        return _overrides.get(str(product_sku))
+
+
+def _write(records: list, cleared: list) -> bool:
+    if records and upsert_data(OVERRIDES_TABLE, records) is None:
+        return False
+    if cleared and delete_rows(OVERRIDES_TABLE, 'product_sku', cleared) is None:
+        return False
+    return True
+
+
+def _persist(records: list, cleared: list, written: dict, previous: dict):
+    """Write one set_min_stock call; on final failure undo it in the index and raise"""
+    for attempt in range(WRITE_RETRIES + 1):
+        if _write(records, cleared):
+            return
+        if attempt < WRITE_RETRIES:
+            delay = WRITE_RETRY_DELAY * (2 ** attempt)
+            print(f"[Overrides] ⚠️ Write failed, retry {attempt + 1}/{WRITE_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+
+    with _lock:
+        # Only undo SKUs that no later call has changed since
+        for sku, value in written.items():
+            if _overrides.get(sku) != value:
+                continue
+            if previous[sku] is None:
+                _overrides.pop(sku, None)
+            else:
+                _overrides[sku] = previous[sku]
+    print(f"[Overrides] ❌ Failed to persist {len(records)} overrides / clear {len(cleared)}; index rolled back")
+    raise RuntimeError(f"Could not save manual overrides for {', '.join(sorted(written))}")
+
+
+def set_min_stock(values: dict):
+    """
+    Set manual min_stock per SKU ({sku: min_stock}); None clears the override.
+    The index changes immediately; returns the future of the background
+    write, which raises RuntimeError if the table could not be updated.
+    """
+    load()
+    now = datetime.now().isoformat()
+    records, cleared = [], []
+    written, previous = {}, {}
+    with _lock:
+        for sku, min_stock in values.items():
+            sku = str(sku)
+            previous[sku] = _overrides.get(sku)
+            written[sku] = None if min_stock is None or pd.isna(min_stock) else int(min_stock)
+            if min_stock is None or pd.isna(min_stock):
+                _overrides.pop(sku, None)
+                cleared.append(sku)
+            else:
+                _overrides[sku] = int(min_stock)
+                records.append({'product_sku': sku, 'min_stock': int(min_stock), 'updated_at': now})
+    future = _writer.submit(_persist, records, cleared, written, previous)
+    _pending.add(future)
+    future.add_done_callback(_pending.discard)
+    return future
+
+
+def flush(timeout: float = None):
+    """Wait for queued writes to reach the database"""
+    wait(list(_pending), timeout=timeout)
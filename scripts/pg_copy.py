@@ -0,0 +1,132 @@
+"""
+Direct Postgres COPY bulk loader
+Streams a DataFrame through COPY ... FROM STDIN into a temporary staging
+table and merges it into the target in the same transaction, so large
+loads skip the REST JSON round trips entirely.
+
+Enable by pointing DATABASE_URL at the Postgres database behind Supabase:
+    DATABASE_URL=postgresql://postgres:<password>@db.<project>.supabase.co:5432/postgres
+
+Requires psycopg2 (psycopg2-binary in requirements.txt). When it is not
+installed or DATABASE_URL is not a Postgres DSN, DB_server keeps using the
+REST bulk loader.
+"""
+
+import io
+import pandas as pd
+
+try:
+    import psycopg2
+    PSYCOPG2_AVAILABLE = True
+except ImportError:
+    psycopg2 = None
+    PSYCOPG2_AVAILABLE = False
+
+# Marker written for missing values; COPY reads it back as NULL
+NULL_MARKER = '\\N'
+
+# information_schema data types rendered as integers in the CSV
+INTEGER_TYPES = ('smallint', 'integer', 'bigint')
+
+
+def _quote(identifier: str) -> str:
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+def is_postgres_dsn(dsn: str) -> bool:
+    return bool(dsn) and dsn.split('://', 1)[0] in ('postgres', 'postgresql')
+
+
+def _integer_columns(cur, table_name: str) -> set:
+    """Columns of table_name with an integer type"""
+    cur.execute(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = %s AND data_type IN %s",
+        (table_name, INTEGER_TYPES),
+    )
+    return {row[0] for row in cur.fetchall()}
+
+
+def _cast_integer_columns(df: pd.DataFrame, integer_columns: set) -> pd.DataFrame:
+    """
+    Float columns bound for integer columns as nullable ints, so the CSV
+    holds "5" rather than "5.0" (a NaN upcasts an int column to float and
+    COPY rejects "5.0" for an integer column). Raises if a value is not whole.
+    """
+    floats = [c for c in df.columns if c in integer_columns and pd.api.types.is_float_dtype(df[c])]
+    if not floats:
+        return df
+    df = df.copy()
+    for column in floats:
+        df[column] = df[column].astype('Int64')
+    return df
+
+
+class _CsvStream(io.TextIOBase):
+    """File-like object that renders a DataFrame as CSV a chunk at a time,
+    so COPY streams the frame without building the whole payload in memory"""
+
+    def __init__(self, df: pd.DataFrame, chunk_rows: int):
+        self._df = df
+        self._chunk_rows = chunk_rows
+        self._position = 0
+        self._buffer = ''
+
+    def readable(self):
+        return True
+
+    def _next_chunk(self) -> str:
+        chunk = self._df.iloc[self._position:self._position + self._chunk_rows]
+        self._position += self._chunk_rows
+        return chunk.to_csv(index=False, header=False, na_rep=NULL_MARKER)
+
+    def read(self, size: int = -1) -> str:
+        while (size < 0 or len(self._buffer) < size) and self._position < len(self._df):
+            self._buffer += self._next_chunk()
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def copy_merge(dsn: str, table_name: str, df: pd.DataFrame, on_conflict: str = None,
+               chunk_rows: int = 10000, connect_timeout: int = 10) -> int:
+    """
+    Load df into table_name through a staging table:
+        (float columns bound for integer columns are written as ints)
+        CREATE TEMP TABLE ... (LIKE table_name INCLUDING DEFAULTS)
+        COPY staging (columns) FROM STDIN (FORMAT csv)
+        INSERT INTO table_name SELECT ... FROM staging [ON CONFLICT DO UPDATE]
+    Everything runs in one transaction: a failure leaves the target untouched.
+    Returns the number of rows merged.
+    """
+    if not PSYCOPG2_AVAILABLE:
+        raise RuntimeError("psycopg2 is not installed")
+
+    columns = list(df.columns)
+    column_sql = ', '.join(_quote(c) for c in columns)
+    staging = _quote(f"_stage_{table_name}")
+
+    merge_sql = (f"INSERT INTO {_quote(table_name)} ({column_sql}) "
+                 f"SELECT {column_sql} FROM {staging}")
+    if on_conflict:
+        keys = [k.strip() for k in on_conflict.split(',')]
+        updates = ', '.join(f"{_quote(c)} = EXCLUDED.{_quote(c)}" for c in columns if c not in keys)
+        merge_sql += f" ON CONFLICT ({', '.join(_quote(k) for k in keys)}) "
+        merge_sql += f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+
+    conn = psycopg2.connect(dsn, connect_timeout=connect_timeout)
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                df = _cast_integer_columns(df, _integer_columns(cur, table_name))
+                cur.execute(f"CREATE TEMP TABLE {staging} (LIKE {_quote(table_name)} INCLUDING DEFAULTS) "
+                            f"ON COMMIT DROP")
+                cur.copy_expert(
+                    f"COPY {staging} ({column_sql}) FROM STDIN WITH (FORMAT csv, NULL '{NULL_MARKER}')",
+                    _CsvStream(df, chunk_rows),
+                )
+                cur.execute(merge_sql)
+                return cur.rowcount
+    finally:
+        conn.close()
@@ -0,0 +1,173 @@
+"""
+Restock rule engine
+One vectorized implementation of the restock math, shared by the weekly
+stock report and manual min_stock / buffer updates:
+
+    weekly_sale     weekly consumption, at least 1: the smoothed multi-week
+                    rate when one is given (see consumption.py), else
+                    last_stock - stock_level
+    decrease_rate   weekly consumption as a share of last_stock (%)
+    weeks_to_empty  stock_level / weekly_sale
+    min_stock       manual value, else weekly_sale * weeks_to_cover * safety_factor
+    buffer          manual value, else 20 / 10 / 5 units for a decrease rate
+                    above 50% / above 20% / otherwise, capped at max_buffer
+    reorder_qty     min_stock + buffer - stock_level, at least weekly_sale * safety_factor
+    status          Red below min_stock or above 50% decrease, Yellow above 20%, else Green
+
+The parameters come from named rule sets (RULE_SETS). RESTOCK_RULE_SET picks
+the one used by default; the 'default' set itself can be tuned with
+RESTOCK_SAFETY_FACTOR, RESTOCK_WEEKS_TO_COVER and RESTOCK_MAX_BUFFER.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+
+class RestockRules:
+    """Parameters of the restock formulas"""
+
+    def __init__(self, safety_factor: float = 1.5, weeks_to_cover: float = 2, max_buffer: int = 50):
+        self.safety_factor = safety_factor
+        self.weeks_to_cover = weeks_to_cover
+        self.max_buffer = max_buffer
+
+    def to_dict(self) -> dict:
+        return {
+            'safety_factor': self.safety_factor,
+            'weeks_to_cover': self.weeks_to_cover,
+            'max_buffer': self.max_buffer,
+        }
+
+
+DEFAULT_RULES = RestockRules(
+    safety_factor=float(os.getenv("RESTOCK_SAFETY_FACTOR", "1.5")),
+    weeks_to_cover=float(os.getenv("RESTOCK_WEEKS_TO_COVER", "2")),
+    max_buffer=int(os.getenv("RESTOCK_MAX_BUFFER", "50")),
+)
+
+RULE_SETS = {
+    'default': DEFAULT_RULES,
+    'conservative': RestockRules(safety_factor=2.0, weeks_to_cover=3, max_buffer=50),
+    'lean': RestockRules(safety_factor=1.2, weeks_to_cover=1, max_buffer=20),
+}
+
+# Rule set used when a caller does not name one
+ACTIVE_RULE_SET = os.getenv("RESTOCK_RULE_SET", "default")
+
+# Derived columns that stock_notifications stores
+STORED_COLUMNS = [
+    'weekly_consumption', 'decrease_rate', 'weeks_to_empty', 'min_stock', 'reorder_qty', 'status', 'description'
+]
+
+
+def get_rules(rules=None) -> RestockRules:
+    """Resolve None (ACTIVE_RULE_SET), a rule set name or a RestockRules instance"""
+    if rules is None:
+        rules = ACTIVE_RULE_SET
+    if isinstance(rules, RestockRules):
+        return rules
+    if rules not in RULE_SETS:
+        raise ValueError(f"Unknown restock rule set {rules!r}; expected one of {', '.join(RULE_SETS)}")
+    return RULE_SETS[rules]
+
+
+def _as_series(values, index) -> pd.Series:
+    if values is None:
+        return pd.Series(np.nan, index=index)
+    if isinstance(values, pd.Series):
+        return pd.to_numeric(values, errors='coerce').set_axis(index)
+    return pd.Series(pd.to_numeric(np.broadcast_to(values, len(index)), errors='coerce'), index=index)
+
+
+def compute_restock(stock_level, last_stock, min_stock=None, buffer=None, rules=None,
+                    consumption=None) -> pd.DataFrame:
+    """
+    Derive every restock column for aligned arrays of stock_level and
+    last_stock. min_stock / buffer are optional manual values and
+    consumption an optional smoothed weekly consumption (arrays or scalars);
+    missing entries fall back to the formulas / the single-week diff.
+    Returns a frame (indexed like stock_level when it is a Series) with
+    weekly_consumption, weekly_sale, decrease_rate, weeks_to_empty,
+    min_stock, dynamic_buffer, buffer, reorder_qty, status and description.
+    """
+    rules = get_rules(rules)
+    index = stock_level.index if isinstance(stock_level, pd.Series) else pd.RangeIndex(len(stock_level))
+    stock = _as_series(stock_level, index).fillna(0)
+    last = _as_series(last_stock, index).fillna(stock)
+
+    rate = _as_series(consumption, index)
+    # A restock week is no consumption, not a negative one
+    rate = rate.where(rate.notna(), (last - stock).clip(lower=0))
+    weekly_sale = rate.clip(lower=1)
+    decrease_rate = (rate / last.where(last > 0) * 100).fillna(0).round(1)
+    weeks_to_empty = (stock / weekly_sale).round(2)
+
+    manual_min = _as_series(min_stock, index)
+    default_min = (weekly_sale * rules.weeks_to_cover * rules.safety_factor).astype(int)
+    min_values = manual_min.where(manual_min.notna(), default_min).astype(int)
+
+    dynamic = np.minimum(np.select([decrease_rate > 50, decrease_rate > 20], [20, 10], default=5), rules.max_buffer)
+    dynamic = pd.Series(dynamic, index=index).astype(int)
+    manual_buffer = _as_series(buffer, index)
+    buffer_values = manual_buffer.where(manual_buffer.notna(), dynamic).astype(int)
+
+    default_reorder = (weekly_sale * rules.safety_factor).astype(int)
+    reorder_qty = np.maximum(min_values + buffer_values - stock, default_reorder).astype(int)
+
+    is_red = ((stock < min_values) | (decrease_rate > 50)).to_numpy()
+    is_yellow = ~is_red & (decrease_rate > 20).to_numpy()
+    reorder_text = reorder_qty.astype(str).to_numpy()
+    status = np.where(is_red, 'Red', np.where(is_yellow, 'Yellow', 'Green'))
+    description = np.where(
+        is_red,
+        'Decreasing rapidly and nearly out of stock! Recommend restocking ' + reorder_text + ' units',
+        np.where(
+            is_yellow,
+            'Decreasing rapidly, should prepare to restock. Recommend restocking ' + reorder_text + ' units',
+            'Stock is sufficient'
+        )
+    )
+
+    return pd.DataFrame({
+        'weekly_consumption': rate.round(2),
+        'weekly_sale': weekly_sale,
+        'decrease_rate': decrease_rate,
+        'weeks_to_empty': weeks_to_empty,
+        'min_stock': min_values,
+        'dynamic_buffer': dynamic,
+        'buffer': buffer_values,
+        'reorder_qty': reorder_qty,
+        'status': status,
+        'description': description,
+    }, index=index)
+
+
+def reprice(df: pd.DataFrame, mask=None, min_stock=None, buffer=None, rules=None,
+            consumption=None, columns: list = None) -> pd.DataFrame:
+    """
+    Recompute the restock columns of the rows of df selected by mask (all
+    rows by default) in place, from their stock_level and last_stock.
+    min_stock / buffer / consumption are values aligned with df or scalars;
+    consumption defaults to df's stored weekly_consumption, so repricing
+    keeps the smoothed rate of the last report. Missing entries fall back to
+    the formulas. Only `columns` (STORED_COLUMNS by default) are written
+    back to df.
+    Returns the derived frame for the selected rows.
+    """
+    rows = df.index if mask is None else df.index[np.asarray(mask, dtype=bool)]
+
+    def pick(values):
+        if isinstance(values, pd.Series):
+            return values.reindex(rows)
+        return values
+
+    if consumption is None and 'weekly_consumption' in df.columns:
+        consumption = df['weekly_consumption']
+    derived = compute_restock(
+        df.loc[rows, 'stock_level'], df.loc[rows, 'last_stock'],
+        min_stock=pick(min_stock), buffer=pick(buffer), rules=rules, consumption=pick(consumption)
+    )
+    for column in columns or STORED_COLUMNS:
+        df.loc[rows, column] = derived[column]
+    return derived
@@ -0,0 +1,254 @@
+"""
+Stock file parsing
+Loads weekly stock exports (Excel or CSV, Thai or English headers, title
+rows above the header) into frames with the base_stock columns.
+
+Kept free of the web app and database so parse_stock_file can run in
+worker processes (see parse_stock_files and the /notifications/backfill
+endpoint).
+"""
+
+import io
+import os
+import re
+import csv
+import sys
+import types
+import codecs
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+# Worker processes that parse backfill files
+PARSE_WORKERS = int(os.getenv("BACKFILL_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+STOCK_COLUMN_MAPPING = {
+    # SKU columns
+    "รหัสสินค้า": "Product_SKU",
+    "เลขอ้างอิง SKU (SKU Reference No.)": "Product_SKU",
+    "Product_SKU": "Product_SKU",
+    "SKU": "Product_SKU",
+    "รหัส": "Product_SKU",
+    "Code": "Product_SKU",
+
+    # Product name columns
+    "ชื่อสินค้า": "product_name",
+    "สินค้า": "product_name",
+    "Product Name": "product_name",
+    "Name": "product_name",
+
+    # Stock level columns
+    "จำนวนคงเหลือ": "stock_level",
+    "จำนวน": "stock_level",
+    "Stock": "stock_level",
+    "Quantity": "stock_level",
+
+    # Category columns
+    "หมวดหมู่": "category",
+    "Category": "category",
+    "ประเภท": "category"
+}
+
+SNIFF_SAMPLE_BYTES = 64 * 1024
+
+# xlsx files are zip archives; legacy xls files are OLE2 compound documents
+EXCEL_SIGNATURES = (b"PK\x03\x04", b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1")
+
+
+def sniff_csv_encoding(content: bytes) -> str:
+    """Pick the text encoding from a byte sample: BOM, then UTF-8, else Thai cp874"""
+    if content.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # Incremental decoder tolerates a multi-byte character cut at the sample edge
+        codecs.getincrementaldecoder('utf-8')().decode(content[:SNIFF_SAMPLE_BYTES], final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        # cp874 is a superset of TIS-620
+        return 'cp874'
+
+
+def find_header_row(rows, possible_headers=(0, 1, 2, 3)):
+    """
+    Return the index of the row that looks like the header: it must name a
+    SKU column and, among candidates, match the most known column names.
+    `rows` are the first rows of the file as lists of cell values.
+    """
+    best_row, best_score = None, 0
+    for h in possible_headers:
+        if h >= len(rows):
+            continue
+        names = {str(cell).strip() for cell in rows[h] if not pd.isna(cell)}
+        mapped = {STOCK_COLUMN_MAPPING[name] for name in names if name in STOCK_COLUMN_MAPPING}
+        if 'Product_SKU' in mapped and len(mapped) > best_score:
+            best_row, best_score = h, len(mapped)
+    return best_row
+
+
+def load_file_with_fallback(file_content, possible_headers=[0,1,2,3]):
+    """
+    Load an Excel/CSV stock file whose header may sit below a few title rows.
+    `file_content` is a path (e.g. a spooled upload), bytes or a binary file
+    object. The format is detected from the file signature and the CSV
+    encoding from a byte sample; the header row is found by scanning the
+    first rows against STOCK_COLUMN_MAPPING, then the file is parsed in full
+    exactly once, straight from the source without copying it into memory.
+    Returns (DataFrame, header_row_used)
+    """
+    if isinstance(file_content, (bytes, bytearray)):
+        file_content = io.BytesIO(file_content)
+
+    def source():
+        # Paths are reopened by pandas; buffers are rewound for every pass
+        if hasattr(file_content, 'seek'):
+            file_content.seek(0)
+        return file_content
+
+    if hasattr(file_content, 'read'):
+        sample = source().read(SNIFF_SAMPLE_BYTES)
+    else:
+        with open(file_content, 'rb') as f:
+            sample = f.read(SNIFF_SAMPLE_BYTES)
+
+    sniff_rows = max(possible_headers) + 1
+
+    if sample.startswith(EXCEL_SIGNATURES):
+        preview = pd.read_excel(source(), header=None, nrows=sniff_rows)
+        h = find_header_row(preview.values.tolist(), possible_headers)
+        if h is None:
+            raise ValueError(f"❌ Could not find a SKU column in the first {sniff_rows} rows of the Excel file")
+        df = pd.read_excel(source(), header=h)
+        print(f"✓ Found Excel with header row {h}")
+    else:
+        encoding = sniff_csv_encoding(sample)
+        # read_csv skips blank lines when counting header rows, so the preview does too
+        text = sample.decode(encoding, errors='ignore')
+        preview = [row for row in csv.reader(io.StringIO(text)) if row][:sniff_rows]
+        h = find_header_row(preview, possible_headers)
+        if h is None:
+            raise ValueError(f"❌ Could not find a SKU column in the first {sniff_rows} rows of the CSV file ({encoding})")
+        try:
+            df = pd.read_csv(source(), header=h, encoding=encoding)
+        except UnicodeDecodeError:
+            # The sample was valid UTF-8 but the rest of the file is not
+            encoding = 'cp874'
+            df = pd.read_csv(source(), header=h, encoding=encoding)
+        print(f"✓ Found CSV with encoding {encoding}, header row {h}")
+
+    # Drop the index column if it exists
+    df = df.drop(columns=['#', 'Unnamed: 0'], errors='ignore')
+    df.columns = df.columns.astype(str).str.strip()
+    df = df.rename(columns=STOCK_COLUMN_MAPPING)
+
+    # Convert stock_level to numeric
+    if 'stock_level' in df.columns:
+        df['stock_level'] = pd.to_numeric(df['stock_level'], errors='coerce').fillna(0).astype(int)
+
+    return df, h
+
+
+# Normalize column names to expected keys so generate_stock_report doesn't KeyError
+def ensure_sku_column(df):
+    # make a copy to avoid modifying original
+    df = df.copy()
+    cols = {str(c): c for c in df.columns}
+    # find SKU-like column (case-insensitive)
+    sku_col = None
+    for c in cols:
+        if 'sku' in c.lower():
+            sku_col = cols[c]
+            break
+    if sku_col is not None and str(sku_col) != 'product_sku':
+        df = df.rename(columns={sku_col: 'product_sku'})
+    # product name
+    name_col = None
+    for c in cols:
+        if 'product' in c.lower() and 'name' in c.lower():
+            name_col = cols[c]
+            break
+    if name_col is not None and str(name_col) != 'product_name':
+        df = df.rename(columns={name_col: 'product_name'})
+    # stock level
+    stock_col = None
+    for c in cols:
+        if 'stock' in c.lower() or c.lower() == 'จำนวน' or 'quantity' in c.lower():
+            stock_col = cols[c]
+            break
+    if stock_col is not None and str(stock_col) != 'stock_level':
+        df = df.rename(columns={stock_col: 'stock_level'})
+    # category
+    cat_col = None
+    for c in cols:
+        if 'หมวด' in c or 'category' in c.lower():
+            cat_col = cols[c]
+            break
+    if cat_col is not None and str(cat_col) != 'category':
+        df = df.rename(columns={cat_col: 'category'})
+    return df
+
+
+def normalize_stock_frame(df):
+    """Map Thai/English stock columns to the base_stock schema and drop rows without SKU/category"""
+    df = df.rename(columns={
+        'ชื่อสินค้า': 'product_name',
+        'รหัสสินค้า': 'product_sku',
+        'จำนวนคงเหลือ': 'stock_level',
+        'จำนวน': 'stock_level',
+        'หมวดหมู่': 'category',
+        "หมวดหมู่ย่อย" : 'category'
+    })
+    df["stock_level"] = pd.to_numeric(df["stock_level"], errors='coerce').fillna(0).astype(int)
+    # Normalize column names (handle upper/lowercase automatically)
+    df.columns = df.columns.str.strip().str.lower()
+    return df.dropna(subset=['product_sku','category'])
+
+
+# Dates in export file names: 2025-01-31, 2025_01_31, 2025.01.31 or 20250131
+_FILE_DATE_RE = re.compile(r'(?<!\d)(\d{4})[-_.]?(\d{2})[-_.]?(\d{2})(?!\d)')
+
+
+def snapshot_date_from_name(filename: str) -> str:
+    """ISO date embedded in a stock export's file name, or None"""
+    for match in _FILE_DATE_RE.finditer(filename or ''):
+        try:
+            return pd.Timestamp(f"{match.group(1)}-{match.group(2)}-{match.group(3)}").date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_stock_file(path: str) -> pd.DataFrame:
+    """
+    Load one stock file into the base_stock columns
+    (product_sku, product_name, stock_level, category), one row per SKU.
+    Top-level and picklable so it can run in a process pool.
+    """
+    df, _ = load_file_with_fallback(path)
+    required_columns = ['Product_SKU', 'product_name', 'stock_level', 'category']
+    missing_columns = [col for col in required_columns if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Missing required columns: {', '.join(missing_columns)}")
+    df = normalize_stock_frame(df[required_columns])
+    df = df[['product_sku', 'product_name', 'stock_level', 'category']]
+    return df.drop_duplicates(subset='product_sku', keep='last').reset_index(drop=True)
+
+
+def parse_stock_files(paths: list, workers: int = None) -> list:
+    """
+    Parse stock files in parallel worker processes, returning frames in the
+    order of paths. Workers are spawned (no inherited server threads or
+    connection pools) without re-running the launching script, so each one
+    imports only this module instead of the whole web app.
+    """
+    workers = max(1, min(workers or PARSE_WORKERS, len(paths)))
+    # spawn re-imports the parent's __main__ in every worker unless it has no
+    # file, as in an interactive session; hide it while the workers start
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = types.ModuleType('__main__')
+    try:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        futures = [pool.submit(parse_stock_file, path) for path in paths]
+    finally:
+        sys.modules['__main__'] = main
+    with pool:
+        return [future.result() for future in futures]
@@ -0,0 +1,211 @@
+"""
+Weekly stock snapshot history
+Every stock upload is appended to stock_history keyed by
+(snapshot_date, product_sku), storing only the rows that changed since the
+previous upload (see create_stock_history_table.sql):
+
+    stock_history            one row per SKU whose stock/name/category changed,
+                             or a tombstone (removed = true) when it disappeared
+    stock_history_snapshots  one row per snapshot date with its counts
+
+The state of a SKU on any snapshot date is its latest change on or before
+that date, so reads forward-fill changes over the snapshot timeline.
+Reads raise RuntimeError when the tables cannot be read.
+"""
+
+import os
+from datetime import date, datetime
+import pandas as pd
+
+from DB_server import read_table, execute_query, upsert_data, diff_frames
+
+HISTORY_TABLE = 'stock_history'
+SNAPSHOTS_TABLE = 'stock_history_snapshots'
+
+# Columns whose change creates a history row; flags/counters are derived
+HISTORY_COLUMNS = ['product_name', 'category', 'stock_level']
+
+# SKUs per IN (...) filter when reading the history of many SKUs
+SKU_BATCH = int(os.getenv("STOCK_HISTORY_SKU_BATCH", "200"))
+
+
+def _as_date(value) -> str:
+    if value is None:
+        return None
+    return pd.Timestamp(value).date().isoformat()
+
+
+def _read(query: str, params: dict = None) -> pd.DataFrame:
+    """read_table that raises instead of returning None, so a failed read never looks like no history"""
+    df = read_table(query, params)
+    if df is None:
+        raise RuntimeError(f"Failed to read stock history: {query}")
+    return df
+
+
+def _snapshot_rows(df_new: pd.DataFrame, df_old: pd.DataFrame, snapshot_date: str) -> tuple:
+    """History rows and summary for one snapshot: new/changed SKUs plus tombstones for removed ones"""
+    diff = diff_frames(df_new, df_old, 'product_sku', HISTORY_COLUMNS)
+
+    changed = pd.concat([diff['inserted'], diff['changed']], ignore_index=True)
+    rows = changed[['product_sku'] + [c for c in HISTORY_COLUMNS if c in changed.columns]].copy()
+    rows['removed'] = False
+    if diff['removed']:
+        rows = pd.concat([rows, pd.DataFrame({'product_sku': diff['removed'], 'removed': True})], ignore_index=True)
+    rows.insert(0, 'snapshot_date', snapshot_date)
+
+    summary = {
+        'snapshot_date': snapshot_date,
+        'skus': int(df_new['product_sku'].nunique()),
+        'changed_rows': int(len(changed)),
+        'removed_rows': len(diff['removed']),
+        'unchanged_rows': diff['unchanged'],
+    }
+    return rows, summary
+
+
+def record_stock_snapshots(snapshots: list, df_old: pd.DataFrame = None) -> list:
+    """
+    Append consecutive snapshots to the history in one write per table.
+    `snapshots` is a list of (snapshot_date, base_stock frame) in date order;
+    each is diffed against the one before it, the first against df_old
+    (the base_stock the first snapshot replaces).
+    Uploading twice on the same date updates that date's rows.
+    Returns one summary dict per snapshot, or None if a write failed.
+    """
+    frames, summaries = [], []
+    for snapshot_date, df_new in snapshots:
+        rows, summary = _snapshot_rows(df_new, df_old, _as_date(snapshot_date))
+        frames.append(rows)
+        summaries.append(summary)
+        df_old = df_new
+
+    rows = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if not rows.empty and upsert_data(HISTORY_TABLE, rows, on_conflict='snapshot_date,product_sku') is None:
+        return None
+    created_at = datetime.now().isoformat()
+    if summaries and upsert_data(SNAPSHOTS_TABLE, [dict(s, created_at=created_at) for s in summaries],
+                                 on_conflict='snapshot_date') is None:
+        return None
+    for summary in summaries:
+        print(f"[History] ✅ Recorded {summary['snapshot_date']}: {summary['changed_rows']} changed, "
+              f"{summary['removed_rows']} removed, {summary['unchanged_rows']} unchanged")
+    return summaries
+
+
+def record_stock_snapshot(df_new: pd.DataFrame, df_old: pd.DataFrame = None, snapshot_date=None) -> dict:
+    """
+    Append one upload to the history: rows of df_new (the new base_stock)
+    that are new or differ from df_old (the base_stock it replaces) in
+    HISTORY_COLUMNS, plus tombstones for SKUs that disappeared.
+    Returns a summary dict, or None if a write failed.
+    """
+    summaries = record_stock_snapshots([(snapshot_date or date.today(), df_new)], df_old)
+    return summaries[0] if summaries else None
+
+
+def latest_snapshot_date() -> str:
+    """Most recent snapshot date (ISO string), or None when nothing is recorded"""
+    df = execute_query(f"SELECT snapshot_date FROM {SNAPSHOTS_TABLE} ORDER BY snapshot_date DESC LIMIT 1")
+    return None if df.empty else _as_date(df['snapshot_date'].iloc[0])
+
+
+def snapshot_dates(start=None, end=None) -> list:
+    """Snapshot dates (ISO strings) in [start, end], oldest first"""
+    conditions, params = [], {}
+    if start is not None:
+        conditions.append("snapshot_date >= :start")
+        params['start'] = _as_date(start)
+    if end is not None:
+        conditions.append("snapshot_date <= :end")
+        params['end'] = _as_date(end)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    df = _read(f"SELECT snapshot_date FROM {SNAPSHOTS_TABLE}{where} ORDER BY snapshot_date ASC", params)
+    return [] if df.empty else [_as_date(d) for d in df['snapshot_date']]
+
+
+def _read_changes(skus: list = None, end: str = None) -> pd.DataFrame:
+    """History rows on or before `end`, optionally for a list of SKUs (read SKU_BATCH at a time)"""
+    conditions, params = [], {}
+    if end is not None:
+        conditions.append("snapshot_date <= :end")
+        params['end'] = end
+
+    def read(extra: list, extra_params: dict) -> pd.DataFrame:
+        clauses = conditions + extra
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return _read(f"SELECT * FROM {HISTORY_TABLE}{where} ORDER BY snapshot_date ASC",
+                          {**params, **extra_params})
+
+    if skus is None:
+        return read([], {})
+    skus = list(dict.fromkeys(skus))
+    frames = []
+    for i in range(0, len(skus), SKU_BATCH):
+        batch = {f"sku{n}": sku for n, sku in enumerate(skus[i:i + SKU_BATCH])}
+        placeholders = ', '.join(f":{name}" for name in batch)
+        frames.append(read([f"product_sku IN ({placeholders})"], batch))
+    frames = [f for f in frames if not f.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def read_stock_history(skus: list = None, start=None, end=None) -> pd.DataFrame:
+    """
+    Dense history: one row per (snapshot_date, product_sku) for every snapshot
+    date in [start, end], carrying each SKU's latest change forward. SKUs are
+    omitted on dates before they first appear or after they were removed.
+    Columns: snapshot_date, product_sku, product_name, category, stock_level
+    """
+    columns = ['snapshot_date', 'product_sku'] + HISTORY_COLUMNS
+    dates = snapshot_dates(start, end)
+    if not dates or (skus is not None and len(skus) == 0):
+        return pd.DataFrame(columns=columns)
+
+    changes = _read_changes(skus, dates[-1])
+    if changes.empty:
+        return pd.DataFrame(columns=columns)
+    changes['snapshot_date'] = pd.to_datetime(changes['snapshot_date'])
+    changes['removed'] = changes['removed'].fillna(False).astype(bool)
+
+    # Every (date, sku) pair, then the latest change at or before each date
+    grid = pd.MultiIndex.from_product(
+        [pd.to_datetime(dates), changes['product_sku'].unique()], names=['snapshot_date', 'product_sku']
+    ).to_frame(index=False).sort_values('snapshot_date')
+    dense = pd.merge_asof(
+        grid, changes.sort_values('snapshot_date'),
+        on='snapshot_date', by='product_sku', direction='backward'
+    )
+    dense = dense[dense['removed'].eq(False)]
+    dense['snapshot_date'] = dense['snapshot_date'].dt.date.astype(str)
+    return dense.sort_values(['product_sku', 'snapshot_date'])[columns].reset_index(drop=True)
+
+
+def stock_as_of(snapshot_date=None, skus: list = None) -> pd.DataFrame:
+    """State of every (or the given) SKU on a date: the latest change on or before it"""
+    changes = _read_changes(skus, _as_date(snapshot_date) if snapshot_date else None)
+    if changes.empty:
+        return pd.DataFrame(columns=['product_sku'] + HISTORY_COLUMNS + ['snapshot_date'])
+    latest = changes.sort_values('snapshot_date').drop_duplicates('product_sku', keep='last')
+    latest = latest[~latest['removed'].fillna(False).astype(bool)]
+    return latest[['product_sku'] + HISTORY_COLUMNS + ['snapshot_date']].reset_index(drop=True)
+
+
+def find_history_skus(term: str) -> tuple:
+    """
+    Resolve a search term to SKUs: an exact SKU, then a category, then a
+    partial SKU/product-name match against the latest base_stock.
+    Returns (skus, search_type).
+    """
+    exact = execute_query(f"SELECT product_sku FROM {HISTORY_TABLE} WHERE product_sku = :term LIMIT 1", {'term': term})
+    if not exact.empty:
+        return [term], 'sku'
+    by_category = _read("SELECT product_sku FROM base_stock WHERE category = :term", {'term': term})
+    if not by_category.empty:
+        return by_category['product_sku'].tolist(), 'category'
+    pattern = f"%{term}%"
+    by_sku = _read("SELECT product_sku FROM base_stock WHERE product_sku ILIKE :p", {'p': pattern})
+    by_name = _read("SELECT product_sku FROM base_stock WHERE product_name ILIKE :p", {'p': pattern})
+    matches = pd.concat([by_sku, by_name], ignore_index=True)
+    if matches.empty:
+        return [], 'unknown'
+    return matches['product_sku'].drop_duplicates().tolist(), 'sku'